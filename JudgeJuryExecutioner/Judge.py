@@ -1,76 +1,313 @@
 from prompts import COMPARE_INTENT_PROMPT, ABSTRACT_CODE_PROMPT, VALIDATE_WITH_CONTEXT_PROMPT
+from prompts import COMPARE_INTENT_INPUT, COMPARE_INTENT_DELTA, ABSTRACT_CODE_TARGET, ABSTRACT_CODE_INPUT
+from prompts import VALIDATE_WITH_CONTEXT_TARGET, VALIDATE_WITH_CONTEXT_RELATED, VALIDATE_WITH_CONTEXT_INPUT
 from sys_prompts import SYS_COMPARE_INTENT_PROMPT, SYS_ABSTRACT_CODE_PROMPT, SYS_VALIDATE_WITH_CONTEXT_PROMPT
 from parser import repair_json
-from openai import OpenAI
-from dotenv import load_dotenv
-import os
+from abstraction import MapReduceAbstractor, estimate_tokens
+from backends import default_backend, DEFAULT_SEED
+from semdiff import differ
+from targets import related_code
+import metrics
+import hooks
 import time
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-load_dotenv()
+# room left in the context window for the answer
+ANSWER_RESERVE = 8000
+# sampling temperature of the validation votes, a single validation call stays at 0
+VOTE_TEMPERATURE = 0.7
+
+class JudgeCancelled(Exception):
+    """Raised between stages when the caller no longer needs the result (fail-fast)"""
 
-BASE_URL = os.getenv("BASE_URL")
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 
 class Judge:
-    def __init__(self):
-        """Initialize OpenAI client for OpenRouter"""
-        self.client = OpenAI(
-            base_url=BASE_URL,
-            api_key=OPENROUTER_API_KEY,
-        )
-
-    def _call_api(self, model, system_prompt, prompt, temperature=0):
-        """Generic API call helper"""
-        response = self.client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}],
-            seed=2025,
-            temperature=temperature,
-        )
-        return response.choices[0].message.content
+    # observed latency and token usage of all model calls of this process, shared by every Judge instance
+    call_stats = {"calls": 0, "seconds": 0.0, "paused_seconds": 0.0, "prompt_tokens": 0, "cached_tokens": 0,
+                  "completion_tokens": 0}
+    _stats_lock = threading.Lock()
+    # send a locally computed per-symbol delta instead of both raw patches to compare_intent (--semantic-diff)
+    semantic_diff = False
+    # validation calls per file whose majority is_correct wins (--votes), 1 is the single call at temperature 0
+    votes = 1
+    vote_stats = {"files": 0, "votes": 0, "calls": 0, "skipped": 0, "unanimous": 0, "agreement": 0.0}
+
+    def __init__(self, backend=None):
+        """Use the given backend, or the one configured for the run (OpenRouter by default)"""
+        self.backend = backend or default_backend()
+
+    @classmethod
+    def settings(cls):
+        """Class wide switches that change the prompts or the verdicts, every new one belongs here"""
+        return {"semantic_diff": cls.semantic_diff, "votes": cls.votes}
+
+    def _call_api(self, stage, system_prompt, prompt, temperature=0, json_output=False, seed=None):
+        """
+        Generic API call helper. stage picks the model through the backend,
+        prompt is a string or a list of (text, cache_breakpoint) parts.
+        """
+        model = self.backend.model_for(stage)
+        hooks.emit("before_call", stage=stage, model=model)
+        metrics.MODEL_IN_FLIGHT.inc(model, stage)
+        start = time.perf_counter()
+        try:
+            completion = self.backend.complete(stage, system_prompt, prompt, temperature=temperature, json_output=json_output,
+                                               seed=seed)
+        except Exception as e:
+            metrics.MODEL_FAILURES.inc(model, stage, type(e).__name__)
+            raise
+        finally:
+            metrics.MODEL_IN_FLIGHT.dec(model, stage)
+        seconds = time.perf_counter() - start
+        self._record_usage(completion, seconds, model, stage)
+        hooks.emit("after_call", stage=stage, model=model, content=completion.content, seconds=seconds)
+        return completion.content
+
+    def _record_usage(self, completion, seconds, model, stage):
+        metrics.MODEL_CALLS.inc(model, stage)
+        metrics.MODEL_LATENCY.observe(seconds, model, stage)
+        metrics.PROMPT_TOKENS.inc(model, amount=completion.prompt_tokens)
+        metrics.CACHED_TOKENS.inc(model, amount=completion.cached_tokens)
+        metrics.COMPLETION_TOKENS.inc(model, amount=completion.completion_tokens)
+        with self._stats_lock:
+            self.call_stats["calls"] += 1
+            self.call_stats["seconds"] += seconds
+            self.call_stats["prompt_tokens"] += completion.prompt_tokens
+            self.call_stats["completion_tokens"] += completion.completion_tokens
+            self.call_stats["cached_tokens"] += completion.cached_tokens
+
+    @classmethod
+    def usage_report(cls):
+        stats = cls.call_stats
+        if not stats["calls"]:
+            return
+        cached_share = stats["cached_tokens"] / stats["prompt_tokens"] * 100 if stats["prompt_tokens"] else 0
+        print(f"Model calls: {stats['calls']}, {stats['seconds']:.1f}s, prompt tokens {stats['prompt_tokens']} "
+              f"({stats['cached_tokens']} cached, {cached_share:.1f}%), completion tokens {stats['completion_tokens']}")
+
+    @classmethod
+    def seconds_per_call(cls, default=15.0):
+        """Average observed call latency plus the average pause kept after a call"""
+        if not cls.call_stats["calls"]:
+            return default
+        return (cls.call_stats["seconds"] + cls.call_stats["paused_seconds"]) / cls.call_stats["calls"]
+
+    @classmethod
+    def _compare_prompt(cls, upstream_patch, backported_patch):
+        delta = differ.delta(upstream_patch, backported_patch) if cls.semantic_diff else None
+        if delta is not None:
+            return [
+                (COMPARE_INTENT_PROMPT, True),
+                (COMPARE_INTENT_DELTA.format(path=upstream_patch.path, delta=delta), False),
+            ]
+        return [
+            (COMPARE_INTENT_PROMPT, True),
+            (COMPARE_INTENT_INPUT.format(upstream_patch=upstream_patch, backported_patch=backported_patch), False),
+        ]
 
     def compare_intent(self, upstream_patch, backported_patch):
         system_prompt = SYS_COMPARE_INTENT_PROMPT
+        hooks.emit("before_stage", stage="compare", path=backported_patch.path)
+        start = time.perf_counter()
         
-        prompt = COMPARE_INTENT_PROMPT.format(
-            upstream_patch=upstream_patch,
-            backported_patch=backported_patch
-        )
-        raw_response = self._call_api("deepseek/deepseek-r1:free", system_prompt, prompt)
+        prompt = self._compare_prompt(upstream_patch, backported_patch)
+        raw_response = self._call_api("compare", system_prompt, prompt, json_output=True)
         
-        return repair_json(raw_response)
+        result = repair_json(raw_response)
+        hooks.emit("after_stage", stage="compare", path=backported_patch.path, result=result, seconds=time.perf_counter() - start)
+        return result
+
+    @staticmethod
+    def _abstract_prompt(target_code, backport_patch):
+        # the target code is shared by every file pair of a sample that touches it, so it goes before the patch
+        return [
+            (ABSTRACT_CODE_PROMPT, True),
+            (ABSTRACT_CODE_TARGET.format(target_code=target_code), True),
+            (ABSTRACT_CODE_INPUT.format(backport_patch=backport_patch), False),
+        ]
 
     def abstract_code_context(self, target_code, backport_patch):
         system_prompt = SYS_ABSTRACT_CODE_PROMPT
+        hooks.emit("before_stage", stage="abstract", path=backport_patch.path)
+        start = time.perf_counter()
         
-        prompt = ABSTRACT_CODE_PROMPT.format(
-            target_code=target_code,
-            backport_patch=backport_patch
-        )
-        
-        return self._call_api("deepseek/deepseek-chat:free", system_prompt, prompt)
+        prompt = self._abstract_prompt(target_code, backport_patch)
+
+        # too large for the model: abstract definition sized chunks in parallel and merge them
+        prompt_size = estimate_tokens(system_prompt + "".join(text for text, _ in prompt))
+        if prompt_size > self.backend.capabilities("abstract")["context"] - ANSWER_RESERVE:
+            abstractor = MapReduceAbstractor(self._abstract_chunk, self.backend.model_for("abstract"))
+            result = abstractor.abstract(target_code, backport_patch)
+        else:
+            result = self._call_api("abstract", system_prompt, prompt)
+
+        hooks.emit("after_stage", stage="abstract", path=backport_patch.path, result=result, seconds=time.perf_counter() - start)
+        return result
+
+    def _abstract_chunk(self, target_code, backport_patch):
+        return self._call_api("abstract", SYS_ABSTRACT_CODE_PROMPT, self._abstract_prompt(target_code, backport_patch))
 
-    def validate_with_context(self, discrepancies, backported_patch, target_code):
+    @staticmethod
+    def _validate_prompt(discrepancies, backported_patch, target_code, related=None):
+        # related: cross-file context of the target tree, differs per file so it comes after the cached target
+        prompt = [
+            (VALIDATE_WITH_CONTEXT_PROMPT, True),
+            (VALIDATE_WITH_CONTEXT_TARGET.format(target_code=target_code), True),
+        ]
+        if related:
+            prompt.append((VALIDATE_WITH_CONTEXT_RELATED.format(related_code=related), False))
+        prompt.append((VALIDATE_WITH_CONTEXT_INPUT.format(discrepancies=discrepancies, backported_patch=backported_patch), False))
+        return prompt
+
+    def validate_with_context(self, discrepancies, backported_patch, target_code, related=None):
         system_prompt = SYS_VALIDATE_WITH_CONTEXT_PROMPT
         
-        prompt = VALIDATE_WITH_CONTEXT_PROMPT.format(
-            discrepancies=discrepancies,
-            backported_patch=backported_patch,
-            target_code=target_code
-        )
-        raw_response = self._call_api("google/gemini-2.0-pro-exp-02-05:free", system_prompt, prompt)
+        hooks.emit("before_stage", stage="validate", path=backported_patch)
+        start = time.perf_counter()
 
-        return repair_json(raw_response)
+        prompt = self._validate_prompt(discrepancies, backported_patch, target_code, related)
+        if self.votes > 1:
+            result = self._validate_by_vote(system_prompt, prompt)
+        else:
+            result = repair_json(self._call_api("validate", system_prompt, prompt, json_output=True))
+
+        hooks.emit("after_stage", stage="validate", path=backported_patch, result=result, seconds=time.perf_counter() - start)
+        return result
+
+    def _validate_by_vote(self, system_prompt, prompt):
+        """
+        Self-consistency: up to self.votes validation calls, each sampled with its own seed. Only as many
+        votes run at once as could still settle the majority is_correct (a majority of self.votes at
+        first), more are sent while the outcome is open. Stops as soon as the remaining votes can no
+        longer change the majority; the rest is never sent and answers still running are ignored.
+        Ties go to "No". Returns the first answer of the majority with its agreement, e.g. "3/3".
+        """
+        counts = Counter()
+        first_answers = {}
+        failures = []
+        running = set()
+        sent = 0
+        pool = ThreadPoolExecutor(max_workers=self.votes)
+        try:
+            while True:
+                ranked = counts.most_common(2)
+                lead = ranked[0][1] - (ranked[1][1] if len(ranked) > 1 else 0) if ranked else 0
+                remaining = self.votes - sum(counts.values()) - len(failures)
+                if lead > remaining:
+                    break
+                # votes the leader still needs to settle the outcome, if all of them agree with it
+                needed = (remaining - lead) // 2 + 1
+                while len(running) < needed and sent < self.votes:
+                    running.add(pool.submit(self._call_api, "validate", system_prompt, prompt, VOTE_TEMPERATURE, True,
+                                            DEFAULT_SEED + sent))
+                    sent += 1
+                if not running:
+                    break
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    try:
+                        answer = repair_json(future.result())
+                    except Exception as e:
+                        failures.append(e)
+                        continue
+                    verdict = answer.get("is_correct", "Unknown") if isinstance(answer, dict) else "Unknown"
+                    counts[verdict] += 1
+                    first_answers.setdefault(verdict, answer)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        if not counts:
+            raise failures[-1]
+
+        winner = max(counts, key=lambda verdict: (counts[verdict], verdict == "No"))
+        answered = sum(counts.values())
+        with self._stats_lock:
+            self.vote_stats["files"] += 1
+            self.vote_stats["votes"] += self.votes
+            self.vote_stats["calls"] += answered + len(failures)
+            self.vote_stats["skipped"] += self.votes - answered - len(failures)
+            self.vote_stats["unanimous"] += len(counts) == 1
+            self.vote_stats["agreement"] += counts[winner] / answered
+
+        result = first_answers[winner]
+        if isinstance(result, dict):
+            result = dict(result, agreement=f"{counts[winner]}/{answered}")
+        return result
+
+    @classmethod
+    def vote_report(cls):
+        stats = cls.vote_stats
+        if not stats["files"]:
+            return
+        print(f"Validation votes: {stats['files']} file(s), {stats['calls']} of {stats['votes']} votes waited for "
+              f"({stats['skipped']} not sent or ignored), {stats['unanimous']} unanimous, "
+              f"mean agreement {stats['agreement'] / stats['files'] * 100:.0f}%")
+
+    #### batch rendering: the same requests as above, rendered instead of sent ####
+
+    def render_compare(self, upstream_patch, backported_patch):
+        return self.backend.request_body("compare", SYS_COMPARE_INTENT_PROMPT,
+                                         self._compare_prompt(upstream_patch, backported_patch), json_output=True)
+
+    def render_abstract(self, target_code, backport_patch):
+        """None when the target needs a map-reduce abstraction, which cannot be rendered as a single request"""
+        prompt = self._abstract_prompt(target_code, backport_patch)
+        prompt_size = estimate_tokens(SYS_ABSTRACT_CODE_PROMPT + "".join(text for text, _ in prompt))
+        if prompt_size > self.backend.capabilities("abstract")["context"] - ANSWER_RESERVE:
+            return None
+        return self.backend.request_body("abstract", SYS_ABSTRACT_CODE_PROMPT, prompt)
+
+    def render_validate(self, discrepancies, backported_patch, target_code, related=None):
+        return self.backend.request_body("validate", SYS_VALIDATE_WITH_CONTEXT_PROMPT,
+                                         self._validate_prompt(discrepancies, backported_patch, target_code, related),
+                                         json_output=True)
+
+    @staticmethod
+    def verdict_from_discrepancies(discrepancies):
+        """Turn a compare_intent answer into a validate_with_context shaped result"""
+        if not isinstance(discrepancies, dict):
+            return {"is_correct": "Unknown", "difference_type": "Unknown",
+                    "explanation": f"Unparsable intent comparison: {discrepancies}", "suggested_fixes": ""}
+
+        found = discrepancies.get("discrepancies") or []
+        risky = "Yes" in (discrepancies.get("security_risk"), discrepancies.get("functionality_risk"))
+        return {
+            "is_correct": "No" if risky else "Yes",
+            "difference_type": "Major" if risky else ("Minor" if found else "None"),
+            "explanation": "; ".join(str(item) for item in found) or "No discrepancies found by the intent comparison.",
+            "suggested_fixes": ""
+        }
+
+    def pause(self, stage, cancel_event=None):
+        """
+        Wait after a call of stage as long as the backend asks for (the model's rpm), waking up
+        early and raising JudgeCancelled once cancel_event is set
+        """
+        seconds = self.backend.pause_after(stage)
+        if not seconds:
+            return
+        with self._stats_lock:
+            self.call_stats["paused_seconds"] += seconds
+        if cancel_event is None:
+            time.sleep(seconds)
+        elif cancel_event.wait(seconds):
+            raise JudgeCancelled()
 
     # Process function
-    def process_backport(self, upstream_file, backported_file, target_code):
+    def process_backport(self, upstream_file, backported_file, target_code, cancel_event=None):
         discrepancies = self.compare_intent(upstream_file, backported_file)
-        time.sleep(3)
+        self.pause("compare", cancel_event)
         abstract_code = self.abstract_code_context(target_code, backported_file)
-        time.sleep(3)
-        result = self.validate_with_context(discrepancies, backported_file.path, abstract_code)
-        time.sleep(3)
+        self.pause("abstract", cancel_event)
+        result = self.validate_with_context(discrepancies, backported_file.path, abstract_code, related_code(backported_file))
+        self.pause("validate")
         
         return result
+
+    def process_backport_cheap(self, upstream_file, backported_file, cancel_event=None):
+        """Cheap path for docs and generated files: intent comparison only, no abstraction or validation"""
+        discrepancies = self.compare_intent(upstream_file, backported_file)
+        self.pause("compare", cancel_event)
+
+        return self.verdict_from_discrepancies(discrepancies)
@@ -1,13 +1,48 @@
 import os
+import json
+import time
+import queue
+import socket
+import argparse
+import importlib
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, CancelledError, as_completed
 from unidiff import PatchSet
-from Judge import Judge
-from parser import create_csv, compare_verdicts, get_file_from_path , print_to_txt, write_verification_results_txt
+from Judge import Judge, JudgeCancelled
+from backends import BACKENDS, configure_default_backend, parse_stage_models, default_backend
+from parser import repair_json, create_csv, compare_verdicts, get_file_from_path , print_to_txt, write_verification_results_txt
+from resilience import report as resilience_report
+from sharding import select_samples, shard_output_path, merge_shards, parse_ranges
+from scheduler import CostModel, lpt_schedule, LATENCY_HISTORY_FILE
+from planner import plan_run, rate_limits
+from pipeline import StagedPipeline, PipelineItem, stage_pool_sizes, PROGRESS_SECONDS
+from daemon import serve, DEFAULT_ADDRESS
+import metrics
+import hooks
+from profiling import SampleProfiler, PROFILE_DIR
+from semdiff import differ
+from targets import target_provider, sample_target, blob_cache_report, attach_related_code, related_code
+from symbols import configure_symbol_index, symbol_index, SYMBOL_INDEX_FILE
+from symbols import report as symbol_index_report
+from retrieval import configure_retrieval, retriever, RETRIEVAL_INDEX_DIR, TOP_K
+from retrieval import report as retrieval_report
+from cassette import report as cassette_report
+from fingerprints import ResultStore, file_fingerprint, RESULT_CACHE_FILE
+from prefilter import PreClassifier, ROUTE_SKIP, ROUTE_LOCAL, ROUTE_CHEAP, ROUTE_FULL, ROUTE_CALLS
+from trivia import LOCAL_RESULT
+from hunks import judge_in_hunk_groups
+from task_queue import TaskQueue, LeaseKeeper, STAGE_COMPARE, STAGE_ABSTRACT, STAGE_VALIDATE
+from batch import BatchWriter, BATCH_DIR, STAGE12, STAGE3, batch_path, clear_results, write_manifest, read_manifest, read_results
+from batch import submit, fetch
 
 
 VERDICTS_CSV_FILE = r"samples/verdicts.csv"  
 OUTPUT_CSV_FILE = r"samples/verdicts_JudgeJuryExecutioner.csv"
 OUTPUT_FILE = "verification_results.txt"
+RESULT_STORE_FILE = "functions.txt"
 SAMPLES_DIR = "samples"
+DEFAULT_INCLUDE = "20-"     # for testing purposes
 
 def get_verdict(result):
     """Determines the verdict based on the 'is_correct' field in result for both dict and str result"""
@@ -22,74 +57,829 @@ def get_verdict(result):
 
     return "unknown" 
 
-def process_patches(upstream_patch_file, backported_patch_file, base_directory, output_file, sample):
+def skipped_result(reason):
+    """Placeholder result for a file that was not evaluated (fail-fast)"""
+    return {
+        "is_correct": "Skipped",
+        "difference_type": "None",
+        "explanation": f"Not evaluated: {reason}",
+        "suggested_fixes": ""
+    }
+
+def failed_result(error):
     """
-    Process patches and verify them.
-    Save results to a .txt file.
+    Result for a file whose model calls still failed after all retries, so the run can go on.
+    error is the exception, or the error text a queue task stored
+    """
+    return {
+        "is_correct": "Unknown",
+        "difference_type": "Unknown",
+        "explanation": error if isinstance(error, str) else f"Model call failed: {type(error).__name__}: {error}",
+        "suggested_fixes": ""
+    }
+
+def collect_file_pairs(upstream_patch_file, backported_patch_file, base_directory, classifier=None):
+    """
+    Parse both patches and return (upstream_file, backported_file, target_code, route) for every file
+    that should be judged. The pre-classifier drops files routed to skip before anything else happens.
+    With a symbol index or a retriever, full route files get the cross-file context of the target tree attached.
     """
+    if classifier is None:
+        classifier = PreClassifier()
+
     # Step 1: Parse patch files using unidiff
+    hooks.emit("before_parse", upstream_patch=upstream_patch_file, backported_patch=backported_patch_file)
+    parse_start = time.perf_counter()
     with open(upstream_patch_file, 'r') as f:
         upstream_patch = PatchSet(f)
     with open(backported_patch_file, 'r') as f:
         backported_patch = PatchSet(f)
 
     # Step 2: Process each file in the upstream patch
-    results = []
-    verdict = "correct"
+    targets = target_provider(base_directory)
+    index, tree = symbol_index(), None
+    lexical, lexical_index = retriever(), None
+    file_pairs = []
     for upstream_file in upstream_patch:
-        if upstream_file.path.endswith(".rst"):
-            continue
-        
-        # Step 3: Find the corresponding file in the backported patch
+        # Step 3: Find the corresponding file in the backported patch and classify the pair
         backported_file = get_file_from_path(backported_patch, upstream_file.path)
+        route, _ = classifier.classify(upstream_file, backported_file, (backported_file or upstream_file).path, targets)
+        if route == ROUTE_SKIP:
+            continue
+
         if not backported_file:
             print(f"Warning: File {upstream_file.path} not found in backported patch.")
             continue
 
         # Step 4: Read the target code
-        full_path = os.path.join(base_directory, backported_file.path)
-        if not os.path.exists(full_path):
-            print(f"Warning: File {full_path} does not exist in the base directory.")
+        if not targets.exists(backported_file.path):
+            print(f"Warning: File {targets.describe(backported_file.path)} does not exist in the target.")
             continue
-        target_code = open(full_path, 'r').read()
-        
-        # step 5: judge and write down the results 
-        judge = Judge()
-        
-        result = judge.process_backport(upstream_file, backported_file, target_code)
-        print_to_txt("functions.txt", backported_file.path, result)
-        
+        target_code = targets.read_text(backported_file.path)
+        route = classifier.resolve_locally(upstream_file, backported_file, route)
+        if index is not None and route == ROUTE_FULL:
+            tree = tree or index.index_tree(targets)
+            attach_related_code(backported_file, index.related(tree, backported_file))
+        if lexical is not None and route == ROUTE_FULL:
+            lexical_index = lexical_index or lexical.index_for(targets)
+            attach_related_code(backported_file, lexical.related(lexical_index, backported_file))
+
+        file_pairs.append((upstream_file, backported_file, target_code, route))
+
+    hooks.emit("after_parse", upstream_patch=upstream_patch_file, backported_patch=backported_patch_file,
+               file_pairs=file_pairs, seconds=time.perf_counter() - parse_start)
+    return file_pairs
+
+def sample_verdict(results):
+    """
+    A sample is incorrect as soon as one of its files is, and unknown when none is incorrect
+    but a file could not be judged (its model calls failed or its answer is not a verdict)
+    """
+    verdict = "correct"
+    for result in results:
+        if get_verdict(result["result"]) == "incorrect":
+            return "incorrect"
+        if not isinstance(result["result"], dict) or result["result"].get("is_correct") == "Unknown":
+            verdict = "unknown"
+    return verdict
+
+def record_results(sample, verdict, results):
+    """Metrics and on_result hooks of a finished sample"""
+    metrics.SAMPLES.inc(verdict)
+    for result in results:
+        is_correct = result["result"].get("is_correct", "Unknown") if isinstance(result["result"], dict) else "Unknown"
+        metrics.FILES.inc(is_correct)
+        hooks.emit("on_result", sample=sample, file_path=result["file_path"], result=result["result"])
+
+def finalize_sample(sample, results, output_file, csv_file):
+    """Derive the sample verdict from the per-file results and append it to the CSV and txt files"""
+    verdict = sample_verdict(results)
+    record_results(sample, verdict, results)
+    if verdict == "unknown":
+        print(f"Warning: Sample {sample} has files that could not be judged, its verdict is unknown.")
+
+    create_csv(csv_file, sample, verdict)
+    write_verification_results_txt(output_file, sample, verdict, results)
+    print(f"Results saved to {output_file}")
+
+def judging_config(route, hunk_group_size=None):
+    """What besides the patches and the target decides a file's result, part of its fingerprint"""
+    return json.dumps({"route": route, "models": default_backend().stage_models, "split_hunks": hunk_group_size,
+                       **Judge.settings()}, sort_keys=True)
+
+def judge_file(judge, upstream_file, backported_file, target_code, route, cancel_event=None, hunk_group_size=None):
+    """
+    Run the model calls of the route the pre-classifier picked.
+    Full route files with more than hunk_group_size hunks are judged in concurrent hunk groups.
+    """
+    if route == ROUTE_LOCAL:
+        return dict(LOCAL_RESULT)
+    if route == ROUTE_CHEAP:
+        return judge.process_backport_cheap(upstream_file, backported_file, cancel_event)
+    if hunk_group_size and len(upstream_file) > hunk_group_size:
+        return judge_in_hunk_groups(judge, upstream_file, backported_file, target_code, hunk_group_size, cancel_event)
+    return judge.process_backport(upstream_file, backported_file, target_code, cancel_event)
+
+def process_patches(upstream_patch_file, backported_patch_file, base_directory, output_file, sample,
+                    csv_file=OUTPUT_CSV_FILE, result_store_file=RESULT_STORE_FILE, fail_fast=False, classifier=None,
+                    hunk_group_size=None, fingerprint_store=None):
+    """
+    Process patches and verify them.
+    Save results to a .txt file.
+    With fail_fast, files left after the first incorrect one are recorded as skipped instead of judged.
+    With a fingerprint_store, files whose fingerprint did not change since the last run keep their stored result.
+    """
+    judge = Judge()
+    hooks.emit("before_sample", sample=sample)
+    start = time.perf_counter()
+
+    results = []
+    failed_file = None
+    file_pairs = collect_file_pairs(upstream_patch_file, backported_patch_file, base_directory, classifier)
+    for upstream_file, backported_file, target_code, route in file_pairs:
+        if failed_file:
+            results.append({
+                "file_path": backported_file.path,
+                "result": skipped_result(f"fail-fast, {failed_file} was judged incorrect")
+            })
+            continue
+
+        # judge and write down the results 
+        result = None
+        if fingerprint_store is not None:
+            fingerprint = file_fingerprint(upstream_file, backported_file, target_code, judging_config(route, hunk_group_size))
+            result = fingerprint_store.lookup(sample, backported_file.path, fingerprint)
+        if result is None:
+            try:
+                result = judge_file(judge, upstream_file, backported_file, target_code, route, hunk_group_size=hunk_group_size)
+            except Exception as e:
+                print(f"Warning: Judging {backported_file.path} of sample {sample} failed: {e}")
+                result = failed_result(e)
+            if fingerprint_store is not None:
+                fingerprint_store.record(sample, backported_file.path, fingerprint, result)
+        print_to_txt(result_store_file, backported_file.path, result)
+        if fail_fast and get_verdict(result) == "incorrect":
+            failed_file = backported_file.path
         
         results.append({
             "file_path": backported_file.path,
             "result": result
         })
 
-        if get_verdict(result) == "incorrect":
-            verdict = "incorrect"
+    # Append result to CSV file and txt file    
+    finalize_sample(sample, results, output_file, csv_file)
+    hooks.emit("after_sample", sample=sample, verdict=sample_verdict(results), seconds=time.perf_counter() - start)
 
+def judge_timed(judge, upstream_file, backported_file, target_code, route, cancel_event=None, hunk_group_size=None):
+    start = time.perf_counter()
+    result = judge_file(judge, upstream_file, backported_file, target_code, route, cancel_event, hunk_group_size)
+    return result, time.perf_counter() - start
 
-    # Step 5: Append result to CSV file and txt file    
-    create_csv(OUTPUT_CSV_FILE, sample, verdict)
-    write_verification_results_txt(output_file, sample, verdict, results)
-    print(f"Results saved to {output_file}")
+def run_scheduled(sample_folders, workers, output_file, csv_file, result_store_file, cost_model, fail_fast=False,
+                  classifier=None, hunk_group_size=None, fingerprint_store=None):
+    """
+    Judge the (sample, file) pairs of all samples on a pool of workers, longest estimated job first.
+    A sample is finalized as soon as its last file is judged. Reports estimated vs actual makespan.
+    With fail_fast, the first incorrect file of a sample cancels its queued files and stops its
+    in-flight ones at the next stage boundary; those files are recorded as skipped.
+    With a fingerprint_store, unchanged files keep their stored result and are not scheduled at all.
+    """
+    judge = Judge()
 
-def main():
-    
-    sample_folders = [f for f in os.listdir(SAMPLES_DIR) if os.path.isdir(os.path.join(SAMPLES_DIR, f)) and not f.endswith(".csv")]
+    # Step 1: collect every pair of the run, reuse stored results and estimate the cost of the rest
+    jobs = {}
+    fingerprints = {}
+    pending_files = {}
+    results = {sample: [] for sample in sample_folders}
+    failed_files = {}
+    costs = []
+    for sample in sample_folders:
+        file_pairs = collect_file_pairs(*sample_paths(sample), classifier)
+        pending_files[sample] = len(file_pairs)
+        for upstream_file, backported_file, target_code, route in file_pairs:
+            job = (sample, backported_file.path)
+            if fingerprint_store is not None:
+                fingerprints[job] = file_fingerprint(upstream_file, backported_file, target_code,
+                                                     judging_config(route, hunk_group_size))
+                stored = fingerprint_store.lookup(sample, backported_file.path, fingerprints[job])
+                if stored is not None:
+                    print_to_txt(result_store_file, backported_file.path, stored)
+                    results[sample].append({"file_path": backported_file.path, "result": stored})
+                    pending_files[sample] -= 1
+                    if fail_fast and get_verdict(stored) == "incorrect":
+                        failed_files.setdefault(sample, backported_file.path)
+                    continue
+            jobs[job] = (upstream_file, backported_file, target_code, route)
+            cost = cost_model.estimate(sample, upstream_file, backported_file, target_code)
+            costs.append((job, cost * ROUTE_CALLS[route] / ROUTE_CALLS[ROUTE_FULL]))
+
+    # a stored incorrect file already decides its sample under fail-fast
+    for job in [job for job in jobs if job[0] in failed_files]:
+        del jobs[job]
+        results[job[0]].append({"file_path": job[1], "result": skipped_result(f"fail-fast, {failed_files[job[0]]} was judged incorrect")})
+        pending_files[job[0]] -= 1
+    costs = [(job, cost) for job, cost in costs if job in jobs]
+
+    order, _, estimated_makespan = lpt_schedule(costs, workers)
+    print(f"Scheduled {len(order)} files of {len(sample_folders)} samples on {workers} workers, "
+          f"estimated makespan {estimated_makespan:.1f}s")
+
+    for sample, count in pending_files.items():
+        if count == 0:
+            finalize_sample(sample, results[sample], output_file, csv_file)
+
+    # Step 2: dispatch longest first, the pool hands each job to the next free worker
+    cancel_events = {sample: threading.Event() for sample in sample_folders}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(judge_timed, judge, *jobs[job], cancel_events[job[0]], hunk_group_size): job
+                   for job in order}
+        for future in as_completed(futures):
+            sample, file_path = futures[future]
+            try:
+                result, seconds = future.result()
+            except (CancelledError, JudgeCancelled):
+                result = skipped_result(f"fail-fast, {failed_files[sample]} was judged incorrect")
+            except Exception as e:
+                print(f"Warning: Judging {file_path} of sample {sample} failed: {e}")
+                result = failed_result(e)
+                print_to_txt(result_store_file, file_path, result)
+            else:
+                upstream_file, backported_file, target_code, route = jobs[(sample, file_path)]
+                if route == ROUTE_FULL:
+                    cost_model.record(sample, file_path, CostModel.size_of(upstream_file, backported_file, target_code), seconds)
+                print_to_txt(result_store_file, file_path, result)
+                if fingerprint_store is not None:
+                    fingerprint_store.record(sample, file_path, fingerprints[(sample, file_path)], result)
+
+                if fail_fast and get_verdict(result) == "incorrect" and sample not in failed_files:
+                    failed_files[sample] = file_path
+                    cancel_events[sample].set()
+                    for other_future, (other_sample, _) in futures.items():
+                        if other_sample == sample:
+                            other_future.cancel()
+
+            results[sample].append({"file_path": file_path, "result": result})
+            pending_files[sample] -= 1
+            if pending_files[sample] == 0:
+                finalize_sample(sample, results[sample], output_file, csv_file)
 
-    # process each sample file sequentially
+    actual_makespan = time.perf_counter() - start
+    cost_model.save()
+    print(f"Makespan: estimated {estimated_makespan:.1f}s, actual {actual_makespan:.1f}s")
+
+def run_pipelined(sample_folders, output_file, csv_file, result_store_file, stage_workers, fail_fast=False,
+                  classifier=None, fingerprint_store=None):
+    """
+    Judge all files through the staged pipeline, one worker pool per stage model, finalizing each
+    sample as soon as its last file comes out. Queue depths and utilization are printed as it runs.
+    With a fingerprint_store, unchanged files keep their stored result and never enter the pipeline.
+    """
+    pipeline = StagedPipeline(Judge(), stage_workers)
+    print(f"Pipeline workers: {stage_workers}")
+
+    results = {sample: [] for sample in sample_folders}
+    pending_files = {}
+    items = []
     for sample in sample_folders:
-        if int(sample.lstrip("0")) < 20:        # for testing purposes
+        file_pairs = collect_file_pairs(*sample_paths(sample), classifier)
+        pending_files[sample] = len(file_pairs)
+        if not file_pairs:
+            finalize_sample(sample, results[sample], output_file, csv_file)
+        items.extend(PipelineItem(sample, *file_pair) for file_pair in file_pairs)
+
+    def finish(sample, file_path, result):
+        results[sample].append({"file_path": file_path, "result": result})
+        pending_files[sample] -= 1
+        if pending_files[sample] == 0:
+            finalize_sample(sample, results[sample], output_file, csv_file)
+
+    # local route and unchanged files need no model, the rest is fed from a thread since the stage queues are bounded
+    failed_files = {}
+    fingerprints = {}
+    remote_items = []
+    for item in items:
+        file_path = item.backported_file.path
+        if item.route == ROUTE_LOCAL:
+            finish(item.sample, file_path, dict(LOCAL_RESULT))
             continue
+        if fingerprint_store is not None:
+            fingerprints[(item.sample, file_path)] = file_fingerprint(item.upstream_file, item.backported_file,
+                                                                      item.target_code, judging_config(item.route))
+            stored = fingerprint_store.lookup(item.sample, file_path, fingerprints[(item.sample, file_path)])
+            if stored is not None:
+                print_to_txt(result_store_file, file_path, stored)
+                if fail_fast and get_verdict(stored) == "incorrect":
+                    failed_files.setdefault(item.sample, file_path)
+                finish(item.sample, file_path, stored)
+                continue
+        remote_items.append(item)
+    for item in [item for item in remote_items if item.sample in failed_files]:
+        remote_items.remove(item)
+        finish(item.sample, item.backported_file.path,
+               skipped_result(f"fail-fast, {failed_files[item.sample]} was judged incorrect"))
+    pipeline.start()
+    feeder = threading.Thread(target=lambda: [pipeline.submit(item) for item in remote_items], daemon=True)
+    feeder.start()
+
+    last_report = time.perf_counter()
+    for _ in remote_items:
+        while True:
+            try:
+                item, result, error = pipeline.done.get(timeout=5)
+                break
+            except queue.Empty:
+                if time.perf_counter() - last_report >= PROGRESS_SECONDS:
+                    pipeline.report()
+                    last_report = time.perf_counter()
+
+        file_path = item.backported_file.path
+        if isinstance(error, JudgeCancelled):
+            result = skipped_result(f"fail-fast, {failed_files[item.sample]} was judged incorrect")
+        elif error is not None:
+            print(f"Warning: Judging {file_path} of sample {item.sample} failed: {error}")
+            result = failed_result(error)
+            print_to_txt(result_store_file, file_path, result)
+        else:
+            print_to_txt(result_store_file, file_path, result)
+            if fail_fast and get_verdict(result) == "incorrect" and item.sample not in failed_files:
+                failed_files[item.sample] = file_path
+                pipeline.cancel(item.sample)
+        if fingerprint_store is not None:
+            fingerprint_store.record(item.sample, file_path, fingerprints[(item.sample, file_path)], result)
+        finish(item.sample, file_path, result)
+
+    feeder.join()
+    pipeline.close()
+    pipeline.report(final=True)
+
+def sample_paths(sample):
+    """upstream patch, backported patch and target (directory or target.json) of a sample folder"""
+    return (
+        os.path.join(SAMPLES_DIR, sample, "upstream.patch"),
+        os.path.join(SAMPLES_DIR, sample, "backporter.patch"),
+        sample_target(os.path.join(SAMPLES_DIR, sample)),
+    )
+
+#### distributed workers ####
+
+@lru_cache(maxsize=32)
+def load_file_pairs(upstream_patch_file, backported_patch_file, base_directory, classifier=None):
+    """Parsed file pairs of a sample keyed by backported path, cached since a worker sees the same sample several times"""
+    file_pairs = collect_file_pairs(upstream_patch_file, backported_patch_file, base_directory, classifier)
+    return {file_pair[1].path: file_pair for file_pair in file_pairs}
+
+def seed_queue(queue, sample_folders, classifier=None):
+    """
+    Enqueue the compare and abstract stage of every file of the selected samples.
+    Cheap and local path files get a single validate task (intent comparison only, or no call at all).
+    """
+    for sample in sample_folders:
+        paths = sample_paths(sample)
+        file_pairs = load_file_pairs(*paths, classifier)
+
+        queue.add_sample(sample, len(file_pairs), {"paths": paths})
+        for file_path, (_, _, _, route) in file_pairs.items():
+            if route in (ROUTE_CHEAP, ROUTE_LOCAL):
+                queue.enqueue(sample, file_path, STAGE_VALIDATE)
+                continue
+            queue.enqueue(sample, file_path, STAGE_COMPARE)
+            queue.enqueue(sample, file_path, STAGE_ABSTRACT)
+
+    print(f"Enqueued {len(sample_folders)} samples into {queue.db_path}")
+
+def run_stage(queue, judge, task, result_store_file, classifier=None):
+    """Run a single queued stage with the Judge and return its JSON serializable result"""
+    paths = queue.sample_payload(task["sample"])["paths"]
+    upstream_file, backported_file, target_code, route = load_file_pairs(*paths, classifier)[task["file_path"]]
+
+    if task["stage"] == STAGE_COMPARE:
+        return judge.compare_intent(upstream_file, backported_file)
+    if task["stage"] == STAGE_ABSTRACT:
+        return judge.abstract_code_context(target_code, backported_file)
+
+    if route in (ROUTE_CHEAP, ROUTE_LOCAL):
+        result = judge_file(judge, upstream_file, backported_file, target_code, route)
+        print_to_txt(result_store_file, backported_file.path, result)
+        return result
+
+    discrepancies = queue.stage_result(task["sample"], task["file_path"], STAGE_COMPARE)
+    abstract_code = queue.stage_result(task["sample"], task["file_path"], STAGE_ABSTRACT)
+    result = judge.validate_with_context(discrepancies, backported_file.path, abstract_code, related_code(backported_file))
+    print_to_txt(result_store_file, backported_file.path, result)
+    return result
+
+def finalize_queued_sample(queue, sample, output_file, csv_file):
+    # failed tasks come back as their error text
+    results = [{"file_path": file_path, "result": result if isinstance(result, dict) else failed_result(result)}
+               for file_path, result in queue.sample_results(sample).items()]
+    results += [{"file_path": file_path, "result": skipped_result(reason)} for file_path, reason in queue.skipped_files(sample).items()]
+    finalize_sample(sample, results, output_file, csv_file)
+
+def run_worker(queue, output_file, csv_file, result_store_file, poll_interval=5, fail_fast=False,
+               classifier=None):
+    """
+    Pull tasks from the shared queue until it is drained.
+    The lease of the current task is renewed in the background; a worker that dies simply stops
+    renewing and its task is picked up again by another worker once the lease expires.
+    With fail_fast, an incorrect file skips the outstanding tasks of its sample, workers busy with
+    one of them notice through their lost lease.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    judge = Judge()
+
+    while True:
+        task = queue.claim(worker_id)
+        if task is None:
+            for sample in queue.finalize_ready():
+                finalize_queued_sample(queue, sample, output_file, csv_file)
+            if queue.is_drained():
+                break
+            time.sleep(poll_interval)
+            continue
+
+        finished_sample = None
+        try:
+            with LeaseKeeper(queue, task["id"], worker_id, queue.lease_seconds / 3) as lease:
+                result = run_stage(queue, judge, task, result_store_file, classifier)
+        except Exception as e:
+            print(f"Warning: {task['stage']} of {task['file_path']} in sample {task['sample']} failed: {e}")
+            finished_sample = queue.fail(task["id"], worker_id, e)
+        else:
+            if lease.lost:
+                print(f"Warning: Lost the lease on {task['stage']} of {task['file_path']}, result discarded.")
+                continue
+            finished_sample = queue.complete(task["id"], worker_id, result)
+            if fail_fast and task["stage"] == STAGE_VALIDATE and get_verdict(result) == "incorrect":
+                finished_sample = queue.skip_sample(
+                    task["sample"], f"fail-fast, {task['file_path']} was judged incorrect") or finished_sample
+
+        if finished_sample:
+            finalize_queued_sample(queue, finished_sample, output_file, csv_file)
+        judge.pause(task["stage"])
+
+    print(f"Worker {worker_id} finished, queue stats: {queue.stats()}")
+
+#### batch mode ####
+
+def batch_failed_result(stage):
+    return {
+        "is_correct": "Unknown",
+        "difference_type": "Unknown",
+        "explanation": f"No answer for the {stage} request in the batch results.",
+        "suggested_fixes": ""
+    }
+
+def batch_render_stage12(judge, sample_folders, batch_dir, classifier=None):
+    """
+    Phase one: render the intent comparison and abstraction request of every file of the corpus
+    into one batch file. The manifest keeps each sample's paths and the route of each file.
+    """
+    manifest = {"samples": {}}
+    # results of an earlier run in the same directory would be taken for the answers to these requests
+    clear_results(batch_dir, STAGE12, STAGE3)
+    with BatchWriter(batch_path(batch_dir, STAGE12, "requests")) as writer:
+        for sample in sample_folders:
+            paths = sample_paths(sample)
+            routes = {}
+            for file_path, (upstream_file, backported_file, target_code, route) in load_file_pairs(*paths, classifier).items():
+                routes[file_path] = route
+                if route == ROUTE_LOCAL:
+                    continue
+                writer.add(sample, file_path, STAGE_COMPARE, judge.render_compare(upstream_file, backported_file))
+                if route != ROUTE_FULL:
+                    continue
+                body = judge.render_abstract(target_code, backported_file)
+                if body is None:
+                    print(f"Note: {file_path} of sample {sample} is too large for one request, abstracted in phase two.")
+                    continue
+                writer.add(sample, file_path, STAGE_ABSTRACT, body)
+            manifest["samples"][sample] = {"paths": paths, "routes": routes}
+    write_manifest(batch_dir, manifest)
+
+def batch_render_stage3(judge, batch_dir, classifier=None):
+    """
+    Phase two: ingest the phase one results and render the validation request of every full route file.
+    Returns False when the phase one batch has not finished yet.
+    """
+    results_path = fetch(judge.backend, batch_dir, STAGE12)
+    if results_path is None:
+        return False
+    answers = read_results(results_path)
+
+    with BatchWriter(batch_path(batch_dir, STAGE3, "requests")) as writer:
+        for sample, entry in read_manifest(batch_dir)["samples"].items():
+            file_pairs = load_file_pairs(*entry["paths"], classifier)
+            for file_path, route in entry["routes"].items():
+                if route != ROUTE_FULL or (sample, file_path, STAGE_COMPARE) not in answers:
+                    continue
+                _, backported_file, target_code, _ = file_pairs[file_path]
+                discrepancies = repair_json(answers[(sample, file_path, STAGE_COMPARE)])
+                abstract_code = answers.get((sample, file_path, STAGE_ABSTRACT))
+                if abstract_code is None:
+                    # map-reduce sized targets and failed abstraction requests are abstracted directly
+                    abstract_code = judge.abstract_code_context(target_code, backported_file)
+                writer.add(sample, file_path, STAGE_VALIDATE,
+                           judge.render_validate(discrepancies, backported_file.path, abstract_code,
+                                                 related_code(backported_file)))
+    return True
+
+def batch_finalize(backend, batch_dir, output_file, csv_file, result_store_file):
+    """Last step: turn the answers of both batches into per-file results and sample verdicts"""
+    results_path = fetch(backend, batch_dir, STAGE3)
+    if results_path is None:
+        return False
+    compare_answers = read_results(batch_path(batch_dir, STAGE12, "results"))
+    validate_answers = read_results(results_path)
+
+    for sample, entry in read_manifest(batch_dir)["samples"].items():
+        results = []
+        for file_path, route in entry["routes"].items():
+            if route == ROUTE_LOCAL:
+                result = dict(LOCAL_RESULT)
+            elif route == ROUTE_CHEAP and (sample, file_path, STAGE_COMPARE) in compare_answers:
+                result = Judge.verdict_from_discrepancies(repair_json(compare_answers[(sample, file_path, STAGE_COMPARE)]))
+            elif route == ROUTE_FULL and (sample, file_path, STAGE_VALIDATE) in validate_answers:
+                result = repair_json(validate_answers[(sample, file_path, STAGE_VALIDATE)])
+            else:
+                result = batch_failed_result(STAGE_COMPARE if route == ROUTE_CHEAP else STAGE_VALIDATE)
+            print_to_txt(result_store_file, file_path, result)
+            results.append({"file_path": file_path, "result": result})
+        finalize_sample(sample, results, output_file, csv_file)
+    return True
+
+def run_batch_phase(phase, sample_folders, batch_dir, output_file, csv_file, result_store_file, classifier=None,
+                    remote=False, workers=4):
+    """
+    render:   phase one, render and submit the compare/abstract batch for the selected samples
+    validate: phase two, ingest its results, render and submit the validation batch
+    finalize: ingest the validation results and write the verdicts
+    Without remote the batches are run right away through the backend, so validate also finalizes.
+    Returns True once the verdicts are written.
+    """
+    judge = Judge()
+    if phase == "render":
+        batch_render_stage12(judge, sample_folders, batch_dir, classifier)
+        submit(judge.backend, batch_dir, STAGE12, remote, workers)
+        return False
+    if phase == "validate":
+        if not batch_render_stage3(judge, batch_dir, classifier) or not submit(judge.backend, batch_dir, STAGE3, remote, workers):
+            return False
+    return batch_finalize(judge.backend, batch_dir, output_file, csv_file, result_store_file)
+
+#### daemon ####
+
+def validate_job(request, classifier=None, hunk_group_size=None, fail_fast=False):
+    """
+    Daemon job: judge the files of one (upstream patch, backported patch, target tree) triple with the
+    warm shared backend and return the per-file results and the verdict instead of writing output files.
+    """
+    judge = Judge()
+    hooks.emit("before_sample", sample=request.get("sample"))
+    start = time.perf_counter()
+    results = []
+    failed_file = None
+    for upstream_file, backported_file, target_code, route in collect_file_pairs(
+            request["upstream_patch"], request["backported_patch"], request["target"], classifier):
+        if failed_file:
+            result = skipped_result(f"fail-fast, {failed_file} was judged incorrect")
+        else:
+            try:
+                result = judge_file(judge, upstream_file, backported_file, target_code, route, hunk_group_size=hunk_group_size)
+            except Exception as e:
+                result = failed_result(e)
+            if fail_fast and get_verdict(result) == "incorrect":
+                failed_file = backported_file.path
+        results.append({"file_path": backported_file.path, "route": route, "result": result})
+
+    record_results(request.get("sample"), sample_verdict(results), results)
+    hooks.emit("after_sample", sample=request.get("sample"), verdict=sample_verdict(results), seconds=time.perf_counter() - start)
+    print(f"Job {request.get('sample') or request['backported_patch']}: {sample_verdict(results)}")
+    return {"sample": request.get("sample"), "verdict": sample_verdict(results), "files": results}
+
+def build_arg_parser():
+    arg_parser = argparse.ArgumentParser(description="Validate backported patches against their upstream patches.")
+    arg_parser.add_argument("--backend", choices=sorted(BACKENDS), default="openrouter",
+                            help="where model calls go: OpenRouter, a local OpenAI compatible server (LOCAL_LLM_URL) or an offline stub")
+    arg_parser.add_argument("--stage-model", action="append", default=[], metavar="STAGE=MODEL",
+                            help="override the model of a stage (compare, abstract, validate), can be repeated")
+    arg_parser.add_argument("--fallback-model", action="append", default=[], metavar="STAGE=MODEL",
+                            help="model a stage switches to while the circuit breaker of its own model is open, can be repeated")
+    arg_parser.add_argument("--max-attempts", type=int, default=4,
+                            help="attempts per model call for timeouts, rate limits, 5xx and empty answers")
+    arg_parser.add_argument("--adaptive-concurrency", action="store_true",
+                            help="bound the requests in flight per model with an AIMD controller driven by 429s, errors and latency")
+    arg_parser.add_argument("--concurrency-log", default=None,
+                            help="CSV file recording every change of the per-model concurrency limits")
+    arg_parser.add_argument("--shard-index", type=int, default=0,
+                            help="index of the shard processed by this run (0 based)")
+    arg_parser.add_argument("--shard-count", type=int, default=1,
+                            help="total number of shards the samples are split into")
+    arg_parser.add_argument("--include", default=DEFAULT_INCLUDE,
+                            help='sample ranges to process, e.g. "1-5,8,20-" (empty string for all)')
+    arg_parser.add_argument("--exclude", default=None,
+                            help="sample ranges to skip, same format as --include")
+    arg_parser.add_argument("--merge", action="store_true",
+                            help="merge the per-shard CSV, TXT, result store and fingerprint outputs and exit")
+    arg_parser.add_argument("--queue", default=None,
+                            help="path of a shared SQLite task queue used by distributed workers")
+    arg_parser.add_argument("--enqueue", action="store_true",
+                            help="add the selected samples to --queue")
+    arg_parser.add_argument("--worker", action="store_true",
+                            help="pull work from --queue until it is drained")
+    arg_parser.add_argument("--lease-seconds", type=float, default=300,
+                            help="how long a claimed task stays leased without a heartbeat")
+    arg_parser.add_argument("--workers", type=int, default=1,
+                            help="judge files on this many workers, longest estimated file first")
+    arg_parser.add_argument("--serve", nargs="?", const=DEFAULT_ADDRESS, default=None, metavar="ADDRESS",
+                            help=f"run as a daemon accepting jobs over HTTP on HOST:PORT (default {DEFAULT_ADDRESS}) or unix:/path.sock")
+    arg_parser.add_argument("--metrics", default=None, metavar="HOST:PORT",
+                            help="serve live Prometheus metrics on http://HOST:PORT/metrics for the whole run (the daemon also has /metrics)")
+    arg_parser.add_argument("--metrics-file", default=None,
+                            help="write the metrics in Prometheus text format to this file at the end of the run")
+    arg_parser.add_argument("--hook", action="append", default=[], metavar="MODULE",
+                            help="import a module that registers hooks (see hooks.py) before the run, can be repeated")
+    arg_parser.add_argument("--profile", default=None, metavar="RANGES",
+                            help="cProfile the selected samples, e.g. \"5,12-14\" (sequential loop and daemon jobs)")
+    arg_parser.add_argument("--trace-memory", default=None, metavar="RANGES",
+                            help="tracemalloc snapshots of the selected samples, same format as --profile")
+    cassette = arg_parser.add_mutually_exclusive_group()
+    cassette.add_argument("--record", default=None, metavar="CASSETTE",
+                          help="record every model call with its answer and latency to this cassette (.jsonl.gz), appending to it")
+    cassette.add_argument("--replay", default=None, metavar="CASSETTE",
+                          help="answer model calls from a recorded cassette instead of the backend, offline and deterministic")
+    arg_parser.add_argument("--replay-latency", action="store_true",
+                            help="with --replay, wait the recorded latency of each call instead of answering at full speed")
+    arg_parser.add_argument("--plan", action="store_true",
+                            help="dry run: estimate calls, tokens and wall time of the selected samples without any model call")
+    arg_parser.add_argument("--batch", choices=["render", "validate", "finalize"], default=None,
+                            help="offline batch mode: render the compare/abstract batch, then ingest it and run the validation batch")
+    arg_parser.add_argument("--batch-dir", default=BATCH_DIR,
+                            help="directory of the batch request/result files and the manifest")
+    arg_parser.add_argument("--batch-remote", action="store_true",
+                            help="submit batches to the provider's batch API instead of running them locally")
+    arg_parser.add_argument("--pipeline", action="store_true",
+                            help="run compare, abstract and validate in their own worker pools at the same time, sized by each model's rate limit")
+    arg_parser.add_argument("--stage-workers", action="append", default=[], metavar="STAGE=N",
+                            help="override the pool size of a pipeline stage, can be repeated")
+    arg_parser.add_argument("--latency-history", default=LATENCY_HISTORY_FILE,
+                            help="file with recorded per-file latencies used for the cost estimates")
+    arg_parser.add_argument("--rules", default=None,
+                            help="JSON file with pre-classifier rules deciding which files skip or shorten the model calls")
+    arg_parser.add_argument("--no-trivia-check", action="store_true",
+                            help="send files whose changes differ only in comments/whitespace to the models anyway")
+    arg_parser.add_argument("--votes", type=int, default=1, metavar="K",
+                            help="validate each file with K sampled calls at once and keep the majority verdict, stopping once it is decided (not used by --batch)")
+    arg_parser.add_argument("--semantic-diff", action="store_true",
+                            help="send the intent comparison a local per-function/class/constant/import delta instead of both raw patches (.py, .c, .h)")
+    arg_parser.add_argument("--symbol-index", nargs="?", const=SYMBOL_INDEX_FILE, default=None, metavar="PATH",
+                            help=f"give the validation the definitions and call sites elsewhere in the target tree of every identifier the backport changes, from a SQLite index (default {SYMBOL_INDEX_FILE})")
+    arg_parser.add_argument("--retrieval", nargs="?", const=RETRIEVAL_INDEX_DIR, default=None, metavar="DIR",
+                            help=f"give the validation the code chunks of the target tree most similar to each hunk (BM25), indexes kept in DIR (default {RETRIEVAL_INDEX_DIR})")
+    arg_parser.add_argument("--retrieval-top-k", type=int, default=TOP_K,
+                            help="chunks retrieved per hunk by --retrieval")
+    arg_parser.add_argument("--split-hunks", type=int, default=None, metavar="N",
+                            help="judge files with more than N hunks in concurrent groups of N hunks (not used by --worker, --batch or --pipeline)")
+    arg_parser.add_argument("--incremental", action="store_true",
+                            help="re-judge only files whose upstream hunks, backport hunks or target region changed since the last run")
+    arg_parser.add_argument("--fingerprints", default=RESULT_CACHE_FILE,
+                            help="JSON file with the per-file results and fingerprints used by --incremental")
+    arg_parser.add_argument("--fail-fast", action="store_true",
+                            help="stop judging a sample once one of its files is incorrect, the rest is recorded as skipped")
+    return arg_parser
+
+def main(argv=None):
+    arg_parser = build_arg_parser()
+    args = arg_parser.parse_args(argv)
+
+    if args.merge:
+        merge_shards(OUTPUT_CSV_FILE, OUTPUT_FILE, RESULT_STORE_FILE, args.fingerprints)
+        compare_verdicts(VERDICTS_CSV_FILE, OUTPUT_CSV_FILE)
+        return
+
+    if args.queue and not (args.enqueue or args.worker):
+        raise SystemExit("--queue needs --enqueue and/or --worker")
+    if args.incremental and (args.queue or args.batch or args.serve):
+        arg_parser.error("--incremental works with the sequential loop, --workers and --pipeline, not with --queue, --batch or --serve")
+
+    if args.metrics:
+        metrics.serve_metrics(args.metrics)
+    for module in args.hook:
+        importlib.import_module(module)
+    Judge.semantic_diff = args.semantic_diff
+    Judge.votes = max(args.votes, 1)
+    configure_symbol_index(args.symbol_index)
+    configure_retrieval(args.retrieval, args.retrieval_top_k)
+    if args.replay_latency and not args.replay:
+        raise SystemExit("--replay-latency needs --replay")
+    if (args.record or args.replay) and args.batch_remote:
+        print("Warning: calls of the provider's batch API are neither recorded nor replayed.")
+    cassette = (args.record, "record", False) if args.record else (args.replay, "replay", args.replay_latency) if args.replay else None
+    configure_default_backend(args.backend, parse_stage_models(args.stage_model), cassette=cassette,
+                              fallback_models=parse_stage_models(args.fallback_model), max_attempts=args.max_attempts,
+                              adaptive_concurrency=args.adaptive_concurrency, concurrency_log=args.concurrency_log)
+
+    csv_file = shard_output_path(OUTPUT_CSV_FILE, args.shard_index, args.shard_count)
+    output_file = shard_output_path(OUTPUT_FILE, args.shard_index, args.shard_count)
+    result_store_file = shard_output_path(RESULT_STORE_FILE, args.shard_index, args.shard_count)
+    if args.profile or args.trace_memory:
+        if (args.workers > 1 and not args.serve) or args.pipeline or args.queue or args.batch:
+            print("Warning: --profile and --trace-memory only cover the sequential loop and daemon jobs.")
+        profile_dir = os.path.join(os.path.dirname(output_file), PROFILE_DIR)
+        SampleProfiler(profile_dir, parse_ranges(args.profile), parse_ranges(args.trace_memory)).install()
+
+    if args.rules:
+        classifier = PreClassifier.from_file(args.rules, trivia_check=not args.no_trivia_check)
+    else:
+        classifier = PreClassifier(trivia_check=not args.no_trivia_check)
+
+    sample_folders = [f for f in os.listdir(SAMPLES_DIR) if os.path.isdir(os.path.join(SAMPLES_DIR, f)) and not f.endswith(".csv")]
+    sample_folders = select_samples(sample_folders, args.shard_index, args.shard_count, args.include, args.exclude)
+    print(f"Shard {args.shard_index}/{args.shard_count}: {len(sample_folders)} samples selected")
+
+    if args.serve:
+        # --workers jobs at a time, all sharing one backend, classifier and set of caches
+        serve(args.serve, lambda request: validate_job(request, classifier, args.split_hunks, args.fail_fast), args.workers)
+        return
+
+    if args.plan:
+        file_pairs_by_sample = {sample: collect_file_pairs(*sample_paths(sample), classifier) for sample in sample_folders}
+        plan = plan_run(file_pairs_by_sample, default_backend(), CostModel(args.latency_history), args.split_hunks)
+        classifier.report(Judge.seconds_per_call())
+        plan.report(args.workers, rate_limits(default_backend()))
+        return
+
+    if args.batch:
+        # later phases take the samples from the manifest and need the same --rules as the render phase
+        done = run_batch_phase(args.batch, sample_folders, args.batch_dir, output_file, csv_file, result_store_file,
+                               classifier, remote=args.batch_remote, workers=args.workers)
+        if args.batch == "render":
+            classifier.report(Judge.seconds_per_call())
+        cassette_report()
+        resilience_report()
+        if args.metrics_file:
+            metrics.write_metrics(args.metrics_file)
+        if done and args.shard_count == 1:
+            compare_verdicts(VERDICTS_CSV_FILE, csv_file)
+        return
+
+    if args.queue:
+        queue = TaskQueue(args.queue, lease_seconds=args.lease_seconds)
+        if args.enqueue:
+            seed_queue(queue, sample_folders, classifier)
+            classifier.report(Judge.seconds_per_call())
+        if args.worker:
+            # workers need the same --rules as the run that enqueued the samples
+            run_worker(queue, output_file, csv_file, result_store_file, fail_fast=args.fail_fast,
+                       classifier=classifier)
+            Judge.usage_report()
+            Judge.vote_report()
+            metrics.report()
+            cassette_report()
+            resilience_report()
+            if args.metrics_file:
+                metrics.write_metrics(args.metrics_file)
+        return
+
+    fingerprint_store = ResultStore(shard_output_path(args.fingerprints, args.shard_index, args.shard_count)) if args.incremental else None
+    if args.pipeline:
+        stage_workers = stage_pool_sizes(default_backend(), {stage: int(count) for stage, count in
+                                                             parse_stage_models(args.stage_workers).items()})
+        run_pipelined(sample_folders, output_file, csv_file, result_store_file, stage_workers,
+                      fail_fast=args.fail_fast, classifier=classifier, fingerprint_store=fingerprint_store)
+    elif args.workers > 1:
+        run_scheduled(sample_folders, args.workers, output_file, csv_file, result_store_file,
+                      CostModel(args.latency_history), fail_fast=args.fail_fast, classifier=classifier,
+                      hunk_group_size=args.split_hunks, fingerprint_store=fingerprint_store)
+    else:
+        # process each sample file sequentially
+        for sample in sample_folders:
+            upstream_patch_file, backported_patch_file, base_directory = sample_paths(sample)
+
+            process_patches(upstream_patch_file, backported_patch_file, base_directory, output_file, sample,
+                            csv_file=csv_file, result_store_file=result_store_file, fail_fast=args.fail_fast,
+                            classifier=classifier, hunk_group_size=args.split_hunks, fingerprint_store=fingerprint_store)
 
-        upstream_patch_file = os.path.join(SAMPLES_DIR, sample, "upstream.patch")
-        backported_patch_file = os.path.join(SAMPLES_DIR, sample, "backporter.patch")
-        base_directory = os.path.join(SAMPLES_DIR, sample, "target")
+    if fingerprint_store is not None:
+        fingerprint_store.save()
+        fingerprint_store.report()
 
-        process_patches(upstream_patch_file, backported_patch_file, base_directory, OUTPUT_FILE, sample) 
+    classifier.report(Judge.seconds_per_call())
+    Judge.usage_report()
+    Judge.vote_report()
+    metrics.report()
+    differ.report()
+    symbol_index_report()
+    retrieval_report()
+    cassette_report()
+    resilience_report()
+    blob_cache_report()
+    if args.metrics_file:
+        metrics.write_metrics(args.metrics_file)
 
-    compare_verdicts(VERDICTS_CSV_FILE, OUTPUT_CSV_FILE)
+    # a single shard only covers part of the corpus, compare after --merge instead
+    if args.shard_count == 1:
+        compare_verdicts(VERDICTS_CSV_FILE, csv_file)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,166 @@
+import os
+import re
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+ABSTRACTION_CACHE_DIR = ".abstraction_cache"
+CHARS_PER_TOKEN = 4
+CHUNK_TOKENS = 12000                # size of a single map step
+ABSTRACTION_TOKEN_CEILING = 24000   # size of the merged abstraction
+MAP_WORKERS = 4
+UNTOUCHED_PATCH_NOTE = "(No change of the backport touches this part of the file. Abstract it to its structure.)"
+
+PYTHON_BOUNDARY = re.compile(r"^(?:@|def\s|async\s+def\s|class\s)")
+PYTHON_SIGNATURE = re.compile(r"^\s*(?:@.*|(?:async\s+)?def\s.*|class\s.*)$")
+C_SIGNATURE = re.compile(r"^[A-Za-z_][\w\s\*,()\[\]]*\([^;]*$")
+IDENTIFIER = re.compile(r"[A-Za-z_]\w{2,}")
+DEFINED_NAME = re.compile(
+    r"^\s*(?:async\s+)?(?:def|class)\s+(\w+)|^#define\s+(\w+)|^[A-Za-z_][\w\s\*]*?\b(\w+)\s*\(", re.MULTILINE)
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def split_at_definitions(target_code, path):
+    """
+    Split a file into (first line, lines) pieces at top-level definition boundaries.
+    Python splits before top-level def/class (keeping decorators with them), C splits after a
+    closing brace in column 0. Other languages are split on blank lines only.
+    """
+    lines = target_code.splitlines(keepends=True)
+    pieces = []
+    current, start = [], 1
+    for number, line in enumerate(lines, 1):
+        starts_definition = path.endswith(".py") and PYTHON_BOUNDARY.match(line) \
+            and not (current and current[-1].startswith("@"))
+        if starts_definition and current:
+            pieces.append((start, current))
+            current, start = [], number
+        current.append(line)
+        ends_definition = path.endswith((".c", ".h")) and line.startswith("}")
+        ends_paragraph = not path.endswith((".py", ".c", ".h")) and not line.strip()
+        if (ends_definition or ends_paragraph) and current:
+            pieces.append((start, current))
+            current, start = [], number + 1
+    if current:
+        pieces.append((start, current))
+    return pieces
+
+def make_chunks(target_code, path, chunk_tokens=CHUNK_TOKENS):
+    """Greedily pack definition pieces into chunks of at most chunk_tokens, oversized pieces are cut by lines"""
+    chunks = []
+    current, start = [], 1
+    for piece_start, piece in split_at_definitions(target_code, path):
+        if current and estimate_tokens("".join(current + piece)) > chunk_tokens:
+            chunks.append((start, current))
+            current, start = [], piece_start
+        if not current:
+            start = piece_start
+        current.extend(piece)
+        while estimate_tokens("".join(current)) > chunk_tokens and len(current) > 1:
+            cut = max(len(current) // 2, 1)
+            chunks.append((start, current[:cut]))
+            current, start = current[cut:], start + cut
+    if current:
+        chunks.append((start, current))
+    return [(start, start + len(lines) - 1, "".join(lines)) for start, lines in chunks]
+
+def touched_lines_and_symbols(backport_patch):
+    """Target line ranges changed by the backport and the identifiers appearing in its changed lines"""
+    ranges = []
+    symbols = set()
+    for hunk in backport_patch:
+        ranges.append((hunk.source_start, hunk.source_start + max(hunk.source_length, 1) - 1))
+        if hunk.section_header:
+            symbols.update(IDENTIFIER.findall(hunk.section_header))
+        for line in hunk:
+            if line.is_added or line.is_removed:
+                symbols.update(IDENTIFIER.findall(line.value))
+    return ranges, symbols
+
+def is_touched(chunk, ranges, symbols):
+    start, end, text = chunk
+    if any(start <= range_end and range_start <= end for range_start, range_end in ranges):
+        return True
+    defined = {name for match in DEFINED_NAME.finditer(text) for name in match.groups() if name}
+    return bool(defined & symbols)
+
+def skeleton(text, path):
+    """Signature-only abstraction made locally, used when the merged result does not fit the ceiling"""
+    pattern = PYTHON_SIGNATURE if path.endswith(".py") else C_SIGNATURE
+    kept = [line.rstrip() for line in text.splitlines() if pattern.match(line)]
+    omitted = len(text.splitlines()) - len(kept)
+    return "\n".join(kept + [f"# ... ({omitted} lines abstracted)"]) + "\n"
+
+
+class MapReduceAbstractor:
+    """
+    Abstraction for target files larger than the abstraction model's context.
+    Map: chunks at definition boundaries are abstracted in parallel; chunks the backport touches
+    (by line range or by defining a symbol the patch uses) get the patch, all others get a neutral
+    note so their abstraction does not depend on the patch and is cached on disk by content hash.
+    Reduce: chunk abstractions are concatenated in file order, untouched chunks fall back to local
+    skeletons and then to omission markers until the result fits the token ceiling.
+    """
+
+    def __init__(self, abstract_chunk, model, cache_dir=ABSTRACTION_CACHE_DIR, token_ceiling=ABSTRACTION_TOKEN_CEILING,
+                 chunk_tokens=CHUNK_TOKENS):
+        self.abstract_chunk = abstract_chunk
+        self.model = model
+        self.cache_dir = cache_dir
+        self.token_ceiling = token_ceiling
+        self.chunk_tokens = chunk_tokens
+
+    def _cache_path(self, text):
+        digest = hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + ".txt")
+
+    def _abstract_untouched(self, text):
+        cache_path = self._cache_path(text)
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding="utf-8") as f:
+                return f.read()
+
+        abstracted = self.abstract_chunk(text, UNTOUCHED_PATCH_NOTE)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path + ".tmp", 'w', encoding="utf-8") as f:
+            f.write(abstracted)
+        os.replace(cache_path + ".tmp", cache_path)
+        return abstracted
+
+    def abstract(self, target_code, backport_patch):
+        path = getattr(backport_patch, "path", "")
+        chunks = make_chunks(target_code, path, self.chunk_tokens)
+        ranges, symbols = touched_lines_and_symbols(backport_patch)
+        touched = [is_touched(chunk, ranges, symbols) for chunk in chunks]
+        print(f"Map-reduce abstraction of {path}: {len(chunks)} chunks, {sum(touched)} touched by the backport")
+
+        # Map
+        with ThreadPoolExecutor(max_workers=MAP_WORKERS) as executor:
+            futures = [
+                executor.submit(self.abstract_chunk, text, backport_patch) if is_chunk_touched
+                else executor.submit(self._abstract_untouched, text)
+                for (_, _, text), is_chunk_touched in zip(chunks, touched)
+            ]
+            parts = [future.result() or "" for future in futures]
+
+        # Reduce
+        return self.merge(chunks, touched, parts, path)
+
+    def merge(self, chunks, touched, parts, path):
+        parts = list(parts)
+        untouched = [index for index, is_chunk_touched in enumerate(touched) if not is_chunk_touched]
+        # largest untouched parts are shrunk first
+        untouched.sort(key=lambda index: estimate_tokens(parts[index]), reverse=True)
+
+        for shrink in (lambda index: skeleton(chunks[index][2], path),
+                       lambda index: f"# ... (lines {chunks[index][0]}-{chunks[index][1]} omitted)\n"):
+            for index in untouched:
+                if estimate_tokens("".join(parts)) <= self.token_ceiling:
+                    return "".join(parts)
+                parts[index] = shrink(index)
+
+        merged = "".join(parts)
+        if estimate_tokens(merged) > self.token_ceiling:
+            print(f"Warning: Abstraction of {path} still exceeds {self.token_ceiling} tokens after merging.")
+        return merged
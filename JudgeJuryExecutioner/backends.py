@@ -0,0 +1,266 @@
+import os
+import json
+import hashlib
+from openai import OpenAI
+from dotenv import load_dotenv
+from resilience import ResilientBackend, EmptyCompletionError
+from cassette import Cassette, CassetteBackend
+
+load_dotenv()
+
+BASE_URL = os.getenv("BASE_URL")
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+LOCAL_LLM_URL = os.getenv("LOCAL_LLM_URL", "http://127.0.0.1:8080/v1")
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "local")
+LOCAL_LLM_CONTEXT = int(os.getenv("LOCAL_LLM_CONTEXT", "32768"))
+
+STAGES = ("compare", "abstract", "validate")
+
+COMPARE_MODEL = "deepseek/deepseek-r1:free"
+ABSTRACT_MODEL = "deepseek/deepseek-chat:free"
+VALIDATE_MODEL = "google/gemini-2.0-pro-exp-02-05:free"
+
+# context: window in tokens, cache_control: needs explicit prompt caching breakpoints,
+# json_mode: honours response_format json_object, streaming: can stream completions,
+# rpm: requests per minute the provider allows (None for no limit)
+MODEL_REGISTRY = {
+    COMPARE_MODEL: {"context": 160000, "cache_control": False, "json_mode": False, "streaming": True, "rpm": 20},
+    ABSTRACT_MODEL: {"context": 64000, "cache_control": False, "json_mode": False, "streaming": True, "rpm": 20},
+    VALIDATE_MODEL: {"context": 1000000, "cache_control": True, "json_mode": False, "streaming": True, "rpm": 20},
+    LOCAL_LLM_MODEL: {"context": LOCAL_LLM_CONTEXT, "cache_control": False, "json_mode": True, "streaming": True, "rpm": None},
+    "stub": {"context": 1000000, "cache_control": False, "json_mode": True, "streaming": False, "rpm": None},
+}
+DEFAULT_CAPABILITIES = {"context": 32768, "cache_control": False, "json_mode": False, "streaming": False, "rpm": None}
+
+DEFAULT_STAGE_MODELS = {"compare": COMPARE_MODEL, "abstract": ABSTRACT_MODEL, "validate": VALIDATE_MODEL}
+
+DEFAULT_SEED = 2025
+
+EPHEMERAL = {"type": "ephemeral"}
+STANDARD_FIELDS = {"model", "messages", "seed", "temperature", "response_format"}
+
+def capabilities(model):
+    return MODEL_REGISTRY.get(model, DEFAULT_CAPABILITIES)
+
+def build_messages(model, system_prompt, prompt_parts):
+    """
+    prompt_parts is a list of (text, cache_breakpoint) in stable-first order. Models that need
+    explicit hints get a cache_control breakpoint after the system prompt and every flagged part,
+    the others (e.g. DeepSeek) cache matching prefixes automatically.
+    """
+    if isinstance(prompt_parts, str):
+        prompt_parts = [(prompt_parts, False)]
+
+    if not capabilities(model)["cache_control"]:
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": "".join(text for text, _ in prompt_parts)}]
+
+    user_content = []
+    for text, cache_breakpoint in prompt_parts:
+        part = {"type": "text", "text": text}
+        if cache_breakpoint:
+            part["cache_control"] = EPHEMERAL
+        user_content.append(part)
+    return [
+        {"role": "system", "content": [{"type": "text", "text": system_prompt, "cache_control": EPHEMERAL}]},
+        {"role": "user", "content": user_content}]
+
+
+class Completion:
+    """Text of a model answer plus its token usage"""
+
+    def __init__(self, content, prompt_tokens=0, completion_tokens=0, cached_tokens=0):
+        self.content = content
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached_tokens = cached_tokens
+
+
+class Backend:
+    """
+    Where the Judge's model calls go. A backend maps each stage (compare, abstract, validate)
+    to a model and turns (system prompt, prompt parts) into a Completion.
+    """
+    name = "base"
+
+    def __init__(self, stage_models=None):
+        self.stage_models = dict(DEFAULT_STAGE_MODELS)
+        self.stage_models.update(stage_models or {})
+
+    def model_for(self, stage):
+        return self.stage_models[stage]
+
+    def capabilities(self, stage):
+        return capabilities(self.model_for(stage))
+
+    def pause_after(self, stage):
+        """Seconds to wait after a call of stage to stay within the model's rpm, none without a limit"""
+        rpm = self.capabilities(stage)["rpm"]
+        return 60 / rpm if rpm else 0
+
+    def request_body(self, stage, system_prompt, prompt_parts, temperature=0, json_output=False, model=None, seed=None):
+        """Chat completions request body of a call, as sent to the API or written to a batch file"""
+        model = model or self.model_for(stage)
+        body = {
+            "model": model,
+            "messages": build_messages(model, system_prompt, prompt_parts),
+            "seed": DEFAULT_SEED if seed is None else seed,
+            "temperature": temperature,
+        }
+        if json_output and capabilities(model)["json_mode"]:
+            body["response_format"] = {"type": "json_object"}
+        return body
+
+    def send(self, stage, body):
+        """Send a rendered request body and return a Completion"""
+        raise NotImplementedError
+
+    def complete(self, stage, system_prompt, prompt_parts, temperature=0, json_output=False, seed=None):
+        return self.send(stage, self.request_body(stage, system_prompt, prompt_parts, temperature, json_output, seed=seed))
+
+
+class OpenAICompatibleBackend(Backend):
+    """Any server speaking the OpenAI chat completions API, OpenRouter by default"""
+    name = "openrouter"
+
+    def __init__(self, base_url=BASE_URL, api_key=OPENROUTER_API_KEY, stage_models=None, extra_body=None):
+        super().__init__(stage_models)
+        self.base_url = base_url
+        self.api_key = api_key
+        self._client = None
+        # OpenRouter only reports cached tokens when usage accounting is requested
+        self.extra_body = {"usage": {"include": True}} if extra_body is None else extra_body
+
+    def request_body(self, stage, system_prompt, prompt_parts, temperature=0, json_output=False, model=None, seed=None):
+        body = super().request_body(stage, system_prompt, prompt_parts, temperature, json_output, model, seed)
+        body.update(self.extra_body)
+        return body
+
+    @property
+    def client(self):
+        # created on first use, a replayed run never needs an API key
+        if self._client is None:
+            # retries are left to ResilientBackend, which also sees them for the circuit breakers
+            self._client = OpenAI(base_url=self.base_url, api_key=self.api_key, max_retries=0)
+        return self._client
+
+    def send(self, stage, body):
+        standard = {key: value for key, value in body.items() if key in STANDARD_FIELDS}
+        extra = {key: value for key, value in body.items() if key not in STANDARD_FIELDS}
+        response = self.client.chat.completions.create(**standard, extra_body=extra or None)
+        return completion_from_response(response)
+
+    def submit_batch(self, input_path):
+        """Upload a batch file to the provider's batch API, returns the batch id"""
+        with open(input_path, 'rb') as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint="/v1/chat/completions",
+                                           completion_window="24h")
+        return batch.id
+
+    def fetch_batch(self, batch_id, results_path):
+        """Download the output of a finished batch, returns False while it is still running"""
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status != "completed":
+            print(f"Batch {batch_id} is {batch.status}.")
+            return False
+        with open(results_path, 'w', encoding="utf-8") as f:
+            f.write(self.client.files.content(batch.output_file_id).text)
+        return True
+
+
+def completion_from_response(response):
+    """Completion out of a chat completions response object"""
+    if not response.choices or response.choices[0].message.content is None:
+        raise EmptyCompletionError(f"Empty answer from {getattr(response, 'model', 'the model')}")
+    usage = getattr(response, "usage", None)
+    details = getattr(usage, "prompt_tokens_details", None)
+    return Completion(
+        response.choices[0].message.content,
+        prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+        completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        cached_tokens=getattr(details, "cached_tokens", 0) or 0,
+    )
+
+
+class LocalServerBackend(OpenAICompatibleBackend):
+    """
+    A local OpenAI compatible server (llama.cpp server, vLLM on CPU, ...) at LOCAL_LLM_URL.
+    All stages use LOCAL_LLM_MODEL unless mapped otherwise.
+    """
+    name = "local"
+
+    def __init__(self, base_url=LOCAL_LLM_URL, model=LOCAL_LLM_MODEL, stage_models=None):
+        local_models = {stage: model for stage in STAGES}
+        local_models.update(stage_models or {})
+        super().__init__(base_url=base_url, api_key=os.getenv("LOCAL_LLM_API_KEY", "not-needed"),
+                         stage_models=local_models, extra_body={})
+
+
+class StubBackend(Backend):
+    """
+    Deterministic offline backend for dry runs and tests of the pipeline itself. Answers depend
+    only on the prompt: an intent comparison finds no discrepancies, the abstraction echoes the
+    target code and the validation accepts the backport.
+    """
+    name = "stub"
+
+    def __init__(self, stage_models=None):
+        super().__init__({stage: "stub" for stage in STAGES})
+        self.stage_models.update(stage_models or {})
+
+    def send(self, stage, body):
+        prompt = "".join(
+            message["content"] if isinstance(message["content"], str) else "".join(part["text"] for part in message["content"])
+            for message in body["messages"] if message["role"] == "user")
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+        if stage == "compare":
+            content = json.dumps({"discrepancies": [], "security_risk": "No", "functionality_risk": "No"})
+        elif stage == "abstract":
+            content = prompt
+        else:
+            content = json.dumps({"is_correct": "Yes", "difference_type": "None",
+                                  "explanation": f"Stub backend verdict ({digest}).", "suggested_fixes": ""})
+        prompt_tokens = len(prompt) // 4
+        return Completion(content, prompt_tokens=prompt_tokens, completion_tokens=len(content) // 4)
+
+
+BACKENDS = {
+    OpenAICompatibleBackend.name: OpenAICompatibleBackend,
+    LocalServerBackend.name: LocalServerBackend,
+    StubBackend.name: StubBackend,
+}
+
+# backend used by Judge() without arguments, set once by main()
+_default_backend = {"name": "openrouter", "stage_models": {}, "resilience": {}, "cassette": None, "instance": None}
+
+def parse_stage_models(specs):
+    """["compare=model-a", "validate=model-b"] -> {"compare": "model-a", "validate": "model-b"}"""
+    stage_models = {}
+    for spec in specs or []:
+        stage, _, model = spec.partition("=")
+        if stage not in STAGES or not model:
+            raise ValueError(f"Invalid stage model mapping {spec!r}, expected one of {STAGES}=<model>")
+        stage_models[stage] = model
+    return stage_models
+
+def configure_default_backend(name, stage_models=None, cassette=None, **resilience):
+    """
+    cassette is (path, mode, realtime) to record or replay the model calls, see cassette.py.
+    resilience is passed on to ResilientBackend (fallback_models, max_attempts, ...)
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}, choose from {sorted(BACKENDS)}")
+    _default_backend.update(name=name, stage_models=stage_models or {}, resilience=resilience, cassette=cassette, instance=None)
+
+def default_backend():
+    """Shared instance, so all Judges of a run reuse one HTTP client and one set of circuit breakers"""
+    if _default_backend["instance"] is None:
+        backend = BACKENDS[_default_backend["name"]](stage_models=_default_backend["stage_models"])
+        if _default_backend["cassette"]:
+            path, mode, realtime = _default_backend["cassette"]
+            backend = CassetteBackend(backend, Cassette(path), mode, realtime)
+        _default_backend["instance"] = ResilientBackend(backend, **_default_backend["resilience"])
+    return _default_backend["instance"]
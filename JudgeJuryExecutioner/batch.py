@@ -0,0 +1,165 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+
+# batch files live in their own directory, one set per run
+BATCH_DIR = "batch"
+MANIFEST_FILE = "manifest.json"
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+# the two batches of a run: intent comparison + abstraction first, validation second
+STAGE12 = "stage12"
+STAGE3 = "stage3"
+
+def batch_path(batch_dir, batch, kind):
+    """batch/stage12_requests.jsonl, batch/stage12_results.jsonl, batch/stage12_batch_id.txt, ..."""
+    extension = "txt" if kind == "batch_id" else "jsonl"
+    return os.path.join(batch_dir, f"{batch}_{kind}.{extension}")
+
+def clear_results(batch_dir, *batches):
+    """Forget the results and batch ids of batches, they belong to requests that are rendered again"""
+    for batch in batches:
+        for kind in ("results", "batch_id"):
+            path = batch_path(batch_dir, batch, kind)
+            if os.path.exists(path):
+                os.remove(path)
+
+def custom_id(sample, file_path, stage):
+    return f"{sample}|{stage}|{file_path}"
+
+def parse_custom_id(value):
+    """custom_id -> (sample, file_path, stage)"""
+    sample, stage, file_path = value.split("|", 2)
+    return sample, file_path, stage
+
+def write_manifest(batch_dir, manifest):
+    os.makedirs(batch_dir, exist_ok=True)
+    with open(os.path.join(batch_dir, MANIFEST_FILE), 'w', encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+def read_manifest(batch_dir):
+    with open(os.path.join(batch_dir, MANIFEST_FILE), 'r', encoding="utf-8") as f:
+        return json.load(f)
+
+
+class BatchWriter:
+    """Writes chat completion requests as lines of an OpenAI style batch input file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, 'w', encoding="utf-8")
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+        print(f"Wrote {self.count} requests to {self.path}")
+        return False
+
+    def add(self, sample, file_path, stage, body):
+        line = {"custom_id": custom_id(sample, file_path, stage), "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+        self._file.write(json.dumps(line) + "\n")
+        self.count += 1
+
+
+def read_results(path):
+    """
+    Read a batch output file into {(sample, file_path, stage): answer text}.
+    Requests that failed are left out with a warning, the caller decides what a missing answer means.
+    """
+    answers = {}
+    failed = 0
+    prompt_tokens = completion_tokens = 0
+    with open(path, 'r', encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            response = entry.get("response") or {}
+            if entry.get("error") or response.get("status_code") != 200:
+                print(f"Warning: Batch request {entry.get('custom_id')} failed: {entry.get('error') or response}")
+                failed += 1
+                continue
+            body = response["body"]
+            answers[parse_custom_id(entry["custom_id"])] = body["choices"][0]["message"]["content"]
+            usage = body.get("usage") or {}
+            prompt_tokens += usage.get("prompt_tokens", 0)
+            completion_tokens += usage.get("completion_tokens", 0)
+
+    print(f"Read {len(answers)} answers from {path} ({failed} failed), "
+          f"prompt tokens {prompt_tokens}, completion tokens {completion_tokens}")
+    return answers
+
+def result_line(request, completion=None, error=None):
+    """Batch output line for a request, in the format of the OpenAI batch API"""
+    if error is not None:
+        return {"custom_id": request["custom_id"], "response": None, "error": {"message": str(error)}}
+    body = {
+        "model": request["body"]["model"],
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": completion.content}}],
+        "usage": {"prompt_tokens": completion.prompt_tokens, "completion_tokens": completion.completion_tokens},
+    }
+    return {"custom_id": request["custom_id"], "response": {"status_code": 200, "body": body}, "error": None}
+
+def run_inline(backend, requests_path, results_path, workers=4):
+    """
+    Local stand-in for a batch endpoint: send every request of the input file through the backend
+    and write an output file in the batch API format, so ingestion does not care where it came from.
+    """
+    with open(requests_path, 'r', encoding="utf-8") as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+
+    def send(request):
+        _, _, stage = parse_custom_id(request["custom_id"])
+        try:
+            return result_line(request, backend.send(stage, request["body"]))
+        except Exception as e:
+            return result_line(request, error=e)
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        lines = list(executor.map(send, requests))
+    with open(results_path + ".tmp", 'w', encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line) + "\n")
+    os.replace(results_path + ".tmp", results_path)
+    print(f"Ran {len(requests)} batch requests locally through the {backend.name} backend into {results_path}")
+
+def submit(backend, batch_dir, batch, remote=False, workers=4):
+    """
+    Submit a rendered batch. remote uploads it to the provider's batch API and keeps the batch id,
+    otherwise the requests are run right away. Returns True when the results file is ready.
+    Results of an earlier submission of the batch are dropped first, fetch never returns them.
+    """
+    clear_results(batch_dir, batch)
+    requests_path = batch_path(batch_dir, batch, "requests")
+    if not remote:
+        run_inline(backend, requests_path, batch_path(batch_dir, batch, "results"), workers)
+        return True
+
+    if not hasattr(backend, "submit_batch"):
+        raise SystemExit(f"The {backend.name} backend has no batch API, run without --batch-remote")
+    batch_id = backend.submit_batch(requests_path)
+    with open(batch_path(batch_dir, batch, "batch_id"), 'w') as f:
+        f.write(batch_id)
+    print(f"Submitted {requests_path} as batch {batch_id}")
+    return False
+
+def fetch(backend, batch_dir, batch):
+    """
+    Make sure the results of a batch are on disk, downloading them for a remote batch.
+    Returns the results path, or None while the remote batch is still running.
+    """
+    results_path = batch_path(batch_dir, batch, "results")
+    if os.path.exists(results_path):
+        return results_path
+
+    id_path = batch_path(batch_dir, batch, "batch_id")
+    if not os.path.exists(id_path):
+        raise SystemExit(f"No results for {batch} in {batch_dir}, run the previous batch phase first")
+    with open(id_path, 'r') as f:
+        batch_id = f.read().strip()
+    return results_path if backend.fetch_batch(batch_id, results_path) else None
@@ -0,0 +1,132 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+from collections import defaultdict
+
+
+class CassetteMissError(Exception):
+    """Replay found no recorded answer for a request"""
+
+
+def request_key(stage, body):
+    """Hash of the stage and the canonical request body, model and seed included"""
+    return hashlib.sha256(json.dumps([stage, body], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    Recorded model interactions in a gzipped JSON lines file: one line per call with the request
+    (stage, body and its key), the answer and token usage, and the call's latency. Recording
+    appends a gzip member per call, so a cassette survives interrupted runs and can grow over
+    several runs. The same request recorded more than once is replayed in recording order.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = defaultdict(list)
+        self.served = defaultdict(int)
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with gzip.open(path, 'rt', encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]].append(entry)
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.entries.values())
+
+    def record(self, stage, body, completion, latency):
+        entry = {"key": request_key(stage, body), "stage": stage, "model": body["model"], "request": body,
+                 "content": completion.content, "prompt_tokens": completion.prompt_tokens,
+                 "completion_tokens": completion.completion_tokens, "cached_tokens": completion.cached_tokens,
+                 "latency": round(latency, 4)}
+        with self._lock:
+            self.entries[entry["key"]].append(entry)
+            with gzip.open(self.path, 'at', encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def play(self, stage, body):
+        """Next recorded entry of the request, the last one again once they are used up"""
+        key = request_key(stage, body)
+        with self._lock:
+            entries = self.entries.get(key)
+            if not entries:
+                raise CassetteMissError(f"No recorded answer for the {stage} call to {body['model']} ({key[:12]}) in {self.path}")
+            entry = entries[min(self.served[key], len(entries) - 1)]
+            self.served[key] += 1
+            return entry
+
+
+# every cassette backend of this process, for the end of run report
+_cassette_backends = []
+
+
+class CassetteBackend:
+    """
+    Record or replay the calls of a backend. Sits under ResilientBackend, so a recording holds
+    the latency of single attempts and a replay still goes through the circuit breakers and
+    concurrency limits. Replays run at full speed without the rate limit pauses between calls,
+    or at the recorded latency with realtime.
+    """
+
+    def __init__(self, backend, cassette, mode, realtime=False):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode {mode!r}")
+        self.backend = backend
+        self.cassette = cassette
+        self.mode = mode
+        self.realtime = realtime
+        self.calls = 0
+        self.recorded_seconds = 0.0
+        self._lock = threading.Lock()
+        _cassette_backends.append(self)
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def pause_after(self, stage):
+        """A replay keeps no pause between calls, its pace is the recorded latency at most"""
+        return self.backend.pause_after(stage) if self.mode == "record" else 0
+
+    def send(self, stage, body):
+        # imported here, backends imports this module
+        from backends import Completion
+
+        if self.mode == "record":
+            start = time.perf_counter()
+            completion = self.backend.send(stage, body)
+            latency = time.perf_counter() - start
+            self.cassette.record(stage, body, completion, latency)
+        else:
+            entry = self.cassette.play(stage, body)
+            latency = entry["latency"]
+            if self.realtime:
+                time.sleep(latency)
+            completion = Completion(entry["content"], prompt_tokens=entry["prompt_tokens"],
+                                    completion_tokens=entry["completion_tokens"], cached_tokens=entry["cached_tokens"])
+        with self._lock:
+            self.calls += 1
+            self.recorded_seconds += latency
+        return completion
+
+    def complete(self, stage, system_prompt, prompt_parts, temperature=0, json_output=False, seed=None):
+        return self.send(stage, self.request_body(stage, system_prompt, prompt_parts, temperature, json_output, seed=seed))
+
+    def report(self):
+        if not self.calls:
+            return
+        if self.mode == "record":
+            print(f"Cassette {self.cassette.path}: {self.calls} call(s) recorded ({self.recorded_seconds:.1f}s), "
+                  f"{len(self.cassette)} in total")
+        else:
+            pace = "at the recorded latency" if self.realtime else f"{self.recorded_seconds:.1f}s of model time skipped"
+            print(f"Cassette {self.cassette.path}: {self.calls} call(s) replayed, {pace}")
+
+
+def report():
+    for backend in _cassette_backends:
+        backend.report()
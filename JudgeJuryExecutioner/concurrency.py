@@ -0,0 +1,103 @@
+import os
+import time
+import threading
+
+
+INITIAL_LIMIT = 2
+MIN_LIMIT = 1
+MAX_LIMIT = 16
+DECREASE_FACTOR = 0.5       # on 429s and errors
+GRADIENT_FACTOR = 0.9       # on latency rising above the baseline
+LATENCY_TOLERANCE = 1.5     # short term latency this much above the long term baseline counts as congestion
+SHORT_ALPHA = 0.3
+LONG_ALPHA = 0.05
+
+class AIMDLimiter:
+    """
+    Additive-increase/multiplicative-decrease limit on the requests in flight to one model.
+    Every success adds 1/limit (about +1 per round of requests), a 429 or error multiplies the limit
+    by DECREASE_FACTOR and a short term latency well above the long term baseline by GRADIENT_FACTOR.
+    Decreases are spaced by the current latency, so one burst of 429s only counts once.
+    """
+
+    def __init__(self, model, initial=INITIAL_LIMIT, minimum=MIN_LIMIT, maximum=MAX_LIMIT, log_file=None):
+        self.model = model
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.log_file = log_file
+        self.in_flight = 0
+        self.short_latency = None
+        self.long_latency = None
+        self.last_decrease = 0.0
+        self.throttled = 0
+        self.history = [(time.time(), int(self.limit), "start")]
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, outcome="success", latency=None):
+        """outcome is success, throttled (429), error or anything else to leave the limit alone"""
+        with self._condition:
+            self.in_flight -= 1
+            before = int(self.limit)
+            reason = None
+            if outcome == "success":
+                reason = self._on_success(latency)
+            elif outcome in ("throttled", "error"):
+                self.throttled += outcome == "throttled"
+                reason = self._decrease(DECREASE_FACTOR, outcome)
+            if int(self.limit) != before:
+                self._log(reason)
+            self._condition.notify_all()
+
+    def _on_success(self, latency):
+        if latency is not None:
+            self.short_latency = latency if self.short_latency is None else \
+                SHORT_ALPHA * latency + (1 - SHORT_ALPHA) * self.short_latency
+            self.long_latency = latency if self.long_latency is None else \
+                LONG_ALPHA * latency + (1 - LONG_ALPHA) * self.long_latency
+            if self.short_latency > self.long_latency * LATENCY_TOLERANCE:
+                return self._decrease(GRADIENT_FACTOR, "latency")
+        self.limit = min(self.limit + 1 / self.limit, self.maximum)
+        return "increase"
+
+    def _decrease(self, factor, reason):
+        now = time.monotonic()
+        if now - self.last_decrease < (self.short_latency or 1.0):
+            return reason
+        self.last_decrease = now
+        self.limit = max(self.limit * factor, self.minimum)
+        return reason
+
+    def _log(self, reason):
+        now = time.time()
+        self.history.append((now, int(self.limit), reason))
+        print(f"Concurrency of {self.model}: {int(self.limit)} in flight ({reason})")
+        if self.log_file:
+            new_file = not os.path.exists(self.log_file)
+            with open(self.log_file, 'a') as f:
+                if new_file:
+                    f.write("time,model,limit,reason\n")
+                f.write(f"{now:.3f},{self.model},{int(self.limit)},{reason}\n")
+
+
+# one limiter per model for the whole process
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def limiter(model, **config):
+    with _limiters_lock:
+        if model not in _limiters:
+            _limiters[model] = AIMDLimiter(model, **config)
+        return _limiters[model]
+
+def report():
+    for model, model_limiter in sorted(_limiters.items()):
+        limits = [limit for _, limit, _ in model_limiter.history]
+        print(f"Concurrency of {model}: final {int(model_limiter.limit)}, range {min(limits)}-{max(limits)}, "
+              f"{len(limits) - 1} change(s), {model_limiter.throttled} throttled call(s)")
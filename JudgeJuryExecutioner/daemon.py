@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import uuid
+import queue
+import threading
+import socketserver
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import metrics
+
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+MAX_FINISHED_JOBS = 1000    # finished jobs kept for polling, oldest are dropped first
+MAX_WAIT_SECONDS = 600
+
+class Job:
+    def __init__(self, request):
+        self.id = uuid.uuid4().hex
+        self.request = request
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {"id": self.id, "status": self.status, "request": self.request, "result": self.result,
+                "error": self.error, "created": self.created, "finished": self.finished}
+
+
+class ValidationDaemon:
+    """
+    Long running process that keeps the Judge's HTTP client, parsed samples, caches and circuit
+    breakers warm between jobs. Jobs are queued and run by a fixed number of worker threads;
+    run_job(request) does the actual validation and returns a JSON serializable result.
+    """
+
+    def __init__(self, run_job, workers=1):
+        self.run_job = run_job
+        self.workers = workers
+        self.jobs = OrderedDict()
+        self.queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def submit(self, request):
+        if not isinstance(request, dict):
+            raise ValueError(f"Expected a JSON object, got {type(request).__name__}")
+        missing = [key for key in ("upstream_patch", "backported_patch", "target") if not request.get(key)]
+        if missing:
+            raise ValueError(f"Missing fields: {', '.join(missing)}")
+        not_text = [key for key in ("upstream_patch", "backported_patch", "target", "sample")
+                    if request.get(key) is not None and not isinstance(request[key], str)]
+        if not_text:
+            raise ValueError(f"Fields must be strings: {', '.join(not_text)}")
+        job = Job(request)
+        with self._lock:
+            self.jobs[job.id] = job
+        self.queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {"uptime": round(time.time() - self.started, 1), "workers": self.workers,
+                "queued": statuses.count("queued"), "running": statuses.count("running"),
+                "done": statuses.count("done"), "failed": statuses.count("failed")}
+
+    def _forget_old_jobs(self):
+        with self._lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+            for job_id in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+                del self.jobs[job_id]
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            job.status = "running"
+            try:
+                job.result = self.run_job(job.request)
+                job.status = "done"
+            except Exception as e:
+                print(f"Warning: Job {job.id} failed: {e}")
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = "failed"
+            job.finished = time.time()
+            job.done.set()
+            self._forget_old_jobs()
+
+    def start_workers(self):
+        metrics.QUEUE_DEPTH.track(lambda: {("daemon_jobs",): self.queue.qsize()})
+        for index in range(self.workers):
+            threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True).start()
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /jobs         {"upstream_patch": path, "backported_patch": path, "target": dir or target.json, "sample": name}
+    GET  /jobs/<id>    job status and result, ?wait=N blocks up to N seconds for it to finish
+    GET  /health       queue and worker stats
+    GET  /metrics      Prometheus text format
+    """
+    validation_daemon = None
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip("/") != "/jobs":
+            return self._reply(404, {"error": "not found"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            job = self.validation_daemon.submit(request)
+        except ValueError as e:
+            return self._reply(400, {"error": str(e)})
+        self._reply(202, {"id": job.id, "status": job.status})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        if parts == ["health"]:
+            return self._reply(200, self.validation_daemon.stats())
+        if parts == ["metrics"]:
+            body = metrics.REGISTRY.exposition().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            return self.wfile.write(body)
+        if len(parts) == 2 and parts[0] == "jobs":
+            job = self.validation_daemon.get(parts[1])
+            if job is None:
+                return self._reply(404, {"error": "unknown job"})
+            wait = parse_qs(url.query).get("wait", ["0"])[0]
+            try:
+                job.done.wait(min(float(wait), MAX_WAIT_SECONDS))
+            except ValueError:
+                return self._reply(400, {"error": f"invalid wait {wait!r}"})
+            return self._reply(200, job.to_dict())
+        self._reply(404, {"error": "not found"})
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def make_server(address, daemon):
+    """address is HOST:PORT or unix:/path/to.sock"""
+    handler = type("Handler", (DaemonRequestHandler,), {"validation_daemon": daemon})
+    if address.startswith("unix:"):
+        path = address[len("unix:"):]
+        if os.path.exists(path):
+            os.remove(path)
+        return UnixHTTPServer(path, handler)
+    host, _, port = address.rpartition(":")
+    return ThreadingHTTPServer((host or "127.0.0.1", int(port)), handler)
+
+def serve(address, run_job, workers=1):
+    daemon = ValidationDaemon(run_job, workers)
+    daemon.start_workers()
+    server = make_server(address, daemon)
+    print(f"Validation daemon listening on {address} with {workers} worker(s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,93 @@
+import os
+import json
+import hashlib
+import threading
+from targets import related_code
+
+
+RESULT_CACHE_FILE = "result_fingerprints.json"
+REGION_MARGIN = 50      # target lines around each backport hunk that count as its region
+FINGERPRINT_PARTS = ("upstream", "backport", "target", "config")
+
+def hunks_text(patched_file):
+    """Hunk bodies without the @@ line numbers, so hunks shifted by edits elsewhere keep their fingerprint"""
+    return "".join(str(line) for hunk in patched_file for line in hunk)
+
+def target_region(target_code, backported_file, margin=REGION_MARGIN):
+    """Target lines the backport hunks touch, with margin lines of surrounding context"""
+    lines = target_code.splitlines(keepends=True)
+    selected = set()
+    for hunk in backported_file:
+        start = max(hunk.source_start - 1 - margin, 0)
+        end = min(hunk.source_start - 1 + hunk.source_length + margin, len(lines))
+        selected.update(range(start, end))
+    return "".join(lines[index] for index in sorted(selected))
+
+def digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def file_fingerprint(upstream_file, backported_file, target_code, config=""):
+    """
+    Per-part digests of a file pair: upstream hunks, backport hunks, target region (with the cross-file
+    context of the symbol index) and the judging config (route, models, ...). A stored result is only
+    valid while all four parts match.
+    """
+    return {
+        "upstream": digest(hunks_text(upstream_file)),
+        "backport": digest(hunks_text(backported_file)),
+        "target": digest(target_region(target_code, backported_file) + (related_code(backported_file) or "")),
+        "config": digest(config),
+    }
+
+def changed_parts(old, new):
+    return [part for part in FINGERPRINT_PARTS if old.get(part) != new.get(part)]
+
+
+class ResultStore:
+    """
+    Per-file results of earlier runs keyed by sample and file path, each stored with the fingerprint
+    it was judged at. Kept as a JSON file like the latency history.
+    """
+
+    def __init__(self, path=RESULT_CACHE_FILE):
+        self.path = path
+        self.entries = {}
+        self.reused = 0
+        self.rejudged = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(sample, file_path):
+        return f"{sample}:{file_path}"
+
+    def lookup(self, sample, file_path, fingerprint):
+        """Stored result when the fingerprint is unchanged, None (and a note on what changed) otherwise"""
+        with self._lock:
+            entry = self.entries.get(self.key(sample, file_path))
+            if entry and entry["fingerprint"] == fingerprint:
+                self.reused += 1
+                return entry["result"]
+            self.rejudged += 1
+        if entry:
+            print(f"Re-judging {file_path} of sample {sample}: {', '.join(changed_parts(entry['fingerprint'], fingerprint))} changed")
+        return None
+
+    def record(self, sample, file_path, fingerprint, result):
+        # failed and skipped files are judged again next time
+        if not isinstance(result, dict) or result.get("is_correct") in ("Unknown", "Skipped"):
+            return
+        with self._lock:
+            self.entries[self.key(sample, file_path)] = {"fingerprint": fingerprint, "result": result}
+
+    def save(self):
+        with self._lock:
+            with open(self.path + ".tmp", 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(self.path + ".tmp", self.path)
+
+    def report(self):
+        if self.reused or self.rejudged:
+            print(f"Incremental: {self.reused} file result(s) reused, {self.rejudged} file(s) judged")
@@ -0,0 +1,33 @@
+import threading
+from collections import defaultdict
+
+
+# before_sample/after_sample:  sample, (after: verdict, seconds)              process_patches, daemon jobs
+# before_parse/after_parse:    upstream_patch, backported_patch, (after: file_pairs, seconds)
+# before_stage/after_stage:    stage, path, (after: result, seconds)        compare, abstract, validate of the Judge
+# before_call/after_call:      stage, model, (after: content, seconds)      every model call, also map-reduce chunks and votes
+# on_result:                   sample, file_path, result                     every file result of a finalized sample
+EVENTS = ("before_sample", "after_sample", "before_parse", "after_parse", "before_stage", "after_stage",
+          "before_call", "after_call", "on_result")
+
+_hooks = defaultdict(list)
+_lock = threading.Lock()
+
+def register(event, callback):
+    """Call callback(**details) on every event, from the thread the event happens on"""
+    if event not in EVENTS:
+        raise ValueError(f"Unknown hook event {event!r}, choose from {EVENTS}")
+    with _lock:
+        _hooks[event] = _hooks[event] + [callback]
+
+def unregister(event, callback):
+    with _lock:
+        _hooks[event] = [hook for hook in _hooks[event] if hook is not callback]
+
+def emit(event, **details):
+    # the list is replaced on every change, so it can be iterated without the lock
+    for callback in _hooks.get(event, ()):
+        try:
+            callback(**details)
+        except Exception as e:
+            print(f"Warning: {event} hook {getattr(callback, '__name__', callback)} failed: {e}")
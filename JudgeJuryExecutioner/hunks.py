@@ -0,0 +1,127 @@
+import difflib
+from concurrent.futures import ThreadPoolExecutor
+from targets import related_code
+
+
+DIFFERENCE_SEVERITY = ["None", "Trivia", "Minor", "Testing", "Functional", "Major"]
+POSITION_WEIGHT = 0.2
+
+class HunkGroup:
+    """
+    A few hunks of a PatchedFile that are judged together.
+    Behaves like a PatchedFile as far as the Judge and the prompts are concerned: it has a path,
+    iterates over its hunks and renders as a patch with the file header.
+    """
+
+    def __init__(self, patched_file, hunks, first_index):
+        self.patched_file = patched_file
+        self.hunks = hunks
+        self.first_index = first_index
+        self.path = patched_file.path
+
+    def __iter__(self):
+        return iter(self.hunks)
+
+    def __len__(self):
+        return len(self.hunks)
+
+    def __str__(self):
+        header = f"--- {self.patched_file.source_file}\n+++ {self.patched_file.target_file}\n"
+        return header + "".join(str(hunk) for hunk in self.hunks)
+
+    @property
+    def label(self):
+        last_index = self.first_index + len(self.hunks) - 1
+        return f"hunks {self.first_index + 1}-{last_index + 1}" if self.hunks else "no hunks"
+
+def changed_text(hunk):
+    return "".join(line.value for line in hunk if line.is_added or line.is_removed)
+
+def split_into_hunk_groups(upstream_file, backported_file, group_size):
+    """
+    Split the upstream file into groups of group_size consecutive hunks and give every backported
+    hunk to the upstream group whose changed lines are most similar to it. Backported hunks that
+    resemble nothing stay at their relative position. Returns [(upstream group, backported group)].
+    """
+    upstream_hunks = list(upstream_file)
+    backported_hunks = list(backported_file)
+    starts = range(0, len(upstream_hunks), group_size)
+    upstream_groups = [upstream_hunks[start:start + group_size] for start in starts]
+
+    assigned = [[] for _ in upstream_groups]
+    for position, backported_hunk in enumerate(backported_hunks):
+        matcher = difflib.SequenceMatcher(None, b=changed_text(backported_hunk), autojunk=False)
+        relative_position = position / max(len(backported_hunks), 1)
+        best_group, best_score = None, 0.0
+        for index, upstream_hunk in enumerate(upstream_hunks):
+            matcher.set_seq1(changed_text(upstream_hunk))
+            # near identical hunks (e.g. the same one-line fix in many places) are told apart by position
+            penalty = POSITION_WEIGHT * abs(index / max(len(upstream_hunks), 1) - relative_position)
+            if matcher.real_quick_ratio() - penalty <= best_score or matcher.quick_ratio() - penalty <= best_score:
+                continue
+            score = matcher.ratio() - penalty
+            if score > best_score:
+                best_group, best_score = index // group_size, score
+        if best_group is None:
+            best_group = min(int(relative_position * len(upstream_groups)), len(upstream_groups) - 1)
+        assigned[best_group].append(backported_hunk)
+
+    return [
+        (HunkGroup(upstream_file, group, start), HunkGroup(backported_file, hunks, 0))
+        for start, group, hunks in zip(starts, upstream_groups, assigned)
+    ]
+
+def severity(difference_type):
+    """Unknown difference types (e.g. "Security/Functionality") count as the most severe"""
+    if difference_type in DIFFERENCE_SEVERITY:
+        return DIFFERENCE_SEVERITY.index(difference_type)
+    return len(DIFFERENCE_SEVERITY)
+
+def merge_group_results(labelled_results):
+    """Merge [(label, result)] of the hunk groups into the single per-file result process_patches expects"""
+    is_correct = "Yes"
+    difference_type = "None"
+    explanations = []
+    fixes = []
+    for label, result in labelled_results:
+        if not isinstance(result, dict):
+            is_correct = "No" if "'is_correct': 'No'" in str(result) else is_correct
+            explanations.append(f"[{label}] {result}")
+            continue
+
+        if result.get("is_correct") == "No":
+            is_correct = "No"
+        group_type = str(result.get("difference_type", "None"))
+        if severity(group_type) > severity(difference_type):
+            difference_type = group_type
+        if result.get("explanation"):
+            explanations.append(f"[{label}] {result['explanation']}")
+        if result.get("suggested_fixes") and result["suggested_fixes"] != "None":
+            fixes.append(f"[{label}] {result['suggested_fixes']}")
+
+    return {
+        "is_correct": is_correct,
+        "difference_type": difference_type,
+        "explanation": " ".join(explanations),
+        "suggested_fixes": " ".join(fixes)
+    }
+
+def judge_in_hunk_groups(judge, upstream_file, backported_file, target_code, group_size, cancel_event=None):
+    """
+    Fan a large file out into hunk groups. The target code is abstracted once for the whole file,
+    then every group gets its own intent comparison and validation, all groups concurrently.
+    """
+    groups = split_into_hunk_groups(upstream_file, backported_file, group_size)
+    abstract_code = judge.abstract_code_context(target_code, backported_file)
+    judge.pause("abstract", cancel_event)
+
+    def judge_group(upstream_group, backported_group):
+        # an empty backported group is still compared, the change may already exist in the target
+        discrepancies = judge.compare_intent(upstream_group, backported_group)
+        judge.pause("compare", cancel_event)
+        return judge.validate_with_context(discrepancies, backported_file.path, abstract_code, related_code(backported_file))
+
+    with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+        futures = [(upstream_group.label, executor.submit(judge_group, upstream_group, backported_group))
+                   for upstream_group, backported_group in groups]
+        return merge_group_results([(label, future.result()) for label, future in futures])
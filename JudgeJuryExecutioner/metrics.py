@@ -0,0 +1,234 @@
+import math
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+QUANTILES = (0.5, 0.95, 0.99)
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named family of values, one per combination of label values"""
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """[(suffix, label names, label values, value)] for the exposition"""
+        with self._lock:
+            return [("", self.labels, key, value) for key, value in sorted(self.values.items())]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def total(self):
+        with self._lock:
+            return sum(self.values.values())
+
+
+class Gauge(Metric):
+    """Set directly, or computed at scrape time by the callbacks added with track()"""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self.callbacks = []
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self.values[labels] = value
+
+    def track(self, callback):
+        """callback() returns {label values tuple: value}"""
+        with self._lock:
+            self.callbacks.append(callback)
+
+    def samples(self):
+        samples = super().samples()
+        with self._lock:
+            callbacks = list(self.callbacks)
+        for callback in callbacks:
+            samples += [("", self.labels, key, value) for key, value in sorted(callback().items())]
+        return samples
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][index] += 1
+                    break
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, entry in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry["buckets"]):
+                    cumulative += count
+                    samples.append(("_bucket", self.labels + ("le",), key + (format_value(bound),), cumulative))
+                samples.append(("_sum", self.labels, key, entry["sum"]))
+                samples.append(("_count", self.labels, key, entry["count"]))
+        return samples
+
+    def quantile(self, q, *labels):
+        """Estimate from the buckets, interpolated linearly inside the bucket the quantile falls in"""
+        with self._lock:
+            entry = self.values.get(labels)
+            if not entry or not entry["count"]:
+                return None
+            rank = q * entry["count"]
+            cumulative, lower = 0, 0.0
+            for bound, count in zip(self.buckets, entry["buckets"]):
+                if count and cumulative + count >= rank:
+                    if bound == math.inf:
+                        return lower
+                    return lower + (bound - lower) * (rank - cumulative) / count
+                cumulative += count
+                lower = bound if bound != math.inf else lower
+            return lower
+
+    def label_sets(self):
+        with self._lock:
+            return sorted(self.values)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name, help_text, labels, **options):
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = metric_class(name, help_text, labels, **options)
+            return self.metrics[name]
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, help_text, labels, buckets=buckets)
+
+    def exposition(self):
+        """Prometheus text format (version 0.0.4)"""
+        lines = []
+        with self._lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, names, values, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{format_labels(names, values)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# model calls, recorded by Judge._call_api
+MODEL_CALLS = REGISTRY.counter("judge_model_calls_total", "Finished model calls", ("model", "stage"))
+MODEL_FAILURES = REGISTRY.counter("judge_model_call_failures_total", "Model calls that failed after all retries",
+                                  ("model", "stage", "reason"))
+MODEL_IN_FLIGHT = REGISTRY.gauge("judge_model_calls_in_flight", "Model calls waiting for an answer", ("model", "stage"))
+MODEL_LATENCY = REGISTRY.histogram("judge_model_call_seconds", "Latency of model calls including retries", ("model", "stage"))
+PROMPT_TOKENS = REGISTRY.counter("judge_prompt_tokens_total", "Prompt tokens sent", ("model",))
+CACHED_TOKENS = REGISTRY.counter("judge_cached_prompt_tokens_total", "Prompt tokens served from the provider's prompt cache", ("model",))
+COMPLETION_TOKENS = REGISTRY.counter("judge_completion_tokens_total", "Completion tokens received", ("model",))
+# retries, 429s, breaker trips, ... counted by the resilient backend
+RESILIENCE_EVENTS = REGISTRY.counter("judge_resilience_events_total", "Retries, circuit breaker trips, fallbacks and deferrals",
+                                     ("event", "model", "reason"))
+# progress, recorded when samples are finalized
+FILES = REGISTRY.counter("judge_files_total", "Judged files by is_correct", ("is_correct",))
+SAMPLES = REGISTRY.counter("judge_samples_total", "Finalized samples by verdict", ("verdict",))
+QUEUE_DEPTH = REGISTRY.gauge("judge_queue_depth", "Items waiting in the pipeline stage queues and the daemon job queue", ("queue",))
+RUN_STARTED = time.time()
+SAMPLES_PER_MINUTE = REGISTRY.gauge("judge_samples_per_minute", "Finalized samples per minute since the process started")
+SAMPLES_PER_MINUTE.track(lambda: {(): SAMPLES.total() / max(time.time() - RUN_STARTED, 1e-9) * 60})
+CACHE_HIT_RATIO = REGISTRY.gauge("judge_prompt_cache_hit_ratio", "Share of prompt tokens served from the prompt cache", ("model",))
+CACHE_HIT_RATIO.track(lambda: {key: CACHED_TOKENS.values.get(key, 0) / tokens
+                               for key, tokens in list(PROMPT_TOKENS.values.items()) if tokens})
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """GET /metrics"""
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.exposition().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes every few seconds would drown the run's own output
+        pass
+
+def serve_metrics(address):
+    """Expose /metrics on HOST:PORT from a background thread for the rest of the run"""
+    host, _, port = address.rpartition(":")
+    server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics on http://{host or '127.0.0.1'}:{server.server_address[1]}/metrics")
+    return server
+
+def write_metrics(path):
+    with open(path, 'w') as f:
+        f.write(REGISTRY.exposition())
+    print(f"Metrics written to {path}")
+
+def report():
+    """Per model and stage call latency percentiles"""
+    for labels in MODEL_LATENCY.label_sets():
+        model, stage = labels
+        p50, p95, p99 = (MODEL_LATENCY.quantile(q, *labels) for q in QUANTILES)
+        print(f"Latency {stage} ({model}): {MODEL_CALLS.values.get(labels, 0)} call(s), "
+              f"p50 {p50:.1f}s, p95 {p95:.1f}s, p99 {p99:.1f}s")
@@ -68,24 +68,34 @@ def compare_verdicts(file1, file2):
         print("No data to compare.")
         return
 
+    # samples whose files could not all be judged are neither matches nor mismatches
+    unknown = [sample for sample in verdicts1 if verdicts2.get(sample) == "unknown"]
+
     # Find mismatches
     mismatches = {
         sample: (verdicts1[sample], verdicts2[sample])
-        for sample in verdicts1 if sample in verdicts2 and verdicts1[sample] != verdicts2[sample]
+        for sample in verdicts1 if sample in verdicts2 and verdicts1[sample] != verdicts2[sample] and sample not in unknown
     }
 
     # Calculate overlap percentage
-    matching_count = total_samples - len(mismatches)
+    matching_count = total_samples - len(mismatches) - len(unknown)
     overlap_percentage = (matching_count / total_samples) * 100
 
     print(f"Total Samples: {total_samples}")
     print(f"Mismatched Samples: {len(mismatches)}")
+    if unknown:
+        print(f"Unknown Samples (model calls failed): {len(unknown)}")
     print(f"Overlap Percentage: {overlap_percentage:.2f}%")
 
     if mismatches:
         print("\nDifferences:")
         for sample, (verdict1, verdict2) in mismatches.items():
             print(f"Sample {sample}: File1 = {verdict1}, File2 = {verdict2}")
+
+    if unknown:
+        print("\nNot judged:")
+        for sample in unknown:
+            print(f"Sample {sample}: File1 = {verdicts1[sample]}, File2 = unknown")
             
             
 #### temporary txt helper functions ###
@@ -0,0 +1,159 @@
+import time
+import queue
+import threading
+from Judge import JudgeCancelled
+from prefilter import ROUTE_CHEAP, ROUTE_FULL
+from targets import related_code
+import metrics
+
+
+STAGES = ("compare", "abstract", "validate")
+QUEUE_SIZE = 8                  # items waiting per stage before the feeder blocks
+ESTIMATED_CALL_SECONDS = 15.0   # used to turn a model's rpm into a pool size
+DEFAULT_STAGE_WORKERS = 2       # models without a known rate limit
+MAX_STAGE_WORKERS = 8
+PROGRESS_SECONDS = 30
+
+def stage_pool_sizes(backend, overrides=None):
+    """Workers per stage: as many requests in flight as the stage model's rpm allows, or the override"""
+    sizes = {}
+    for stage in STAGES:
+        rpm = backend.capabilities(stage)["rpm"]
+        if rpm:
+            sizes[stage] = max(1, min(MAX_STAGE_WORKERS, int(rpm * ESTIMATED_CALL_SECONDS / 60)))
+        else:
+            sizes[stage] = DEFAULT_STAGE_WORKERS
+    sizes.update(overrides or {})
+    return sizes
+
+
+class StageStats:
+    def __init__(self, workers):
+        self.workers = workers
+        self.active = 0
+        self.calls = 0
+        self.busy_seconds = 0.0
+
+
+class PipelineItem:
+    """One file travelling through the stages; full route files wait for compare and abstract before validate"""
+
+    def __init__(self, sample, upstream_file, backported_file, target_code, route):
+        self.sample = sample
+        self.upstream_file = upstream_file
+        self.backported_file = backported_file
+        self.target_code = target_code
+        self.route = route
+        self.discrepancies = None
+        self.abstract_code = None
+        self.error = None
+        self.pending = 2 if route == ROUTE_FULL else 1
+        self.lock = threading.Lock()
+
+
+class StagedPipeline:
+    """
+    One bounded queue and worker pool per stage, so the three models work at the same time:
+    validation of one file overlaps with the intent comparison and abstraction of the next ones.
+    Finished items come out of done as (item, result, error).
+    """
+
+    def __init__(self, judge, stage_workers, queue_size=QUEUE_SIZE):
+        self.judge = judge
+        self.queues = {stage: queue.Queue(maxsize=queue_size) for stage in STAGES}
+        self.done = queue.Queue()
+        self.stats = {stage: StageStats(stage_workers[stage]) for stage in STAGES}
+        self.cancelled = set()
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        metrics.QUEUE_DEPTH.track(lambda: {(f"pipeline_{stage}",): self.queues[stage].qsize() for stage in STAGES})
+        for stage in STAGES:
+            for index in range(self.stats[stage].workers):
+                thread = threading.Thread(target=self._work, args=(stage,), name=f"{stage}-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, item):
+        """Blocks while the first stages are full"""
+        self.queues["compare"].put(item)
+        if item.route == ROUTE_FULL:
+            self.queues["abstract"].put(item)
+
+    def cancel(self, sample):
+        """Items of sample still waiting are finished with JudgeCancelled instead of being run"""
+        self.cancelled.add(sample)
+
+    def close(self):
+        for stage in STAGES:
+            for _ in range(self.stats[stage].workers):
+                self.queues[stage].put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _call(self, stage, item):
+        if item.sample in self.cancelled:
+            raise JudgeCancelled()
+        if stage == "compare":
+            return self.judge.compare_intent(item.upstream_file, item.backported_file)
+        if stage == "abstract":
+            return self.judge.abstract_code_context(item.target_code, item.backported_file)
+        return self.judge.validate_with_context(item.discrepancies, item.backported_file.path, item.abstract_code,
+                                                related_code(item.backported_file))
+
+    def _work(self, stage):
+        stats = self.stats[stage]
+        while True:
+            item = self.queues[stage].get()
+            if item is None:
+                break
+            with self._lock:
+                stats.active += 1
+            start = time.perf_counter()
+            try:
+                result, error = self._call(stage, item), None
+            except Exception as e:
+                result, error = None, e
+            with self._lock:
+                stats.active -= 1
+                stats.calls += 1
+                stats.busy_seconds += time.perf_counter() - start
+            self._advance(stage, item, result, error)
+            if error is None:
+                self.judge.pause(stage)
+
+    def _advance(self, stage, item, result, error):
+        if stage == "validate":
+            self.done.put((item, result, error))
+            return
+        if item.route == ROUTE_CHEAP:
+            self.done.put((item, None if error else self.judge.verdict_from_discrepancies(result), error))
+            return
+
+        with item.lock:
+            if stage == "compare":
+                item.discrepancies = result
+            else:
+                item.abstract_code = result
+            item.error = item.error or error
+            item.pending -= 1
+            ready = item.pending == 0
+        if ready and item.error is not None:
+            self.done.put((item, None, item.error))
+        elif ready:
+            self.queues["validate"].put(item)
+
+    def utilization(self):
+        """Per stage queue depth, busy workers and the share of worker time spent in calls"""
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        with self._lock:
+            return {stage: {"queued": self.queues[stage].qsize(), "active": stats.active, "workers": stats.workers,
+                            "calls": stats.calls, "utilization": stats.busy_seconds / (stats.workers * elapsed)}
+                    for stage, stats in self.stats.items()}
+
+    def report(self, final=False):
+        parts = [f"{stage} {s['active']}/{s['workers']} busy, {s['queued']} queued, {s['utilization'] * 100:.0f}%"
+                 for stage, s in self.utilization().items()]
+        print(f"Pipeline{' done' if final else ''}: " + "; ".join(parts))
@@ -0,0 +1,146 @@
+import os
+import hashlib
+import tempfile
+from collections import defaultdict
+from Judge import Judge, ANSWER_RESERVE
+from sys_prompts import SYS_COMPARE_INTENT_PROMPT, SYS_ABSTRACT_CODE_PROMPT, SYS_VALIDATE_WITH_CONTEXT_PROMPT
+from abstraction import estimate_tokens, make_chunks, ABSTRACTION_TOKEN_CEILING, CHUNK_TOKENS
+from hunks import split_into_hunk_groups
+from prefilter import ROUTE_CHEAP, ROUTE_FULL, ROUTE_CALLS
+from scheduler import lpt_schedule
+from targets import related_code
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# expected answer sizes, the planner never sees a real answer
+COMPARE_ANSWER_TOKENS = 1500        # reasoning model, mostly thinking
+VALIDATE_ANSWER_TOKENS = 300
+DISCREPANCIES_TOKENS = 200          # compare answer as quoted in the validation prompt
+ABSTRACTION_RATIO = 0.5             # share of the target code the abstraction keeps
+FREE_DAILY_REQUESTS = 1000          # OpenRouter limit on ":free" models per account and day
+
+# the BPE file tiktoken downloads for cl100k_base, and the cache directories it looks in (tiktoken/load.py)
+CL100K_BASE_URL = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+
+_encoding = {}
+
+def tiktoken_cached():
+    """True when the cl100k_base file is already in tiktoken's cache, so loading it needs no network"""
+    if "TIKTOKEN_CACHE_DIR" in os.environ:
+        cache_dir = os.environ["TIKTOKEN_CACHE_DIR"]
+    elif "DATA_GYM_CACHE_DIR" in os.environ:
+        cache_dir = os.environ["DATA_GYM_CACHE_DIR"]
+    else:
+        cache_dir = os.path.join(tempfile.gettempdir(), "data-gym-cache")
+    if not cache_dir:
+        return False
+    return os.path.exists(os.path.join(cache_dir, hashlib.sha1(CL100K_BASE_URL.encode()).hexdigest()))
+
+def count_tokens(text):
+    """Token count with tiktoken's cl100k_base when it is installed and cached, chars/4 otherwise"""
+    if "encoding" not in _encoding:
+        try:
+            # get_encoding would download the file otherwise, a plan never touches the network
+            _encoding["encoding"] = tiktoken.get_encoding("cl100k_base") if tiktoken and tiktoken_cached() else None
+        except Exception as e:
+            print(f"Warning: tiktoken encoding unavailable ({e}), estimating tokens from characters.")
+            _encoding["encoding"] = None
+    if _encoding["encoding"] is None:
+        return estimate_tokens(text)
+    return len(_encoding["encoding"].encode(text, disallowed_special=()))
+
+def prompt_tokens(system_prompt, prompt_parts):
+    return count_tokens(system_prompt) + sum(count_tokens(text) for text, _ in prompt_parts)
+
+
+class RunPlan:
+    """Calls and tokens per model of a planned run, and the per-file cost estimates for scheduling"""
+
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self.prompt_tokens = defaultdict(int)
+        self.completion_tokens = defaultdict(int)
+        self.file_costs = []
+        self.files = 0
+
+    def add_call(self, model, prompt, completion):
+        self.calls[model] += 1
+        self.prompt_tokens[model] += prompt
+        self.completion_tokens[model] += completion
+
+    def wall_time(self, workers, rate_limits):
+        """Larger of the LPT makespan on the workers and the time the per-minute rate limits allow"""
+        _, _, makespan = lpt_schedule(self.file_costs, workers)
+        rate_bound = max([self.calls[model] / rpm * 60 for model, rpm in rate_limits.items() if rpm] or [0.0])
+        return max(makespan, rate_bound), makespan, rate_bound
+
+    def report(self, workers, rate_limits):
+        print(f"Plan for {self.files} files ({'tiktoken' if _encoding.get('encoding') else 'chars/4'} token counts):")
+        for model in sorted(self.calls):
+            rpm = rate_limits.get(model)
+            print(f"  {model}: {self.calls[model]} calls, {self.prompt_tokens[model]} prompt tokens, "
+                  f"~{self.completion_tokens[model]} completion tokens"
+                  f"{f', limited to {rpm}/min' if rpm else ''}")
+        total, makespan, rate_bound = self.wall_time(workers, rate_limits)
+        print(f"  total: {sum(self.calls.values())} calls, {sum(self.prompt_tokens.values())} prompt tokens, "
+              f"~{sum(self.completion_tokens.values())} completion tokens")
+        print(f"  estimated wall time with {workers} worker(s): {total / 60:.1f} min "
+              f"(workers {makespan / 60:.1f} min, rate limits {rate_bound / 60:.1f} min)")
+        free_calls = sum(calls for model, calls in self.calls.items() if model.endswith(":free"))
+        if free_calls > FREE_DAILY_REQUESTS:
+            print(f"Warning: {free_calls} calls to free models exceed the daily limit of {FREE_DAILY_REQUESTS}, "
+                  f"the run needs about {free_calls / FREE_DAILY_REQUESTS:.1f} days.")
+
+
+def rate_limits(backend, stages=("compare", "abstract", "validate")):
+    return {backend.model_for(stage): backend.capabilities(stage)["rpm"] for stage in stages}
+
+def plan_file(plan, backend, upstream_file, backported_file, target_code, route, hunk_group_size=None):
+    """Render the prompts a file would send on its route and add their calls to the plan"""
+    compare_model = backend.model_for("compare")
+    pairs = [(upstream_file, backported_file)]
+    if route == ROUTE_FULL and hunk_group_size and len(upstream_file) > hunk_group_size:
+        pairs = split_into_hunk_groups(upstream_file, backported_file, hunk_group_size)
+
+    for upstream_part, backported_part in pairs:
+        plan.add_call(compare_model, prompt_tokens(SYS_COMPARE_INTENT_PROMPT, Judge._compare_prompt(upstream_part, backported_part)),
+                      COMPARE_ANSWER_TOKENS)
+    if route == ROUTE_CHEAP:
+        return
+
+    # abstraction: one call, or one per chunk when the target needs a map-reduce abstraction
+    abstract_model = backend.model_for("abstract")
+    abstract_prompt = Judge._abstract_prompt(target_code, backported_file)
+    abstract_tokens = prompt_tokens(SYS_ABSTRACT_CODE_PROMPT, abstract_prompt)
+    if abstract_tokens > backend.capabilities("abstract")["context"] - ANSWER_RESERVE:
+        for _, _, text in make_chunks(target_code, backported_file.path, CHUNK_TOKENS):
+            chunk_tokens = prompt_tokens(SYS_ABSTRACT_CODE_PROMPT, Judge._abstract_prompt(text, backported_file))
+            plan.add_call(abstract_model, chunk_tokens, int(count_tokens(text) * ABSTRACTION_RATIO))
+        abstraction_tokens = ABSTRACTION_TOKEN_CEILING
+    else:
+        abstraction_tokens = int(count_tokens(target_code) * ABSTRACTION_RATIO)
+        plan.add_call(abstract_model, abstract_tokens, abstraction_tokens)
+
+    validate_model = backend.model_for("validate")
+    validate_tokens = prompt_tokens(SYS_VALIDATE_WITH_CONTEXT_PROMPT, Judge._validate_prompt("", backported_file.path, "", related_code(backported_file)))
+    # every vote of --votes counts, voting may stop earlier
+    for _ in range(len(pairs) * Judge.votes):
+        plan.add_call(validate_model, validate_tokens + DISCREPANCIES_TOKENS + abstraction_tokens, VALIDATE_ANSWER_TOKENS)
+
+def plan_run(file_pairs_by_sample, backend, cost_model, hunk_group_size=None):
+    """
+    Dry run: file_pairs_by_sample maps each sample to its collected (upstream, backported, target, route)
+    pairs. Nothing is sent, the plan holds the calls and tokens every model would see.
+    """
+    plan = RunPlan()
+    for sample, file_pairs in file_pairs_by_sample.items():
+        for upstream_file, backported_file, target_code, route in file_pairs:
+            plan.files += 1
+            plan_file(plan, backend, upstream_file, backported_file, target_code, route, hunk_group_size)
+            cost = cost_model.estimate(sample, upstream_file, backported_file, target_code)
+            plan.file_costs.append(((sample, backported_file.path), cost * ROUTE_CALLS[route] / ROUTE_CALLS[ROUTE_FULL]))
+    return plan
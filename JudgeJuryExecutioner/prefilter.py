@@ -0,0 +1,176 @@
+import os
+import re
+import json
+from collections import Counter
+from trivia import TriviaDetector
+
+
+# routes a PatchedFile can take
+ROUTE_SKIP = "skip"     # no model call at all
+ROUTE_CHEAP = "cheap"   # intent comparison only
+ROUTE_FULL = "full"     # compare, abstract and validate
+ROUTE_LOCAL = "local"   # changes differ only in trivia, resolved without a model call
+
+# model calls each route costs, used for the savings report
+ROUTE_CALLS = {ROUTE_SKIP: 0, ROUTE_LOCAL: 0, ROUTE_CHEAP: 1, ROUTE_FULL: 3}
+
+SNIFF_BYTES = 8192
+
+# header markers of generated files, only looked for in the first lines of the file
+GENERATED_MARKERS = ["@generated", "DO NOT EDIT"]
+GENERATED_HEADER_LINES = 5
+
+DEFAULT_RULES = [
+    {"name": "restructured-text", "route": ROUTE_SKIP, "globs": ["*.rst"]},
+    {"name": "news-entries", "route": ROUTE_SKIP, "globs": ["Misc/NEWS.d/**", "NEWS*", "ChangeLog*", "CHANGES*"]},
+    {"name": "binary-diff", "route": ROUTE_SKIP, "binary": True},
+    {"name": "documentation", "route": ROUTE_CHEAP, "globs": ["Doc/**", "doc/**", "docs/**", "*.md"]},
+    {"name": "generated-file", "route": ROUTE_CHEAP, "generated": True},
+]
+
+def glob_pattern(glob):
+    """
+    Regex of a path glob: "*" and "?" stay within a path segment, "**" spans segments and a glob
+    without "/" matches the file name in any directory
+    """
+    regex = []
+    index = 0
+    while index < len(glob):
+        if glob.startswith("**/", index):
+            regex.append("(?:.*/)?")
+            index += 3
+        elif glob.startswith("**", index):
+            regex.append(".*")
+            index += 2
+        else:
+            regex.append({"*": "[^/]*", "?": "[^/]"}.get(glob[index], re.escape(glob[index])))
+            index += 1
+    prefix = "" if "/" in glob else "(?:.*/)?"
+    return re.compile(prefix + "".join(regex) + r"\Z")
+
+class PreClassifier:
+    """
+    Rule engine deciding which route a PatchedFile takes before any network call.
+    Rules are checked in order and the first matching rule wins. A rule matches when all of its
+    conditions hold:
+        globs:            path globs for the file path, see glob_pattern
+        binary:           the diff is a binary diff or the target file contains NUL bytes
+        generated:        the first lines of the target (of the added file for new files) have a generated-file marker
+        content_patterns: regexes searched in the target head and the added lines
+    """
+
+    def __init__(self, rules=None, default_route=ROUTE_FULL, trivia_check=True):
+        self.rules = [self._compile(rule) for rule in (DEFAULT_RULES if rules is None else rules)]
+        self.default_route = default_route
+        self.hits = Counter()
+        self.routes = Counter()
+        self.trivia = TriviaDetector(enabled=trivia_check)
+
+    @classmethod
+    def from_file(cls, path, trivia_check=True):
+        """Load rules from a JSON file: {"rules": [...], "default_route": "full"}"""
+        with open(path, 'r') as f:
+            config = json.load(f)
+        return cls(config.get("rules", DEFAULT_RULES), config.get("default_route", ROUTE_FULL), trivia_check)
+
+    @staticmethod
+    def _compile(rule):
+        if rule.get("route") not in ROUTE_CALLS:
+            raise ValueError(f"Rule {rule.get('name')} has an unknown route {rule.get('route')!r}")
+        compiled = dict(rule)
+        compiled["content_patterns"] = [re.compile(pattern) for pattern in rule.get("content_patterns", [])]
+        if "globs" in rule:
+            compiled["globs"] = [glob_pattern(glob) for glob in rule["globs"]]
+        return compiled
+
+    #### sniffing ####
+
+    @staticmethod
+    def _target_head(target_path, targets=None):
+        if targets is not None:
+            return targets.read_head(target_path, SNIFF_BYTES)
+        if not target_path or not os.path.isfile(target_path):
+            return b""
+        with open(target_path, 'rb') as f:
+            return f.read(SNIFF_BYTES)
+
+    @staticmethod
+    def _added_text(patched_files):
+        lines = []
+        for patched_file in patched_files:
+            if patched_file is None:
+                continue
+            for hunk in patched_file:
+                lines.extend(line.value for line in hunk if line.is_added)
+        return "".join(lines)
+
+    def _matches(self, rule, path, patched_files, sniff):
+        if "globs" in rule and not any(pattern.match(path) for pattern in rule["globs"]):
+            return False
+        if rule.get("binary") and not sniff("binary"):
+            return False
+        if rule.get("generated") and not sniff("generated"):
+            return False
+        if rule["content_patterns"]:
+            text = sniff("text")
+            if not any(pattern.search(text) for pattern in rule["content_patterns"]):
+                return False
+        return True
+
+    def classify(self, upstream_file, backported_file=None, target_path=None, targets=None):
+        """
+        Returns (route, rule name) for a file pair, rule name is None when the default route applies.
+        target_path is a file path, or a path within targets (a target provider) when one is given.
+        """
+        patched_files = [upstream_file, backported_file]
+        cache = {}
+
+        def sniff(kind):
+            # content is only read when a rule actually needs it
+            if kind not in cache:
+                if kind == "binary":
+                    cache[kind] = any(f is not None and f.is_binary_file for f in patched_files) \
+                        or b"\0" in self._target_head(target_path, targets)
+                elif kind == "text":
+                    head = self._target_head(target_path, targets).decode("utf-8", errors="replace")
+                    cache[kind] = head + self._added_text(patched_files)
+                elif kind == "generated":
+                    head = self._target_head(target_path, targets).decode("utf-8", errors="replace")
+                    if not head:
+                        # a file the patches create has its header in the added lines
+                        head = self._added_text([f for f in patched_files if f is not None and f.is_added_file])
+                    lines = head.splitlines()[:GENERATED_HEADER_LINES]
+                    cache[kind] = any(marker in line for line in lines for marker in GENERATED_MARKERS)
+            return cache[kind]
+
+        route, rule_name = self.default_route, None
+        for rule in self.rules:
+            if self._matches(rule, upstream_file.path, patched_files, sniff):
+                route, rule_name = rule["route"], rule["name"]
+                break
+
+        self.hits[rule_name or "default"] += 1
+        self.routes[route] += 1
+        return route, rule_name
+
+    def resolve_locally(self, upstream_file, backported_file, route):
+        """
+        Second look once both files are known: a pair whose changes differ only in trivia is moved
+        to the local route. Returns the (possibly updated) route.
+        """
+        if route in (ROUTE_SKIP, ROUTE_LOCAL) or not self.trivia.check(upstream_file, backported_file, ROUTE_CALLS[route]):
+            return route
+        self.routes[route] -= 1
+        self.routes[ROUTE_LOCAL] += 1
+        return ROUTE_LOCAL
+
+    def report(self, seconds_per_call=15.0):
+        """Per-rule hit counts and the model calls the pre-classifier saved compared to judging everything"""
+        if not self.routes:
+            return
+        saved = sum(count * (ROUTE_CALLS[ROUTE_FULL] - ROUTE_CALLS[route]) for route, count in self.routes.items())
+        print("Pre-classifier:")
+        for rule_name, count in self.hits.most_common():
+            print(f"  {rule_name}: {count} file(s)")
+        print(f"  routes: {dict(self.routes)}, model calls saved: {saved}")
+        self.trivia.report(seconds_per_call)
@@ -0,0 +1,100 @@
+import os
+import io
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import hooks
+from sharding import in_ranges
+
+
+PROFILE_DIR = "profiles"
+TOP_ENTRIES = 40
+TRACEMALLOC_FRAMES = 10
+
+class SampleProfiler:
+    """
+    cProfile and/or tracemalloc capture of selected samples through the before_sample/after_sample
+    hooks. Writes profile_<sample>.prof (for snakeviz, pstats, ...), profile_<sample>.txt with
+    the top functions by cumulative time, and tracemalloc_<sample>.txt with the allocations that
+    grew the most while the sample ran. cProfile only sees the thread running the sample, so calls
+    made on worker pools (hunk groups, map-reduce, votes) show up as waits.
+    """
+
+    def __init__(self, output_dir, profile_ranges=None, memory_ranges=None):
+        self.output_dir = output_dir
+        self.profile_ranges = profile_ranges or []
+        self.memory_ranges = memory_ranges or []
+        self.active = {}
+        self.tracing = 0
+        self._lock = threading.Lock()
+
+    def install(self):
+        hooks.register("before_sample", self.before_sample)
+        hooks.register("after_sample", self.after_sample)
+
+    @staticmethod
+    def selected(sample, ranges):
+        try:
+            return in_ranges(sample, ranges)
+        except (TypeError, ValueError, AttributeError):
+            # daemon jobs without a numeric sample name
+            return False
+
+    def before_sample(self, sample, **details):
+        profiler, snapshot = None, None
+        if self.selected(sample, self.memory_ranges):
+            with self._lock:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(TRACEMALLOC_FRAMES)
+                self.tracing += 1
+            snapshot = tracemalloc.take_snapshot()
+        if self.selected(sample, self.profile_ranges):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:
+                # only one profiler can be active at a time, e.g. two profiled daemon jobs at once
+                print(f"Warning: Not profiling sample {sample}: {e}")
+                profiler = None
+        if profiler or snapshot:
+            self.active[sample] = (profiler, snapshot, time.perf_counter())
+
+    def after_sample(self, sample, **details):
+        profiler, snapshot, start = self.active.pop(sample, (None, None, None))
+        if profiler is None and snapshot is None:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        if profiler is not None:
+            profiler.disable()
+            self.write_profile(sample, profiler)
+        if snapshot is not None:
+            self.write_memory(sample, snapshot, tracemalloc.take_snapshot())
+            with self._lock:
+                self.tracing -= 1
+                if not self.tracing:
+                    tracemalloc.stop()
+        print(f"Profiled sample {sample} ({time.perf_counter() - start:.1f}s), artifacts in {self.output_dir}")
+
+    def write_profile(self, sample, profiler):
+        profiler.dump_stats(os.path.join(self.output_dir, f"profile_{sample}.prof"))
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(TOP_ENTRIES)
+        with open(os.path.join(self.output_dir, f"profile_{sample}.txt"), 'w') as f:
+            f.write(text.getvalue())
+
+    def write_memory(self, sample, before, after):
+        peak = tracemalloc.get_traced_memory()[1]
+        # leave out what the profilers themselves allocate
+        ignored = [tracemalloc.Filter(False, module.__file__) for module in (cProfile, pstats, tracemalloc)]
+        before, after = before.filter_traces(ignored), after.filter_traces(ignored)
+        with open(os.path.join(self.output_dir, f"tracemalloc_{sample}.txt"), 'w') as f:
+            f.write(f"Peak traced memory: {peak / 1e6:.1f} MB\n\n")
+            f.write(f"Top {TOP_ENTRIES} allocation sites by growth during sample {sample}:\n")
+            for stat in after.compare_to(before, "lineno")[:TOP_ENTRIES]:
+                f.write(f"{stat}\n")
+            f.write("\nLargest allocations still alive, with tracebacks:\n")
+            for stat in after.statistics("traceback")[:5]:
+                f.write(f"{stat.size / 1e6:.2f} MB in {stat.count} block(s)\n")
+                f.write("\n".join(f"    {line}" for line in stat.traceback.format()) + "\n")
@@ -1,5 +1,9 @@
+# Prompts are laid out for provider-side prefix caching: the static instructions come first,
+# followed by the content shared between calls (target code), and the per-call content last.
+# Judge sends every *_PROMPT as its own message part, so a cache breakpoint can follow it.
+
 # Compare Intent Prompt
-COMPARE_INTENT_PROMPT = """Analyze the following upstream patch and backported patch. 
+COMPARE_INTENT_PROMPT = """Analyze the following upstream patch and backported patch.
 Identify any discrepancies in intent, key logic changes, or security/functionality goals.
 Consider the upstream patch as holy, without faults and judge the backported patch.
 Focus on changes made by the upstream and backported patches. Some cases to consider:
@@ -11,24 +15,33 @@ Consider these critical:
 - API/ABI version markers
 - Backward compatibility breaks
 
-Upstream Patch:
-{upstream_patch}
-
-Backported Patch:
-{backported_patch}
-
 Output strictly as JSON, without any extra summaries or artifacts:
-{{
+{
     "discrepancies": ["List of intent/logic differences"],
     "security_risk": "Yes/No",
     "functionality_risk": "Yes/No"
-}}
+}
 
 IMPORTANT: Respond only with valid JSON. Do not write a preamble or summary.
 """
 
+COMPARE_INTENT_INPUT = """
+Upstream Patch:
+{upstream_patch}
+
+Backported Patch:
+{backported_patch}
+"""
+
+COMPARE_INTENT_DELTA = """
+The patches of {path} were reduced locally to a structured delta. Changes that are the same in both
+patches (ignoring comments and whitespace) are only named; changes that differ or exist in only one
+patch are shown per function, class, constant or import as removed (-) and added (+) lines.
+
+{delta}"""
+
 # Abstract Code Context Prompt
-ABSTRACT_CODE_PROMPT = """You are an expert at patch backporting. Process this code and patch to create focused context:
+ABSTRACT_CODE_PROMPT = """You are an expert at patch backporting. Process the target code and backport patch below to create focused context:
 1. Keep all class/function/variable names.
 2. Keep full implementation for functions modified in the patch or those DIRECTLY relevant to understanding the changes.
 3. Abstract other functions to signatures with '# ...'.
@@ -37,13 +50,17 @@ ABSTRACT_CODE_PROMPT = """You are an expert at patch backporting. Process this c
 6. Preserve any functions/variables directly called or modified by the backport patch.
 7. Include data structures passed between preserved functions.
 
-Backport Patch:
-{backport_patch}
+Output ONLY the abstracted code.
+"""
 
+ABSTRACT_CODE_TARGET = """
 Target Code:
 {target_code}
+"""
 
-Output ONLY the abstracted code.
+ABSTRACT_CODE_INPUT = """
+Backport Patch:
+{backport_patch}
 """
 
 # Validate with Context Prompt
@@ -58,12 +75,7 @@ Non-critical functions have been abstracted to only their names, while critical
 
 **Task**:
 Review the discrepancies between the upstream and backported patches. Use the abstracted target code to determine if these discrepancies are justified or problematic.
-
-**Input**:
 Discrepancies include judgment from a previous expert comparing the backported and upstream patches.
-- Discrepancies: {discrepancies}
-- Backported Patch: {backported_patch}
-- Abstracted Target Code: {target_code}
 
 **Instructions**:
 1. Differences in function names or implementations are not necessarily errors if they achieve the same intent and are part of the target codebase's design.
@@ -74,12 +86,25 @@ Discrepancies include judgment from a previous expert comparing the backported a
 **Output Format**:
 You MUST follow this example format.
 Output strictly as JSON, without any extra summaries or artifacts:
-{{
+{
     "is_correct": "No",
     "difference_type": "Major",
     "explanation": "The missing RCSID change could potentially cause maintenance issues.",
     "suggested_fixes": "Change the RCSID to match the upstream patch."
-}}
+}
 
 Respond only with valid JSON. Do not write a preamble or summary.
 """
+
+VALIDATE_WITH_CONTEXT_TARGET = """
+**Input**:
+- Abstracted Target Code: {target_code}
+"""
+
+VALIDATE_WITH_CONTEXT_RELATED = """- Related code elsewhere in the target tree (definitions, uses and similar code of the changed identifiers):
+{related_code}
+"""
+
+VALIDATE_WITH_CONTEXT_INPUT = """- Backported Patch: {backported_patch}
+- Discrepancies: {discrepancies}
+"""
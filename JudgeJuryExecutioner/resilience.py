@@ -0,0 +1,208 @@
+import time
+import random
+import threading
+from collections import Counter
+import openai
+import concurrency
+import metrics
+
+
+class EmptyCompletionError(Exception):
+    """The provider answered without choices or without message content"""
+
+
+# transient failures worth another attempt, everything else (auth, bad request, ...) fails right away
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,      # includes APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+    EmptyCompletionError,
+)
+RETRYABLE_STATUS = {408, 409, 429}
+
+# retry, trip and recovery counters of all resilient backends of this process, keyed by (event, model, reason)
+stats = Counter()
+_stats_lock = threading.Lock()
+
+def count(event, model, reason=""):
+    with _stats_lock:
+        stats[(event, model, reason)] += 1
+    metrics.RESILIENCE_EVENTS.inc(event, model, reason)
+
+def is_retryable(error):
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return isinstance(error, openai.APIStatusError) and (error.status_code in RETRYABLE_STATUS or error.status_code >= 500)
+
+def retry_after(error):
+    """Seconds the provider asked us to wait (Retry-After header), None when it did not say"""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def backoff_delay(attempt, base_delay, max_delay, error=None):
+    """Exponential backoff with full jitter, at least as long as a Retry-After of the provider"""
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+    requested = retry_after(error) if error is not None else None
+    return max(delay, min(requested, max_delay)) if requested is not None else delay
+
+
+class CircuitBreaker:
+    """
+    Per-model breaker. closed: calls go through. After failure_threshold consecutive retryable
+    failures it opens and rejects calls for reset_seconds, then half-opens and lets a single probe
+    through; the probe's outcome closes it again or reopens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=60):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def seconds_until_probe(self):
+        with self._lock:
+            if self.state == "closed":
+                return 0.0
+            return max(self.opened_at + self.reset_seconds - time.monotonic(), 0.0)
+
+    def allow(self):
+        """True when a call may go through now, half-opens the breaker once the reset time has passed"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half-open"
+            if self.state == "half-open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        """Returns True when this success closed a tripped breaker"""
+        with self._lock:
+            recovered = self.state != "closed"
+            self.state, self.failures, self.probing = "closed", 0, False
+            return recovered
+
+    def record_failure(self):
+        """Returns True when this failure tripped the breaker"""
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == "half-open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+class ResilientBackend:
+    """
+    Wraps a backend with classified retries (exponential backoff with jitter) and a circuit breaker
+    per model. While the breaker of a stage's model is open, calls go to the stage's fallback model,
+    or wait until the breaker lets a probe through when there is none. With adaptive_concurrency,
+    the requests in flight to each model are bounded by an AIMD limiter. Everything else is delegated.
+    """
+
+    def __init__(self, backend, fallback_models=None, max_attempts=4, base_delay=2.0, max_delay=60.0,
+                 failure_threshold=5, reset_seconds=60, adaptive_concurrency=False, concurrency_log=None):
+        self.backend = backend
+        self.fallback_models = fallback_models or {}
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.adaptive_concurrency = adaptive_concurrency
+        self.concurrency_log = concurrency_log
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def breaker(self, model):
+        with self._lock:
+            if model not in self.breakers:
+                self.breakers[model] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+            return self.breakers[model]
+
+    def complete(self, stage, system_prompt, prompt_parts, temperature=0, json_output=False, seed=None):
+        model = self.backend.model_for(stage)
+        fallback = self.fallback_models.get(stage)
+        if fallback and self.breaker(model).seconds_until_probe() > 0:
+            count("fallbacks", model, fallback)
+            model = fallback
+        body = self.backend.request_body(stage, system_prompt, prompt_parts, temperature, json_output, model=model, seed=seed)
+        return self.send(stage, body)
+
+    def _wait_for(self, breaker, model):
+        """Defer the call while the breaker of its model is open"""
+        deferred = False
+        while not breaker.allow():
+            if not deferred:
+                count("deferred", model)
+                deferred = True
+            time.sleep(max(breaker.seconds_until_probe(), 1.0))
+
+    def _send_limited(self, stage, body):
+        """One attempt, holding a slot of the model's AIMD limiter when adaptive concurrency is on"""
+        if not self.adaptive_concurrency:
+            return self.backend.send(stage, body)
+        model_limiter = concurrency.limiter(body["model"], log_file=self.concurrency_log)
+        model_limiter.acquire()
+        start = time.perf_counter()
+        try:
+            completion = self.backend.send(stage, body)
+        except Exception as e:
+            if isinstance(e, openai.RateLimitError):
+                model_limiter.release("throttled")
+            else:
+                model_limiter.release("error" if is_retryable(e) else "ignored")
+            raise
+        model_limiter.release("success", time.perf_counter() - start)
+        return completion
+
+    def send(self, stage, body):
+        model = body["model"]
+        breaker = self.breaker(model)
+        for attempt in range(1, self.max_attempts + 1):
+            self._wait_for(breaker, model)
+            try:
+                completion = self._send_limited(stage, body)
+            except Exception as e:
+                if not is_retryable(e):
+                    breaker.record_success()   # the model answered, the request itself was bad
+                    raise
+                reason = type(e).__name__
+                if breaker.record_failure():
+                    count("trips", model, reason)
+                    print(f"Warning: Circuit breaker for {model} opened after {breaker.failures} failures ({reason}).")
+                if attempt == self.max_attempts:
+                    count("exhausted", model, reason)
+                    raise
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay, e)
+                count("retries", model, reason)
+                print(f"Warning: {stage} call to {model} failed ({reason}), retry {attempt}/{self.max_attempts - 1} in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            if breaker.record_success():
+                count("recoveries", model)
+                print(f"Circuit breaker for {model} closed again.")
+            return completion
+
+def report():
+    concurrency.report()
+    if not stats:
+        return
+    print("Resilience:")
+    for (event, model, reason), value in sorted(stats.items()):
+        print(f"  {event} {model}{f' ({reason})' if reason else ''}: {value}")
@@ -0,0 +1,219 @@
+import os
+import re
+import json
+import math
+import mmap
+import array
+import shutil
+import hashlib
+import threading
+from collections import Counter, defaultdict
+from abstraction import make_chunks, estimate_tokens
+
+
+RETRIEVAL_INDEX_DIR = ".retrieval_index"
+RETRIEVAL_EXTENSIONS = (".py", ".c", ".h")
+MAX_FILE_BYTES = 1024 * 1024     # larger files are generated data, not code worth retrieving
+CHUNK_TOKENS = 300
+TOP_K = 3                        # snippets per hunk
+RETRIEVAL_TOKEN_BUDGET = 1500    # snippets per file
+K1 = 1.2
+B = 0.75
+
+WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]+")
+WORD_PART = re.compile(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])")
+
+def terms(text):
+    """Lowercased identifiers plus their snake_case/CamelCase parts, so HeaderWriteError also matches header"""
+    found = []
+    for word in WORD.findall(text):
+        found.append(word.lower())
+        parts = WORD_PART.findall(word)
+        if len(parts) > 1:
+            found.extend(part.lower() for part in parts if len(part) > 1)
+    return found
+
+def hunk_query(hunk):
+    text = (hunk.section_header or "") + "".join(line.value for line in hunk if line.is_added or line.is_removed)
+    return set(terms(text))
+
+def tree_key(targets):
+    """Hash of the (path, version) list of the retrievable files, a new key for every changed file"""
+    files = sorted((path, version) for path, version in targets.list_files() if path.endswith(RETRIEVAL_EXTENSIONS))
+    listing = targets.root + "\n" + "".join(f"{path}\0{version}\n" for path, version in files)
+    return hashlib.sha256(listing.encode("utf-8")).hexdigest(), [path for path, _ in files]
+
+def write_array(path, typecode, values):
+    with open(path, 'wb') as f:
+        array.array(typecode, values).tofile(f)
+
+def map_array(path, typecode):
+    """Read-only view of a file written by write_array, paged in by the OS as it is used"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b"").cast(typecode), None
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped).cast(typecode), mapped
+
+
+def build_index(targets, paths, index_dir):
+    """
+    Chunk every file at definition boundaries and write the inverted index to index_dir:
+    meta.json (chunk locations and lengths, term -> postings range), postings.bin (chunk ids and
+    term frequencies, uint32 pairs) and chunks.bin (chunk texts, read through byte offsets).
+    """
+    chunks = []
+    postings = defaultdict(list)
+    texts = []
+    offset = 0
+    for path in paths:
+        content = targets.read_bytes(path)
+        if content is None or len(content) > MAX_FILE_BYTES:
+            continue
+        for start, end, text in make_chunks(content.decode("utf-8", errors="replace"), path, CHUNK_TOKENS):
+            counts = Counter(terms(text))
+            if not counts:
+                continue
+            encoded = text.encode("utf-8")
+            chunk_id = len(chunks)
+            chunks.append([path, start, end, offset, len(encoded), sum(counts.values())])
+            texts.append(encoded)
+            offset += len(encoded)
+            for term, count in counts.items():
+                postings[term].append((chunk_id, count))
+
+    term_ranges = {}
+    flat = []
+    for term, entries in postings.items():
+        term_ranges[term] = (len(flat) // 2, len(entries))
+        for chunk_id, count in entries:
+            flat.extend((chunk_id, count))
+
+    building = index_dir + f".building-{os.getpid()}-{threading.get_ident()}"
+    os.makedirs(building, exist_ok=True)
+    write_array(os.path.join(building, "postings.bin"), "I", flat)
+    with open(os.path.join(building, "chunks.bin"), 'wb') as f:
+        f.writelines(texts)
+    average_length = sum(chunk[5] for chunk in chunks) / len(chunks) if chunks else 0
+    with open(os.path.join(building, "meta.json"), 'w') as f:
+        json.dump({"chunks": chunks, "terms": term_ranges, "average_length": average_length}, f)
+    try:
+        os.rename(building, index_dir)
+    except OSError:
+        # another worker finished the same index first
+        shutil.rmtree(building, ignore_errors=True)
+
+
+class BM25Index:
+    """BM25 ranking of the code chunks of one target tree, postings and chunk texts memory-mapped"""
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, "meta.json"), 'r') as f:
+            meta = json.load(f)
+        self.chunks = meta["chunks"]
+        self.terms = meta["terms"]
+        self.average_length = meta["average_length"] or 1
+        self.postings, self._postings_map = map_array(os.path.join(index_dir, "postings.bin"), "I")
+        self.texts, self._texts_map = map_array(os.path.join(index_dir, "chunks.bin"), "B")
+
+    def idf(self, document_frequency):
+        count = len(self.chunks)
+        return math.log((count - document_frequency + 0.5) / (document_frequency + 0.5) + 1)
+
+    def search(self, query_terms, top_k=TOP_K, exclude_path=None):
+        """[(score, chunk id)] of the top_k chunks, best first"""
+        scores = defaultdict(float)
+        for term in query_terms:
+            if term not in self.terms:
+                continue
+            first, count = self.terms[term]
+            idf = self.idf(count)
+            for position in range(first, first + count):
+                chunk_id, frequency = self.postings[2 * position], self.postings[2 * position + 1]
+                length = self.chunks[chunk_id][5]
+                scores[chunk_id] += idf * frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * length / self.average_length))
+        ranked = sorted(((score, chunk_id) for chunk_id, score in scores.items()
+                         if self.chunks[chunk_id][0] != exclude_path), reverse=True)
+        return ranked[:top_k]
+
+    def chunk_text(self, chunk_id):
+        _, _, _, offset, size, _ = self.chunks[chunk_id]
+        return bytes(self.texts[offset:offset + size]).decode("utf-8")
+
+    def related(self, backported_file, top_k=TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET):
+        """
+        Snippets of the top chunks elsewhere in the tree for every hunk of the backport, taken round
+        robin over the hunks (best first) until the token budget is used up
+        """
+        rankings = [self.search(hunk_query(hunk), top_k, backported_file.path) for hunk in backported_file]
+        entries = []
+        seen = set()
+        used_tokens = 0
+        for rank in range(top_k):
+            for hunk_number, ranking in enumerate(rankings, 1):
+                if rank >= len(ranking) or ranking[rank][1] in seen:
+                    continue
+                chunk_id = ranking[rank][1]
+                path, start, end = self.chunks[chunk_id][:3]
+                entry = f"{path}:{start}-{end} (similar to hunk {hunk_number}):\n{self.chunk_text(chunk_id).rstrip()}"
+                tokens = estimate_tokens(entry)
+                if used_tokens + tokens > token_budget:
+                    continue
+                seen.add(chunk_id)
+                entries.append(entry)
+                used_tokens += tokens
+        return entries
+
+
+class Retriever:
+    """BM25 indexes of the target trees of a run, built once per tree and kept in index_dir"""
+
+    def __init__(self, index_dir=RETRIEVAL_INDEX_DIR, top_k=TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET):
+        self.index_dir = index_dir
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.indexes = {}
+        self.built = 0
+        self.retrievals = 0
+        self.snippets = 0
+        self._lock = threading.Lock()
+
+    def index_for(self, targets):
+        key, paths = tree_key(targets)
+        with self._lock:
+            if key not in self.indexes:
+                index_dir = os.path.join(self.index_dir, key)
+                if not os.path.isdir(index_dir):
+                    print(f"Building the retrieval index of {targets.describe('')} ({len(paths)} files)")
+                    os.makedirs(self.index_dir, exist_ok=True)
+                    build_index(targets, paths, index_dir)
+                    self.built += 1
+                self.indexes[key] = BM25Index(index_dir)
+            return self.indexes[key]
+
+    def related(self, index, backported_file):
+        entries = index.related(backported_file, self.top_k, self.token_budget)
+        with self._lock:
+            self.retrievals += 1
+            self.snippets += len(entries)
+        return "Lexically similar code:\n" + "\n".join(entries) if entries else ""
+
+    def report(self):
+        if self.retrievals:
+            print(f"Retrieval: {len(self.indexes)} target index(es), {self.built} built, "
+                  f"{self.snippets} snippet(s) for {self.retrievals} file(s)")
+
+
+# one retriever for the whole run, None unless --retrieval is given
+_retriever = None
+
+def configure_retrieval(index_dir, top_k=TOP_K):
+    global _retriever
+    _retriever = Retriever(index_dir, top_k) if index_dir else None
+
+def retriever():
+    return _retriever
+
+def report():
+    if _retriever is not None:
+        _retriever.report()
@@ -0,0 +1,88 @@
+import os
+import json
+import heapq
+
+
+LATENCY_HISTORY_FILE = "latency_history.json"
+DEFAULT_SECONDS_PER_FILE = 45.0     # three model calls plus the pauses in process_backport
+DEFAULT_SECONDS_PER_KCHAR = 0.5
+
+class CostModel:
+    """
+    Estimates how long judging a (sample, file) pair takes.
+    Pairs seen in an earlier run use their recorded latency, everything else uses a linear fit
+    seconds = base + rate * kchars over the patch and target sizes of all recorded pairs.
+    """
+
+    def __init__(self, history_file=LATENCY_HISTORY_FILE):
+        self.history_file = history_file
+        self.latencies = {}
+        # running sums for the least squares fit: n, sum x, sum y, sum xx, sum xy
+        self.sums = [0, 0.0, 0.0, 0.0, 0.0]
+
+        if history_file and os.path.exists(history_file):
+            with open(history_file, 'r') as f:
+                history = json.load(f)
+            self.latencies = history.get("latencies", {})
+            self.sums = history.get("sums", self.sums)
+
+    @staticmethod
+    def key(sample, file_path):
+        return f"{sample}:{file_path}"
+
+    @staticmethod
+    def size_of(upstream_file, backported_file, target_code):
+        """Work size in thousands of characters sent to the models"""
+        return (len(str(upstream_file)) + len(str(backported_file)) + len(target_code)) / 1000
+
+    def coefficients(self):
+        n, sum_x, sum_y, sum_xx, sum_xy = self.sums
+        if n < 2 or n * sum_xx - sum_x * sum_x <= 0:
+            return DEFAULT_SECONDS_PER_FILE, DEFAULT_SECONDS_PER_KCHAR
+
+        rate = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x * sum_x)
+        rate = max(rate, 0.0)
+        base = max((sum_y - rate * sum_x) / n, 0.0)
+        return base, rate
+
+    def estimate(self, sample, upstream_file, backported_file, target_code):
+        recorded = self.latencies.get(self.key(sample, backported_file.path))
+        if recorded is not None:
+            return recorded
+
+        base, rate = self.coefficients()
+        return base + rate * self.size_of(upstream_file, backported_file, target_code)
+
+    def record(self, sample, file_path, kchars, seconds):
+        self.latencies[self.key(sample, file_path)] = seconds
+        self.sums[0] += 1
+        self.sums[1] += kchars
+        self.sums[2] += seconds
+        self.sums[3] += kchars * kchars
+        self.sums[4] += kchars * seconds
+
+    def save(self):
+        if not self.history_file:
+            return
+        with open(self.history_file, 'w') as f:
+            json.dump({"latencies": self.latencies, "sums": self.sums}, f, indent=1)
+
+
+def lpt_schedule(costs, workers):
+    """
+    Longest-processing-time-first list scheduling.
+    costs is a list of (job, cost). Returns the jobs in dispatch order (longest first),
+    the worker each job lands on and the estimated makespan.
+    """
+    ordered = sorted(costs, key=lambda item: item[1], reverse=True)
+
+    loads = [(0.0, worker) for worker in range(max(workers, 1))]
+    heapq.heapify(loads)
+    assignment = []
+    for job, cost in ordered:
+        load, worker = heapq.heappop(loads)
+        assignment.append((job, worker))
+        heapq.heappush(loads, (load + cost, worker))
+
+    makespan = max(load for load, _ in loads)
+    return [job for job, _ in ordered], assignment, makespan
@@ -0,0 +1,290 @@
+import re
+import ast
+import hashlib
+import textwrap
+import threading
+from collections import OrderedDict
+from trivia import lexer_for
+
+try:
+    from tree_sitter_languages import get_parser
+except ImportError:
+    get_parser = None
+
+
+CACHE_SIZE = 4096
+MODULE_SYMBOL = ("module", "<module level>")
+
+PY_DEFINITION = re.compile(r"^(\s*)(?:async\s+def|def|class)\s+(\w+)")
+PY_IMPORT = re.compile(r"^\s*(?:from\s+(\S+)\s+)?import\s+(.+)")
+PY_CONSTANT = re.compile(r"^([A-Z_][A-Z0-9_]*)\s*(?::[^=]*)?=")
+C_FUNCTION = re.compile(r"^(?:[A-Za-z_][\w\s\*]*?[\s\*])?(\w+)\s*\([^;]*$")    # also CPython style, name at column 0
+C_MACRO = re.compile(r"^\s*#\s*define\s+(\w+)")
+C_INCLUDE = re.compile(r"^\s*#\s*include\s+(\S+)")
+HEADER_NAME = re.compile(r"(?:def|class)\s+(\w+)|\b(\w+)\s*\(")
+
+#### definitions of a hunk fragment: [(first index, last index, kind, name)] ####
+
+def python_definitions(lines):
+    """Definitions in a fragment of Python lines, with ast when the fragment parses and by indentation otherwise"""
+    try:
+        tree = ast.parse(textwrap.dedent("".join(lines)))
+    except (SyntaxError, ValueError):
+        return python_definitions_by_regex(lines)
+
+    definitions = []
+    def visit(node, prefix):
+        for child in ast.iter_child_nodes(node):
+            first, last = getattr(child, "lineno", 1) - 1, getattr(child, "end_lineno", 1) - 1
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                kind = "class" if isinstance(child, ast.ClassDef) else "function"
+                start = min([first] + [decorator.lineno - 1 for decorator in child.decorator_list])
+                definitions.append((start, last, kind, prefix + child.name))
+                visit(child, prefix + child.name + ".")
+            elif isinstance(child, (ast.Import, ast.ImportFrom)):
+                module = f"{child.module}." if isinstance(child, ast.ImportFrom) and child.module else ""
+                for alias in child.names:
+                    definitions.append((first, last, "import", module + alias.name))
+            elif isinstance(child, (ast.Assign, ast.AnnAssign)):
+                targets = child.targets if isinstance(child, ast.Assign) else [child.target]
+                for target in targets:
+                    if isinstance(target, ast.Name) and target.id.isupper():
+                        definitions.append((first, last, "constant", prefix + target.id))
+    visit(tree, "")
+    return definitions
+
+def python_definitions_by_regex(lines):
+    definitions = []
+    for index, line in enumerate(lines):
+        match = PY_DEFINITION.match(line)
+        if match:
+            indent = len(match.group(1))
+            last = index
+            for later in range(index + 1, len(lines)):
+                text = lines[later]
+                if text.strip() and len(text) - len(text.lstrip()) <= indent:
+                    break
+                last = later
+            kind = "class" if line.lstrip().startswith("class") else "function"
+            definitions.append((index, last, kind, match.group(2)))
+            continue
+        match = PY_IMPORT.match(line)
+        if match:
+            module = f"{match.group(1)}." if match.group(1) else ""
+            for name in match.group(2).strip("()\\\n ").split(","):
+                if name.strip():
+                    definitions.append((index, index, "import", module + name.split()[0]))
+            continue
+        match = PY_CONSTANT.match(line)
+        if match:
+            definitions.append((index, index, "constant", match.group(1)))
+    return definitions
+
+def c_definitions(lines):
+    """Functions, macros, includes and globals of a C fragment, with tree-sitter when it is installed"""
+    if get_parser is None:
+        return c_definitions_by_regex(lines)
+
+    tree = get_parser("c").parse("".join(lines).encode("utf-8"))
+    definitions = []
+    for node in tree.root_node.children:
+        first, last = node.start_point[0], node.end_point[0]
+        if node.type == "function_definition":
+            declarator = node.child_by_field_name("declarator")
+            while declarator is not None and declarator.type != "identifier":
+                declarator = declarator.child_by_field_name("declarator")
+            if declarator is not None:
+                definitions.append((first, last, "function", declarator.text.decode("utf-8")))
+        elif node.type in ("preproc_def", "preproc_function_def"):
+            definitions.append((first, last, "macro", node.child_by_field_name("name").text.decode("utf-8")))
+        elif node.type == "preproc_include":
+            definitions.append((first, last, "import", node.child_by_field_name("path").text.decode("utf-8")))
+        elif node.type == "declaration":
+            for declarator in node.children_by_field_name("declarator"):
+                while declarator is not None and declarator.type != "identifier":
+                    declarator = declarator.child_by_field_name("declarator")
+                if declarator is not None:
+                    definitions.append((first, last, "constant", declarator.text.decode("utf-8")))
+    return definitions
+
+def c_definitions_by_regex(lines):
+    definitions = []
+    open_function = None
+    for index, line in enumerate(lines):
+        match = C_FUNCTION.match(line)
+        if match and not line.startswith((" ", "\t")):
+            open_function = (index, match.group(1))
+            continue
+        if line.startswith("}") and open_function:
+            definitions.append((open_function[0], index, "function", open_function[1]))
+            open_function = None
+            continue
+        for pattern, kind in ((C_MACRO, "macro"), (C_INCLUDE, "import")):
+            match = pattern.match(line)
+            if match:
+                definitions.append((index, index, kind, match.group(1)))
+    if open_function:
+        definitions.append((open_function[0], len(lines) - 1, "function", open_function[1]))
+    return definitions
+
+DEFINITION_FINDERS = {".py": python_definitions, ".c": c_definitions, ".h": c_definitions}
+
+def definitions_finder(path):
+    for extension, finder in DEFINITION_FINDERS.items():
+        if path.endswith(extension):
+            return finder
+    return None
+
+#### per-symbol changes ####
+
+def header_symbol(hunk):
+    """Enclosing function or class git names in the @@ line, the module level otherwise"""
+    match = HEADER_NAME.search(hunk.section_header or "")
+    if not match:
+        return MODULE_SYMBOL
+    return ("class" if (hunk.section_header or "").lstrip().startswith("class") else "function",
+            match.group(1) or match.group(2))
+
+def indentation(text):
+    return len(text) - len(text.lstrip(" \t")) if text.strip() else 0
+
+def change_position(lines, index, is_changed):
+    """
+    Where the run of changed lines starting at index sits: the context statements right before
+    and after it and its indentation relative to the statement before
+    """
+    before = next((line.value for line in reversed(lines[:index]) if line.value.strip()), "")
+    after = next((line.value for line in lines[index:] if not is_changed(line) and line.value.strip()), "")
+    return before, after, indentation(lines[index].value.expandtabs(8)) - indentation(before.expandtabs(8))
+
+def symbol_changes(patched_file, find_definitions):
+    """
+    {(kind, name): {"status": added/removed/modified, "removed": [lines], "added": [lines],
+    "positions": [(side, position)]}} of a patch, see change_position
+    """
+    changes = OrderedDict()
+    for hunk in patched_file:
+        fallback = header_symbol(hunk)
+        headers = {"removed": set(), "added": set()}
+        for side, is_changed in (("removed", lambda line: line.is_removed), ("added", lambda line: line.is_added)):
+            other = "added" if side == "removed" else "removed"
+            lines = [line for line in hunk if not getattr(line, f"is_{other}")]
+            definitions = find_definitions([line.value for line in lines])
+            for index, line in enumerate(lines):
+                if not is_changed(line):
+                    continue
+                starts_run = index == 0 or not is_changed(lines[index - 1])
+                # innermost definition around the line, definitions are found outer first
+                containing = [(kind, name, first) for first, last, kind, name in definitions if first <= index <= last]
+                if containing:
+                    kind, name, first = max(containing, key=lambda definition: definition[2])
+                    symbol = (kind, name)
+                    if first == index or kind in ("import", "constant", "macro"):
+                        headers[side].add(symbol)
+                else:
+                    symbol = fallback
+                entry = changes.setdefault(symbol, {"status": "modified", "removed": [], "added": [], "positions": []})
+                entry[side].append(line.value)
+                if starts_run:
+                    entry["positions"].append((side, change_position(lines, index, is_changed)))
+
+        for symbol in headers["added"] - headers["removed"]:
+            changes[symbol]["status"] = "added" if not changes[symbol]["removed"] else "modified"
+        for symbol in headers["removed"] - headers["added"]:
+            changes[symbol]["status"] = "removed" if not changes[symbol]["added"] else "modified"
+    return changes
+
+def same_positions(upstream_change, backport_change, lexer):
+    """Runs of changed lines sit between the same statements, at the same relative indentation"""
+    def normalized(change):
+        return [(side, lexer(before), lexer(after), depth) for side, (before, after, depth) in change["positions"]]
+    return normalized(upstream_change) == normalized(backport_change)
+
+def same_change(upstream_change, backport_change, lexer):
+    return upstream_change["status"] == backport_change["status"] and all(
+        lexer("".join(upstream_change[side])) == lexer("".join(backport_change[side])) for side in ("removed", "added")
+    ) and same_positions(upstream_change, backport_change, lexer)
+
+def render_change(change, indent="    "):
+    lines = [f"{indent}-{line.rstrip()}" for line in change["removed"]] + [f"{indent}+{line.rstrip()}" for line in change["added"]]
+    for side, (before, after, depth) in change["positions"]:
+        lines.append(f"{indent} ({side} lines after `{before.strip() or 'start of hunk'}`, "
+                     f"before `{after.strip() or 'end of hunk'}`, indented {depth:+d})")
+    return "\n".join(lines)
+
+def compute_delta(upstream_file, backported_file):
+    """Structured text delta of both patches, None when the language is not supported"""
+    path = backported_file.path if backported_file is not None else upstream_file.path
+    find_definitions, lexer = definitions_finder(path), lexer_for(path)
+    if find_definitions is None or lexer is None:
+        return None
+
+    upstream = symbol_changes(upstream_file, find_definitions)
+    backport = symbol_changes(backported_file, find_definitions) if backported_file is not None else {}
+
+    identical, differing, upstream_only, backport_only = [], [], [], []
+    for symbol in list(upstream) + [symbol for symbol in backport if symbol not in upstream]:
+        label = f"{symbol[0]} {symbol[1]}"
+        if symbol in upstream and symbol in backport:
+            if same_change(upstream[symbol], backport[symbol], lexer):
+                identical.append(f"{label} ({upstream[symbol]['status']})")
+            else:
+                differing.append(f"  {label} (upstream: {upstream[symbol]['status']}, backport: {backport[symbol]['status']})\n"
+                                 f"   upstream:\n{render_change(upstream[symbol])}\n   backport:\n{render_change(backport[symbol])}")
+        elif symbol in upstream:
+            upstream_only.append(f"  {label} ({upstream[symbol]['status']})\n{render_change(upstream[symbol])}")
+        else:
+            backport_only.append(f"  {label} ({backport[symbol]['status']})\n{render_change(backport[symbol])}")
+
+    sections = [f"Identical in both patches: {', '.join(identical) if identical else 'nothing'}"]
+    for title, entries in (("Changed differently", differing), ("Only in the upstream patch", upstream_only),
+                           ("Only in the backported patch", backport_only)):
+        if entries:
+            sections.append(f"{title}:\n" + "\n".join(entries))
+    return "\n".join(sections) + "\n"
+
+
+class SemanticDiffer:
+    """Caches deltas by the content of both patches and counts how much prompt text they save"""
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.files = 0
+        self.raw_chars = 0
+        self.delta_chars = 0
+        self._lock = threading.Lock()
+
+    def delta(self, upstream_file, backported_file):
+        """Delta text, or None when the raw patches should be sent (unsupported language or no saving)"""
+        raw = str(upstream_file) + str(backported_file)
+        key = hashlib.sha256(f"{upstream_file.path}\0{raw}".encode("utf-8")).hexdigest()
+        with self._lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        try:
+            delta = compute_delta(upstream_file, backported_file)
+        except Exception as e:
+            print(f"Warning: Semantic diff of {upstream_file.path} failed ({e}), sending the raw patches.")
+            delta = None
+        if delta is not None and len(delta) >= len(raw):
+            delta = None
+
+        with self._lock:
+            self.cache[key] = delta
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            if delta is not None:
+                self.files += 1
+                self.raw_chars += len(raw)
+                self.delta_chars += len(delta)
+        return delta
+
+    def report(self):
+        if self.files:
+            print(f"Semantic diff: {self.files} file(s), compare prompts {self.raw_chars} -> {self.delta_chars} chars "
+                  f"({self.raw_chars / max(self.delta_chars, 1):.1f}x smaller)")
+
+differ = SemanticDiffer()
@@ -0,0 +1,191 @@
+import os
+import re
+import csv
+import json
+import glob
+import hashlib
+
+
+SHARD_SUFFIX_PATTERN = re.compile(r"\.shard(\d+)of(\d+)$")
+
+def parse_ranges(spec):
+    """
+    Parse a sample range spec such as "1-5,8,20-" into a list of (start, end) tuples.
+    An open end is stored as None.
+    """
+    ranges = []
+    if not spec:
+        return ranges
+
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            start = int(start) if start.strip() else 0
+            end = int(end) if end.strip() else None
+        else:
+            start = end = int(part)
+        ranges.append((start, end))
+    return ranges
+
+def sample_number(sample):
+    """Turns a sample folder name like '0020' into 20"""
+    return int(sample.lstrip("0") or "0")
+
+def in_ranges(sample, ranges):
+    number = sample_number(sample)
+    for start, end in ranges:
+        if number >= start and (end is None or number <= end):
+            return True
+    return False
+
+def shard_for(sample, shard_count):
+    """
+    Stable hash based shard assignment.
+    Uses sha1 of the zero padded sample id, so the result does not depend on
+    PYTHONHASHSEED, listing order or on which machine the run happens.
+    """
+    digest = hashlib.sha1(sample.zfill(4).encode("utf-8")).hexdigest()
+    return int(digest, 16) % shard_count
+
+def select_samples(samples, shard_index=0, shard_count=1, include=None, exclude=None):
+    """
+    Filter sample folders by include/exclude range specs and keep only the ones
+    that belong to the given shard. Returns them sorted by sample number.
+    """
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise ValueError(f"Invalid shard {shard_index} of {shard_count}")
+
+    include_ranges = parse_ranges(include)
+    exclude_ranges = parse_ranges(exclude)
+
+    selected = []
+    for sample in samples:
+        if include_ranges and not in_ranges(sample, include_ranges):
+            continue
+        if exclude_ranges and in_ranges(sample, exclude_ranges):
+            continue
+        if shard_for(sample, shard_count) != shard_index:
+            continue
+        selected.append(sample)
+
+    return sorted(selected, key=sample_number)
+
+def shard_output_path(path, shard_index, shard_count):
+    """verification_results.txt -> verification_results.shard0of4.txt (unchanged for a single shard)"""
+    if shard_count <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard_index}of{shard_count}{ext}"
+
+def find_shard_outputs(path):
+    """Find all per-shard files written for the given merged output path, ordered by shard index"""
+    root, ext = os.path.splitext(path)
+    found = []
+    for candidate in glob.glob(f"{glob.escape(root)}.shard*of*{ext}"):
+        match = SHARD_SUFFIX_PATTERN.search(os.path.splitext(candidate)[0])
+        if match:
+            found.append((int(match.group(1)), int(match.group(2)), candidate))
+
+    counts = {count for _, count, _ in found}
+    if len(counts) > 1:
+        raise ValueError(f"Shard outputs for {path} come from different shard counts: {sorted(counts)}")
+
+    return [candidate for _, _, candidate in sorted(found)]
+
+#### merging ####
+
+def merge_csv(shard_files, output_file):
+    """Combine per-shard verdict CSVs, keeping the last verdict per sample, sorted by sample id"""
+    verdicts = {}
+    for shard_file in shard_files:
+        with open(shard_file, 'r', newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)  # Skip header
+            for row in reader:
+                if row:
+                    verdicts[row[0]] = row[1]
+
+    with open(output_file, 'w', newline='') as csvfile:
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(["sample_id", "review_verdict"])
+        for sample in sorted(verdicts, key=sample_number):
+            csv_writer.writerow([sample, verdicts[sample]])
+
+    return len(verdicts)
+
+def split_txt_blocks(text, separator):
+    return [block for block in text.split(separator) if block.strip()]
+
+def merge_verification_txt(shard_files, output_file):
+    """Combine per-shard verification_results files, ordering sample blocks by sample number"""
+    separator = "#" * 80 + "\n\n"
+    header = re.compile(r"The Sample Folder Number: (\S+)")
+
+    blocks = []
+    for shard_file in shard_files:
+        with open(shard_file, 'r') as f:
+            for block in split_txt_blocks(f.read(), separator):
+                match = header.search(block)
+                key = sample_number(match.group(1)) if match else -1
+                blocks.append((key, block))
+
+    blocks.sort(key=lambda item: item[0])
+    with open(output_file, 'w') as f:
+        for _, block in blocks:
+            f.write(block.lstrip("\n") + separator)
+
+    return len(blocks)
+
+def merge_result_store(shard_files, output_file):
+    """Concatenate the per-file result logs (functions.txt) of every shard"""
+    entries = 0
+    with open(output_file, 'w', encoding="utf-8") as out:
+        for shard_file in shard_files:
+            with open(shard_file, 'r', encoding="utf-8") as f:
+                content = f.read()
+            entries += content.count("-" * 80 + "\n")
+            out.write(content)
+
+    return entries
+
+def merge_fingerprints(shard_files, output_file):
+    """
+    Combine the per-shard result fingerprints of --incremental into one store. Entries already in
+    the merged store are kept unless a shard judged the same file again.
+    """
+    entries = {}
+    for path in [output_file] + shard_files:
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                entries.update(json.load(f))
+
+    with open(output_file + ".tmp", 'w') as f:
+        json.dump(entries, f)
+    os.replace(output_file + ".tmp", output_file)
+
+    return len(entries)
+
+def merge_shards(csv_file, txt_file, result_store_file, fingerprints_file=None):
+    """
+    Merge the outputs of a sharded run back into single files.
+    Each argument is the merged output path, per-shard inputs are discovered next to it.
+    The fingerprint stores only exist for --incremental runs and are merged when found.
+    """
+    mergers = [
+        (csv_file, merge_csv, True),
+        (txt_file, merge_verification_txt, True),
+        (result_store_file, merge_result_store, True),
+    ]
+    if fingerprints_file:
+        mergers.append((fingerprints_file, merge_fingerprints, False))
+    for output_file, merger, required in mergers:
+        shard_files = find_shard_outputs(output_file)
+        if not shard_files:
+            if required:
+                print(f"Warning: No shard outputs found for {output_file}.")
+            continue
+        merged = merger(shard_files, output_file)
+        print(f"Merged {len(shard_files)} shard files ({merged} entries) into {output_file}")
@@ -0,0 +1,299 @@
+import re
+import ast
+import time
+import sqlite3
+import hashlib
+import threading
+from abstraction import IDENTIFIER, estimate_tokens
+from semdiff import c_definitions, python_definitions_by_regex
+
+
+SYMBOL_INDEX_FILE = "symbol_index.sqlite"
+INDEXED_EXTENSIONS = (".py", ".c", ".h")
+SNIPPET_LINES = 12          # lines of a definition kept as its snippet
+USES_PER_NAME = 3           # call sites, uses and imports attached per identifier
+COMMON_NAME_LIMIT = 20      # identifiers defined more often than this (get, __init__, ...) are not looked up
+RELATED_TOKEN_BUDGET = 1500
+KIND_ORDER = {"definition": 0, "call": 1, "use": 2, "import": 3}
+KIND_LABELS = {"definition": "defined", "call": "called", "use": "used", "import": "imported"}
+
+CALL = re.compile(r"\b([A-Za-z_]\w*)\s*\(")
+CAPITALIZED = re.compile(r"\b([A-Z]\w{2,})\b(?!\s*\()")    # classes, exceptions and constants
+COMMENT_LINE = re.compile(r"^\s*(?:#|//|/\*|\*)")
+NOT_CALLS = {"if", "for", "while", "switch", "return", "sizeof", "defined", "elif", "and", "or", "not", "in",
+             "print", "assert", "del", "except", "with", "lambda", "yield", "await"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_versions (
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    version TEXT NOT NULL,
+    blob TEXT NOT NULL,
+    PRIMARY KEY (root, path)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    blob TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS symbols (
+    blob TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    snippet TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS symbols_by_name ON symbols (name);
+CREATE TABLE IF NOT EXISTS trees (
+    tree TEXT PRIMARY KEY,
+    files INTEGER NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tree_files (
+    tree TEXT NOT NULL,
+    path TEXT NOT NULL,
+    blob TEXT NOT NULL,
+    PRIMARY KEY (tree, path)
+);
+CREATE INDEX IF NOT EXISTS tree_files_by_blob ON tree_files (blob, tree);
+"""
+
+def blob_id(content):
+    """git's object id of a blob, so the files of a checkout and of a repository share index entries"""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+def snippet(lines, first, last, limit=SNIPPET_LINES):
+    return "".join(lines[first:min(last + 1, first + limit)]).rstrip()
+
+#### symbols of a file: [(kind, name, line index, snippet)] ####
+
+def python_symbols(lines):
+    """Definitions, imports, calls and uses of capitalized names, with ast and line by line when the file does not parse (Python 2)"""
+    try:
+        tree = ast.parse("".join(lines))
+    except (SyntaxError, ValueError):
+        return line_symbols(lines, python_definitions_by_regex(lines))
+
+    symbols = []
+    called = set()
+    # ast.walk is breadth first, so a Call is seen before the name it calls
+    for node in ast.walk(tree):
+        index = getattr(node, "lineno", 1) - 1
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            symbols.append(("definition", node.name, index, snippet(lines, index, node.end_lineno - 1)))
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            for target in (node.targets if isinstance(node, ast.Assign) else [node.target]):
+                if isinstance(target, ast.Name) and target.id.isupper():
+                    symbols.append(("definition", target.id, index, snippet(lines, index, node.end_lineno - 1)))
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                symbols.append(("import", alias.asname or alias.name.split(".")[-1], index, lines[index].strip()))
+        elif isinstance(node, ast.Call):
+            called.add(id(node.func))
+            name = node.func.id if isinstance(node.func, ast.Name) else getattr(node.func, "attr", None)
+            if name:
+                symbols.append(("call", name, index, lines[index].strip()))
+        elif isinstance(node, (ast.Name, ast.Attribute)) and id(node) not in called:
+            name = node.id if isinstance(node, ast.Name) else node.attr
+            if name[0].isupper() and isinstance(node.ctx, ast.Load):
+                symbols.append(("use", name, index, lines[index].strip()))
+    return symbols
+
+def c_symbols(lines):
+    return line_symbols(lines, c_definitions(lines))
+
+def line_symbols(lines, definitions):
+    """Symbols from (first, last, kind, name) definitions plus calls and capitalized names found line by line"""
+    symbols = []
+    headers = set()
+    for first, last, kind, name in definitions:
+        if kind == "import":
+            symbols.append(("import", name, first, lines[first].strip()))
+        else:
+            symbols.append(("definition", name, first, snippet(lines, first, last)))
+        headers.add(first)
+
+    for index, line in enumerate(lines):
+        if index in headers or COMMENT_LINE.match(line):
+            continue
+        for name in set(CALL.findall(line)) - NOT_CALLS:
+            symbols.append(("call", name, index, line.strip()))
+        for name in set(CAPITALIZED.findall(line)):
+            symbols.append(("use", name, index, line.strip()))
+    return symbols
+
+SYMBOL_FINDERS = {".py": python_symbols, ".c": c_symbols, ".h": c_symbols}
+
+def file_symbols(path, content):
+    lines = content.decode("utf-8", errors="replace").splitlines(keepends=True)
+    for extension, finder in SYMBOL_FINDERS.items():
+        if path.endswith(extension):
+            return sorted(set(finder(lines)), key=lambda symbol: symbol[2])
+    return []
+
+def changed_identifiers(backported_file):
+    """Identifiers of the added and removed lines of a patch, in order of appearance"""
+    names = {}
+    for hunk in backported_file:
+        for line in hunk:
+            if line.is_added or line.is_removed:
+                for name in IDENTIFIER.findall(line.value):
+                    names.setdefault(name, None)
+    return list(names)
+
+
+class SymbolIndex:
+    """
+    On-disk index of the definitions, imports, call sites and uses in the .py/.c/.h files of target trees.
+    Files are parsed once per content (git blob id) and a tree is the set of (path, blob) of its files,
+    keyed by the hash of that set, so another revision or checkout of the same project only parses
+    the files that changed. Lookups are single indexed queries and take microseconds.
+    """
+
+    def __init__(self, db_path=SYMBOL_INDEX_FILE, token_budget=RELATED_TOKEN_BUDGET):
+        self.db_path = db_path
+        self.token_budget = token_budget
+        self.trees = set()
+        self.parsed_files = 0
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        # one connection per thread, like the task queue
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def index_tree(self, targets):
+        """Hash of the target tree, after adding the files whose content is not indexed yet"""
+        db = self._connection()
+        with self._lock:
+            known = {path: (version, blob) for path, version, blob in db.execute(
+                "SELECT path, version, blob FROM file_versions WHERE root = ?", (targets.root,))}
+            files = {}
+            new_versions = []
+            for path, version in targets.list_files():
+                if not path.endswith(INDEXED_EXTENSIONS):
+                    continue
+                if path in known and known[path][0] == version:
+                    files[path] = known[path][1]
+                    continue
+                # git trees hand out blob ids as versions, checkouts have to be read and hashed
+                if self._is_indexed(db, version):
+                    files[path] = version
+                else:
+                    content = targets.read_bytes(path)
+                    files[path] = blob_id(content)
+                    self._add_blob(db, files[path], path, content)
+                new_versions.append((targets.root, path, version, files[path]))
+
+            tree = hashlib.sha256("".join(f"{path}\0{files[path]}\n" for path in sorted(files)).encode("utf-8")).hexdigest()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.executemany("INSERT OR REPLACE INTO file_versions (root, path, version, blob) VALUES (?, ?, ?, ?)",
+                               new_versions)
+                if db.execute("INSERT OR IGNORE INTO trees (tree, files, indexed_at) VALUES (?, ?, ?)",
+                              (tree, len(files), time.time())).rowcount:
+                    db.executemany("INSERT INTO tree_files (tree, path, blob) VALUES (?, ?, ?)",
+                                   [(tree, path, blob) for path, blob in files.items()])
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            self.trees.add(tree)
+        return tree
+
+    @staticmethod
+    def _is_indexed(db, blob):
+        return db.execute("SELECT 1 FROM blobs WHERE blob = ?", (blob,)).fetchone() is not None
+
+    def _add_blob(self, db, blob, path, content):
+        if self._is_indexed(db, blob):
+            return
+        try:
+            symbols = file_symbols(path, content)
+        except Exception as e:
+            print(f"Warning: Could not index {path} ({e}).")
+            symbols = []
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # another process may have indexed the same content in the meantime
+            if db.execute("INSERT OR IGNORE INTO blobs (blob) VALUES (?)", (blob,)).rowcount:
+                db.executemany("INSERT INTO symbols (blob, kind, name, line, snippet) VALUES (?, ?, ?, ?, ?)",
+                               [(blob, kind, name, index + 1, text) for kind, name, index, text in symbols])
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        self.parsed_files += 1
+
+    def lookup(self, tree, name):
+        """(path, kind, line, snippet) of name in the files of tree, definitions first"""
+        rows = self._connection().execute(
+            "SELECT tree_files.path, symbols.kind, symbols.line, symbols.snippet FROM symbols "
+            "JOIN tree_files ON tree_files.blob = symbols.blob AND tree_files.tree = ? "
+            "WHERE symbols.name = ?",
+            (tree, name)).fetchall()
+        return sorted(rows, key=lambda row: (KIND_ORDER[row[1]], row[0], row[2]))
+
+    def related(self, tree, backported_file):
+        """
+        Definitions and a few call sites/uses elsewhere in the tree of every identifier the backport
+        changes, as prompt text within the token budget
+        """
+        start = time.perf_counter()
+        entries = []
+        used_tokens = 0
+        for name in changed_identifiers(backported_file):
+            rows = self.lookup(tree, name)
+            defined = sum(row[1] == "definition" for row in rows)
+            # names the tree does not define (library methods, locals) are noise, unless they look like classes or constants
+            if defined > COMMON_NAME_LIMIT or not (defined or name[0].isupper()):
+                continue
+            rows = [row for row in rows if row[0] != backported_file.path]
+            definitions = [row for row in rows if row[1] == "definition"]
+            others = [row for row in rows if row[1] != "definition"][:USES_PER_NAME]
+            if not rows:
+                continue
+            lines = [f"{name}:"]
+            for path, kind, line, text in definitions + others:
+                if kind == "definition":
+                    lines.append(f"  {KIND_LABELS[kind]} at {path}:{line}\n" + "\n".join(f"    {part}" for part in text.splitlines()))
+                else:
+                    lines.append(f"  {KIND_LABELS[kind]} at {path}:{line}: {text}")
+            entry = "\n".join(lines)
+            tokens = estimate_tokens(entry)
+            if used_tokens + tokens > self.token_budget:
+                break
+            entries.append(entry)
+            used_tokens += tokens
+
+        with self._lock:
+            self.lookups += 1
+            self.lookup_seconds += time.perf_counter() - start
+        return "\n".join(entries)
+
+    def report(self):
+        if self.trees or self.lookups:
+            average = self.lookup_seconds / self.lookups * 1e6 if self.lookups else 0
+            print(f"Symbol index: {len(self.trees)} tree(s), {self.parsed_files} file(s) parsed, "
+                  f"{self.lookups} file(s) given cross-file context, {average:.0f} µs per file")
+
+
+# one index for the whole run, None unless --symbol-index is given
+_index = None
+
+def configure_symbol_index(db_path):
+    global _index
+    _index = SymbolIndex(db_path) if db_path else None
+
+def symbol_index():
+    return _index
+
+def report():
+    if _index is not None:
+        _index.report()
@@ -0,0 +1,209 @@
+import os
+import json
+import threading
+import subprocess
+from collections import OrderedDict
+
+
+TARGET_SPEC_FILE = "target.json"    # {"repo": "/path/to/repo.git", "revision": "v3.9.1"} next to or instead of target/
+BLOB_CACHE_BYTES = 256 * 1024 * 1024
+HEAD_BYTES = 8192
+RELATED_CODE_ATTRIBUTE = "related_code"
+
+class DirectoryTargets:
+    """Target files of a materialized checkout, e.g. samples/<id>/target"""
+
+    def __init__(self, base_directory):
+        self.base_directory = base_directory
+        self.root = os.path.abspath(base_directory)
+
+    def describe(self, path):
+        return os.path.join(self.base_directory, path)
+
+    def exists(self, path):
+        return os.path.isfile(os.path.join(self.base_directory, path))
+
+    def read_text(self, path):
+        with open(os.path.join(self.base_directory, path), 'r') as f:
+            return f.read()
+
+    def read_head(self, path, size=HEAD_BYTES):
+        if not self.exists(path):
+            return b""
+        with open(os.path.join(self.base_directory, path), 'rb') as f:
+            return f.read(size)
+
+    def read_bytes(self, path):
+        with open(os.path.join(self.base_directory, path), 'rb') as f:
+            return f.read()
+
+    def list_files(self):
+        """(path, version) of every file, the version is a size and mtime signature"""
+        files = []
+        for directory, subdirectories, names in os.walk(self.base_directory):
+            subdirectories[:] = [name for name in subdirectories if not name.startswith(".")]
+            for name in names:
+                full_path = os.path.join(directory, name)
+                stat = os.stat(full_path)
+                path = os.path.relpath(full_path, self.base_directory).replace(os.sep, "/")
+                files.append((path, f"{stat.st_size}:{stat.st_mtime_ns}"))
+        return files
+
+
+class GitRepository:
+    """
+    Blobs of a git repository read through one persistent `git cat-file --batch` process.
+    Blobs are cached by object id (up to BLOB_CACHE_BYTES, least recently used dropped first), so
+    samples at different revisions share the files that did not change between them.
+    """
+
+    def __init__(self, repo, cache_bytes=BLOB_CACHE_BYTES):
+        self.repo = repo
+        self.cache_bytes = cache_bytes
+        self.object_ids = {}            # (revision, path) -> object id, None when missing
+        self.blobs = OrderedDict()      # object id -> content
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._process = None
+        self._lock = threading.Lock()
+
+    def _cat_file(self):
+        if self._process is None or self._process.poll() is not None:
+            self._process = subprocess.Popen(["git", "-C", self.repo, "cat-file", "--batch"],
+                                             stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return self._process
+
+    def _request(self, name):
+        """(object id, content) of name (<revision>:<path>), (None, None) when it does not exist"""
+        process = self._cat_file()
+        process.stdin.write(name.encode("utf-8") + b"\n")
+        process.stdin.flush()
+        header = process.stdout.readline().decode("utf-8").rstrip("\n")
+        # "<name> missing" or "<name> ambiguous", the name may contain spaces itself
+        if header.endswith((" missing", " ambiguous")):
+            return None, None
+        fields = header.split(" ")
+        if len(fields) != 3 or fields[1] not in ("blob", "tree", "commit", "tag") or not fields[2].isdigit():
+            raise RuntimeError(f"Unexpected git cat-file answer for {name}: {header!r}")
+        object_id, object_type, size = fields
+        content = process.stdout.read(int(size))
+        process.stdout.read(1)  # trailing newline
+        return (object_id, content) if object_type == "blob" else (None, None)
+
+    def read(self, revision, path):
+        """Content of path at revision as bytes, None when the file does not exist there"""
+        with self._lock:
+            key = (revision, path)
+            object_id = self.object_ids.get(key)
+            if object_id in self.blobs:
+                self.hits += 1
+                self.blobs.move_to_end(object_id)
+                return self.blobs[object_id]
+            if key in self.object_ids and object_id is None:
+                return None
+
+            self.misses += 1
+            object_id, content = self._request(f"{revision}:{path}")
+            self.object_ids[key] = object_id
+            if object_id is None:
+                return None
+            if object_id not in self.blobs:
+                self.blobs[object_id] = content
+                self.cached_bytes += len(content)
+                while self.cached_bytes > self.cache_bytes and len(self.blobs) > 1:
+                    _, dropped = self.blobs.popitem(last=False)
+                    self.cached_bytes -= len(dropped)
+            return content
+
+    def list_tree(self, revision):
+        """(path, object id) of every blob of revision"""
+        output = subprocess.run(["git", "-C", self.repo, "ls-tree", "-r", "-z", revision],
+                                capture_output=True, check=True).stdout.decode("utf-8")
+        files = []
+        for entry in output.split("\0"):
+            if not entry:
+                continue
+            info, path = entry.split("\t", 1)
+            _, object_type, object_id = info.split()
+            if object_type == "blob":
+                files.append((path, object_id))
+        return files
+
+    def close(self):
+        if self._process is not None:
+            self._process.stdin.close()
+            self._process.wait()
+            self._process = None
+
+
+class GitTargets:
+    """Target files of one revision of a shared GitRepository"""
+
+    def __init__(self, repository, revision):
+        self.repository = repository
+        self.revision = revision
+        self.root = repository.repo
+
+    def describe(self, path):
+        return f"{self.repository.repo}@{self.revision}:{path}"
+
+    def exists(self, path):
+        return self.repository.read(self.revision, path) is not None
+
+    def read_text(self, path):
+        return self.repository.read(self.revision, path).decode("utf-8")
+
+    def read_head(self, path, size=HEAD_BYTES):
+        return (self.repository.read(self.revision, path) or b"")[:size]
+
+    def read_bytes(self, path):
+        return self.repository.read(self.revision, path)
+
+    def list_files(self):
+        """(path, version) of every file, the version is the git object id of its content"""
+        return self.repository.list_tree(self.revision)
+
+
+# one cat-file process per repository for the whole run
+_repositories = {}
+_repositories_lock = threading.Lock()
+
+def git_repository(repo):
+    repo = os.path.abspath(repo)
+    with _repositories_lock:
+        if repo not in _repositories:
+            _repositories[repo] = GitRepository(repo)
+        return _repositories[repo]
+
+def target_provider(target):
+    """
+    Files of a sample's target: target is a checkout directory, or a target.json naming a git
+    repository (relative to the JSON file) and the revision to read from it.
+    """
+    if os.path.isdir(target):
+        return DirectoryTargets(target)
+    with open(target, 'r') as f:
+        spec = json.load(f)
+    repo = os.path.join(os.path.dirname(target), spec["repo"])
+    return GitTargets(git_repository(repo), spec["revision"])
+
+def sample_target(sample_directory):
+    """target/ of a sample when it is checked out, its target.json otherwise"""
+    checkout = os.path.join(sample_directory, "target")
+    spec = os.path.join(sample_directory, TARGET_SPEC_FILE)
+    return spec if not os.path.isdir(checkout) and os.path.isfile(spec) else checkout
+
+def attach_related_code(backported_file, text):
+    """Cross-file context of the target tree for the validation of backported_file (symbol index, ...)"""
+    if text:
+        current = related_code(backported_file)
+        setattr(backported_file, RELATED_CODE_ATTRIBUTE, f"{current}\n{text}" if current else text)
+
+def related_code(backported_file):
+    return getattr(backported_file, RELATED_CODE_ATTRIBUTE, None)
+
+def blob_cache_report():
+    for repository in _repositories.values():
+        print(f"Git blobs of {repository.repo}: {repository.misses} read, {repository.hits} from cache, "
+              f"{repository.cached_bytes / 1e6:.1f} MB cached")
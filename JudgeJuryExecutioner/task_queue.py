@@ -0,0 +1,282 @@
+import json
+import time
+import sqlite3
+import threading
+
+
+# stages of a single (sample, file) item, validate depends on the first two
+STAGE_COMPARE = "compare"
+STAGE_ABSTRACT = "abstract"
+STAGE_VALIDATE = "validate"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sample TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    payload TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    UNIQUE (sample, file_path, stage)
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id);
+CREATE TABLE IF NOT EXISTS samples (
+    sample TEXT PRIMARY KEY,
+    payload TEXT,
+    total_files INTEGER NOT NULL,
+    finalized INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+class TaskQueue:
+    """
+    SQLite backed queue of (sample, file, stage) tasks shared by any number of worker processes.
+    A claimed task is leased to one worker until lease_expires; the worker keeps the lease alive
+    with heartbeat() and tasks whose lease ran out are handed to the next worker that asks for work.
+    The database only needs a filesystem with working file locks, so workers can run on several hosts.
+    """
+
+    def __init__(self, db_path, lease_seconds=300, max_attempts=3):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        # sqlite connections can not be shared between threads (heartbeats run on their own thread)
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            self._local.db = db
+        return db
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    #### producer side ####
+
+    def add_sample(self, sample, total_files, payload=None):
+        """Register a sample so it can be finalized once all of its files are validated"""
+        with self._transaction() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO samples (sample, payload, total_files) VALUES (?, ?, ?)",
+                (sample, json.dumps(payload), total_files))
+
+    def enqueue(self, sample, file_path, stage, payload=None):
+        with self._transaction() as db:
+            self._enqueue(db, sample, file_path, stage, payload)
+
+    def _enqueue(self, db, sample, file_path, stage, payload):
+        db.execute(
+            "INSERT OR IGNORE INTO tasks (sample, file_path, stage, payload) VALUES (?, ?, ?, ?)",
+            (sample, file_path, stage, json.dumps(payload)))
+
+    #### worker side ####
+
+    def reclaim_expired(self, db, now):
+        """Expired leases go back to pending, or to failed once a task used up its attempts"""
+        db.execute(
+            "UPDATE tasks SET status = 'failed', owner = NULL, error = 'lease expired' "
+            "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+            (now, self.max_attempts))
+        reclaimed = db.execute(
+            "UPDATE tasks SET status = 'pending', owner = NULL "
+            "WHERE status = 'leased' AND lease_expires < ?",
+            (now,)).rowcount
+        if reclaimed:
+            print(f"Reclaimed {reclaimed} expired task lease(s).")
+
+    def claim(self, worker_id):
+        """Lease the oldest pending task to worker_id. Returns the task as a dict, or None if there is nothing to do"""
+        now = time.time()
+        with self._transaction() as db:
+            self.reclaim_expired(db, now)
+            row = db.execute(
+                "SELECT * FROM tasks WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE tasks SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                (worker_id, now + self.lease_seconds, row["id"]))
+
+        task = dict(row)
+        task["payload"] = json.loads(task["payload"]) if task["payload"] else None
+        return task
+
+    def heartbeat(self, task_id, worker_id):
+        """Extend the lease. Returns False when the lease was lost (expired and reclaimed by someone else)"""
+        with self._transaction() as db:
+            updated = db.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE id = ? AND owner = ? AND status = 'leased'",
+                (time.time() + self.lease_seconds, task_id, worker_id)).rowcount
+        return updated == 1
+
+    def complete(self, task_id, worker_id, result):
+        """
+        Store the result of a leased task.
+        Enqueues the validate stage once both compare and abstract of a file are done, and returns
+        the sample name when this completion was the last validation of that sample (the caller then
+        finalizes it). Returns False when the lease had already been lost.
+        """
+        with self._transaction() as db:
+            updated = db.execute(
+                "UPDATE tasks SET status = 'done', result = ?, owner = NULL WHERE id = ? AND owner = ? AND status = 'leased'",
+                (json.dumps(result), task_id, worker_id)).rowcount
+            if updated != 1:
+                return False
+
+            task = db.execute("SELECT sample, file_path, stage FROM tasks WHERE id = ?", (task_id,)).fetchone()
+            if task["stage"] in (STAGE_COMPARE, STAGE_ABSTRACT):
+                done = db.execute(
+                    "SELECT COUNT(*) FROM tasks WHERE sample = ? AND file_path = ? AND stage IN (?, ?) AND status = 'done'",
+                    (task["sample"], task["file_path"], STAGE_COMPARE, STAGE_ABSTRACT)).fetchone()[0]
+                if done == 2:
+                    self._enqueue(db, task["sample"], task["file_path"], STAGE_VALIDATE, None)
+                return None
+
+            return self._mark_finalized(db, task["sample"])
+
+    def fail(self, task_id, worker_id, error):
+        """Give a task back after an error, it is retried until max_attempts is reached"""
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "owner = NULL, error = ? WHERE id = ? AND owner = ?",
+                (self.max_attempts, str(error), task_id, worker_id))
+            task = db.execute("SELECT sample, status FROM tasks WHERE id = ?", (task_id,)).fetchone()
+            if task is not None and task["status"] == "failed":
+                return self._mark_finalized(db, task["sample"])
+        return None
+
+    def skip_sample(self, sample, reason):
+        """
+        Skip every pending or leased task of a sample (fail-fast). Leased tasks lose their lease, so
+        their heartbeat fails and their result is not stored. Returns the sample when it can be finalized.
+        """
+        with self._transaction() as db:
+            skipped = db.execute(
+                "UPDATE tasks SET status = 'skipped', owner = NULL, error = ? "
+                "WHERE sample = ? AND status IN ('pending', 'leased')",
+                (reason, sample)).rowcount
+            if skipped:
+                print(f"Skipped {skipped} outstanding task(s) of sample {sample}.")
+            return self._mark_finalized(db, sample)
+
+    def _mark_finalized(self, db, sample):
+        """Flag a sample as finalized once no file is outstanding anymore, exactly one caller wins"""
+        sample_row = db.execute("SELECT total_files, finalized FROM samples WHERE sample = ?", (sample,)).fetchone()
+        if sample_row is None or sample_row["finalized"]:
+            return None
+        settled_files = db.execute(
+            "SELECT COUNT(DISTINCT file_path) FROM tasks WHERE sample = ? "
+            "AND ((stage = ? AND status = 'done') OR status IN ('failed', 'skipped'))",
+            (sample, STAGE_VALIDATE)).fetchone()[0]
+        if settled_files < sample_row["total_files"]:
+            return None
+        db.execute("UPDATE samples SET finalized = 1 WHERE sample = ?", (sample,))
+        return sample
+
+    def finalize_ready(self):
+        """Finalize samples that became complete without a completing worker, e.g. after a reclaimed lease failed for good"""
+        with self._transaction() as db:
+            rows = db.execute("SELECT sample FROM samples WHERE finalized = 0").fetchall()
+            return [sample for sample in (self._mark_finalized(db, row["sample"]) for row in rows) if sample]
+
+    #### results ####
+
+    def stage_result(self, sample, file_path, stage):
+        row = self._connection().execute(
+            "SELECT result FROM tasks WHERE sample = ? AND file_path = ? AND stage = ? AND status = 'done'",
+            (sample, file_path, stage)).fetchone()
+        return json.loads(row["result"]) if row else None
+
+    def sample_results(self, sample):
+        """Per-file validation results of a sample, failed files are reported with their error"""
+        rows = self._connection().execute(
+            "SELECT file_path, stage, status, result, error FROM tasks WHERE sample = ? ORDER BY id",
+            (sample,)).fetchall()
+        results = {}
+        for row in rows:
+            if row["stage"] == STAGE_VALIDATE and row["status"] == "done":
+                results[row["file_path"]] = json.loads(row["result"])
+            elif row["status"] == "failed":
+                results.setdefault(row["file_path"], f"Error in {row['stage']}: {row['error']}")
+        return results
+
+    def skipped_files(self, sample):
+        """Files of a sample that were skipped without a validation result, with the skip reason"""
+        rows = self._connection().execute(
+            "SELECT file_path, error FROM tasks WHERE sample = ? AND status = 'skipped' ORDER BY id",
+            (sample,)).fetchall()
+        results = self.sample_results(sample)
+        skipped = {}
+        for row in rows:
+            if row["file_path"] not in results:
+                skipped.setdefault(row["file_path"], row["error"])
+        return skipped
+
+    def sample_payload(self, sample):
+        row = self._connection().execute("SELECT payload FROM samples WHERE sample = ?", (sample,)).fetchone()
+        return json.loads(row["payload"]) if row and row["payload"] else None
+
+    def stats(self):
+        rows = self._connection().execute(
+            "SELECT stage, status, COUNT(*) AS count FROM tasks GROUP BY stage, status").fetchall()
+        return {(row["stage"], row["status"]): row["count"] for row in rows}
+
+    def is_drained(self):
+        """True when no task is pending or leased anymore"""
+        row = self._connection().execute(
+            "SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased')").fetchone()
+        return row[0] == 0
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK, taking the write lock up front so claims never race"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+class LeaseKeeper:
+    """Background thread renewing a task lease while the worker is busy with it"""
+
+    def __init__(self, queue, task_id, worker_id, interval):
+        self.queue = queue
+        self.task_id = task_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.queue.heartbeat(self.task_id, self.worker_id):
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
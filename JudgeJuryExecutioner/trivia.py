@@ -0,0 +1,176 @@
+import io
+import re
+import time
+import tokenize
+import textwrap
+
+
+PYTHON_SKIPPED_TOKENS = {tokenize.COMMENT, tokenize.NL, tokenize.ENDMARKER}
+# block structure is kept, a statement moved into or out of a block is not trivia
+PYTHON_STRUCTURE_TOKENS = {tokenize.INDENT: "<indent>", tokenize.DEDENT: "<dedent>", tokenize.NEWLINE: "<newline>"}
+
+C_TOKEN_PATTERN = re.compile(r"""
+      (?P<comment>/\*.*?(?:\*/|$)|//[^\n]*)
+    | (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+    | (?P<word>[A-Za-z_]\w*|\d[\w.]*)
+    | (?P<space>\s+)
+    | (?P<punct>->|\+\+|--|<<=|>>=|<<|>>|<=|>=|==|!=|&&|\|\||[-+*/%&|^]=|\#\#|.)
+""", re.VERBOSE | re.DOTALL)
+
+# loose lexer for fragments the tokenize module refuses (unbalanced brackets, partial strings, ...)
+FALLBACK_TOKEN_PATTERN = re.compile(r"""
+      (?P<comment>\#[^\n]*)
+    | (?P<string>(?:[rRbBuUfF]{0,2})(?:\"\"\".*?(?:\"\"\"|$)|'''.*?(?:'''|$)|"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'))
+    | (?P<word>[A-Za-z_]\w*|\d[\w.]*)
+    | (?P<space>\s+)
+    | (?P<punct>.)
+""", re.VERBOSE | re.DOTALL)
+
+LOCAL_RESULT = {
+    "is_correct": "Yes",
+    "difference_type": "Trivia",
+    "explanation": "Upstream and backported changes differ only in comments, docstring layout or whitespace (resolved locally).",
+    "suggested_fixes": ""
+}
+
+def normalize_string(value):
+    """Triple quoted docstrings are compared with their whitespace collapsed"""
+    if value.endswith('"""') or value.endswith("'''"):
+        return " ".join(value.split())
+    return value
+
+def normalize_docstrings(tokens, statements):
+    """
+    Normalize the docstrings among tokens in place. statements lists the statements in order as
+    [(token index, is a string)]; a docstring is a statement of a single string that comes first in
+    the fragment (the module docstring when it starts the file) or first after a def or class header.
+    Other strings, e.g. expected output literals, stay verbatim.
+    """
+    docstring_next = True
+    for statement in statements:
+        if not statement:
+            continue
+        if docstring_next and len(statement) == 1 and statement[0][1]:
+            tokens[statement[0][0]] = normalize_string(tokens[statement[0][0]])
+        words = [tokens[index] for index, _ in statement]
+        docstring_next = words[0] in ("def", "class", "async") and words[-1] == ":"
+    return tokens
+
+def python_tokens(source):
+    source = textwrap.dedent(source)
+    tokens, statements, statement = [], [], []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(source).readline):
+            if token.type in PYTHON_SKIPPED_TOKENS:
+                continue
+            if token.type == tokenize.NEWLINE:
+                statements.append(statement)
+                statement = []
+            elif token.type not in (tokenize.INDENT, tokenize.DEDENT):
+                statement.append((len(tokens), token.type == tokenize.STRING))
+            tokens.append(PYTHON_STRUCTURE_TOKENS.get(token.type, token.string))
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return regex_tokens(FALLBACK_TOKEN_PATTERN, source, indentation=True)
+    return normalize_docstrings(tokens, statements + [statement])
+
+def c_tokens(source):
+    return regex_tokens(C_TOKEN_PATTERN, source)
+
+def regex_tokens(pattern, source, indentation=False):
+    """
+    Tokens without comments and whitespace. With indentation (the Python fallback), every line
+    that has tokens starts with an <indent:N> token of its leading whitespace (tabs expanded)
+    and lines are taken as statements to find docstrings.
+    """
+    tokens, lines = [], []
+    line_start = None
+    if indentation:
+        # the start of the source counts as the start of a line
+        source = "\n" + source
+    for match in pattern.finditer(source):
+        kind = match.lastgroup
+        value = match.group()
+        if kind == "space":
+            if indentation and "\n" in value:
+                line_start = value.rpartition("\n")[2]
+            continue
+        if kind == "comment":
+            continue
+        if line_start is not None:
+            tokens.append(f"<indent:{len(line_start.expandtabs(8))}>")
+            lines.append([])
+            line_start = None
+        if lines:
+            lines[-1].append((len(tokens), kind == "string"))
+        tokens.append(value)
+    return normalize_docstrings(tokens, lines) if indentation else tokens
+
+LEXERS = {
+    ".py": python_tokens,
+    ".c": c_tokens,
+    ".h": c_tokens,
+}
+
+def lexer_for(path):
+    for extension, lexer in LEXERS.items():
+        if path.endswith(extension):
+            return lexer
+    return None
+
+def hunk_tokens(hunk, lexer):
+    """
+    Token streams of the old and the new side of a hunk, context lines included, so a change
+    that lands at another place among the same context lines gives other tokens
+    """
+    before = "".join(line.value for line in hunk if not line.is_added)
+    after = "".join(line.value for line in hunk if not line.is_removed)
+    return lexer(before), lexer(after)
+
+def hunk_gaps(hunks):
+    """Distances between the starts of consecutive hunks in the original file"""
+    return [later.source_start - earlier.source_start for earlier, later in zip(hunks, hunks[1:])]
+
+def hunks_differ_only_in_trivia(upstream_hunks, backported_hunks, path):
+    """
+    True when every upstream hunk and the backported hunk at the same position change the same
+    tokens among the same context, ignoring comments, whitespace inside lines, form feeds and
+    docstring reflowing. Python indentation still counts. Returns None for languages without a lexer.
+    """
+    lexer = lexer_for(path)
+    if lexer is None:
+        return None
+    if len(upstream_hunks) != len(backported_hunks) or hunk_gaps(upstream_hunks) != hunk_gaps(backported_hunks):
+        return False
+    return all(hunk_tokens(upstream_hunk, lexer) == hunk_tokens(backported_hunk, lexer)
+               for upstream_hunk, backported_hunk in zip(upstream_hunks, backported_hunks))
+
+
+class TriviaDetector:
+    """Resolves file pairs whose changes only differ in trivia without any model call, and keeps the savings"""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.resolved_files = 0
+        self.calls_saved = 0
+        self.lexing_seconds = 0.0
+
+    def check(self, upstream_file, backported_file, calls_avoided):
+        """calls_avoided is the number of model calls the file would otherwise cost"""
+        if not self.enabled:
+            return False
+
+        start = time.perf_counter()
+        trivial = hunks_differ_only_in_trivia(list(upstream_file), list(backported_file), backported_file.path)
+        self.lexing_seconds += time.perf_counter() - start
+
+        if trivial:
+            self.resolved_files += 1
+            self.calls_saved += calls_avoided
+        return bool(trivial)
+
+    def report(self, seconds_per_call):
+        if not self.resolved_files:
+            return
+        print(f"Trivia detector: {self.resolved_files} file(s) resolved locally, {self.calls_saved} model calls saved "
+              f"(~{self.calls_saved * seconds_per_call:.0f}s at {seconds_per_call:.1f}s per call, "
+              f"{self.lexing_seconds * 1000:.1f}ms spent lexing)")
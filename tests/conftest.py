@@ -0,0 +1,17 @@
+import os
+import sys
+import textwrap
+import pytest
+from unidiff import PatchSet
+
+# the modules import each other by bare name, as when JuryExecutioner.py is run as a script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "JudgeJuryExecutioner"))
+
+
+def parse_patch(text):
+    """First file of a unified diff, the text is dedented first"""
+    return PatchSet(textwrap.dedent(text))[0]
+
+@pytest.fixture
+def patch():
+    return parse_patch
@@ -0,0 +1,9 @@
+from backends import Backend, StubBackend, LOCAL_LLM_MODEL
+
+
+def test_pause_keeps_calls_within_the_rpm():
+    assert Backend().pause_after("compare") == 3
+
+def test_no_pause_without_a_rate_limit():
+    assert StubBackend().pause_after("validate") == 0
+    assert Backend({"abstract": LOCAL_LLM_MODEL}).pause_after("abstract") == 0
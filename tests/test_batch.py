@@ -0,0 +1,41 @@
+from backends import StubBackend
+from batch import BatchWriter, STAGE12, batch_path, submit, fetch, read_results
+
+
+def render(batch_dir, file_paths):
+    backend = StubBackend()
+    with BatchWriter(batch_path(batch_dir, STAGE12, "requests")) as writer:
+        for file_path in file_paths:
+            writer.add("0001", file_path, "compare", backend.request_body("compare", "system", [(file_path, False)]))
+
+
+class RemoteBackend(StubBackend):
+    def __init__(self):
+        super().__init__()
+        self.fetched = []
+
+    def submit_batch(self, input_path):
+        return f"batch-{len(self.fetched) + 1}"
+
+    def fetch_batch(self, batch_id, results_path):
+        self.fetched.append(batch_id)
+        return False
+
+
+def test_second_render_gets_its_own_results(tmp_path):
+    batch_dir = str(tmp_path)
+    render(batch_dir, ["a.py"])
+    submit(StubBackend(), batch_dir, STAGE12)
+    render(batch_dir, ["b.py"])
+    submit(StubBackend(), batch_dir, STAGE12)
+    assert list(read_results(fetch(StubBackend(), batch_dir, STAGE12))) == [("0001", "b.py", "compare")]
+
+def test_remote_submission_drops_earlier_results(tmp_path):
+    batch_dir = str(tmp_path)
+    render(batch_dir, ["a.py"])
+    submit(StubBackend(), batch_dir, STAGE12)
+    backend = RemoteBackend()
+    render(batch_dir, ["b.py"])
+    assert not submit(backend, batch_dir, STAGE12, remote=True)
+    assert fetch(backend, batch_dir, STAGE12) is None
+    assert backend.fetched == ["batch-1"]
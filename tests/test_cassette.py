@@ -0,0 +1,73 @@
+import time
+import pytest
+from backends import StubBackend
+from cassette import Cassette, CassetteBackend, CassetteMissError
+
+
+class SlowBackend(StubBackend):
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.calls = 0
+
+    def send(self, stage, body):
+        self.calls += 1
+        time.sleep(self.delay)
+        return super().send(stage, body)
+
+def call(backend, text="prompt"):
+    return backend.complete("validate", "system", [(text, False)])
+
+
+def test_replay_returns_the_recorded_answer(tmp_path):
+    path = str(tmp_path / "calls.jsonl.gz")
+    recorded = call(CassetteBackend(SlowBackend(0), Cassette(path), "record"))
+
+    inner = SlowBackend(0)
+    replayed = call(CassetteBackend(inner, Cassette(path), "replay"))
+    assert inner.calls == 0
+    assert (replayed.content, replayed.prompt_tokens, replayed.completion_tokens) == \
+        (recorded.content, recorded.prompt_tokens, recorded.completion_tokens)
+
+def test_unrecorded_request_misses(tmp_path):
+    path = str(tmp_path / "calls.jsonl.gz")
+    call(CassetteBackend(SlowBackend(0), Cassette(path), "record"))
+    with pytest.raises(CassetteMissError):
+        call(CassetteBackend(SlowBackend(0), Cassette(path), "replay"), "other prompt")
+
+def test_replay_latency(tmp_path):
+    path = str(tmp_path / "calls.jsonl.gz")
+    call(CassetteBackend(SlowBackend(0.3), Cassette(path), "record"))
+
+    start = time.perf_counter()
+    call(CassetteBackend(SlowBackend(0), Cassette(path), "replay"))
+    assert time.perf_counter() - start < 0.2
+    start = time.perf_counter()
+    call(CassetteBackend(SlowBackend(0), Cassette(path), "replay", realtime=True))
+    assert time.perf_counter() - start >= 0.3
+
+def test_recording_appends_and_repeats_replay_in_order(tmp_path):
+    path = str(tmp_path / "calls.jsonl.gz")
+    first = Cassette(path)
+    second = Cassette(path)
+    body = StubBackend().request_body("validate", "system", [("prompt", False)])
+    first.record("validate", body, StubBackend().send("validate", body), 0.1)
+    answer = StubBackend().send("validate", body)
+    answer.content = "second answer"
+    second.record("validate", body, answer, 0.2)
+
+    cassette = Cassette(path)
+    assert len(cassette) == 2
+    latencies = [cassette.play("validate", body)["latency"] for _ in range(3)]
+    assert latencies == [0.1, 0.2, 0.2]
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        CassetteBackend(StubBackend(), None, "rewind")
+
+def test_replay_keeps_no_rate_limit_pauses(tmp_path):
+    path = str(tmp_path / "calls.jsonl.gz")
+    rate_limited = {"compare": "deepseek/deepseek-r1:free"}
+    assert CassetteBackend(StubBackend(rate_limited), Cassette(path), "record").pause_after("compare") == 3
+    assert CassetteBackend(StubBackend(rate_limited), Cassette(path), "replay").pause_after("compare") == 0
+    assert CassetteBackend(StubBackend(rate_limited), Cassette(path), "replay", realtime=True).pause_after("compare") == 0
@@ -0,0 +1,50 @@
+import json
+import threading
+import http.client
+import pytest
+from daemon import ValidationDaemon, make_server
+
+
+@pytest.fixture
+def server():
+    daemon = ValidationDaemon(lambda request: {"verdict": "correct", "files": []})
+    daemon.start_workers()
+    server = make_server("127.0.0.1:0", daemon)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def post(server, body):
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=10)
+    connection.request("POST", "/jobs", body=body, headers={"Content-Type": "application/json"})
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+def get(server, path):
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=10)
+    connection.request("GET", path)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+@pytest.mark.parametrize("body", [b"[1]", b"5", b'"text"', b"null", b"{not json"])
+def test_non_object_body_is_rejected(server, body):
+    status, reply = post(server, body)
+    assert status == 400 and reply["error"]
+
+def test_missing_fields_are_rejected(server):
+    status, reply = post(server, json.dumps({"upstream_patch": "u.patch"}).encode())
+    assert status == 400 and "backported_patch" in reply["error"]
+
+def test_non_string_fields_are_rejected(server):
+    request = {"upstream_patch": "u.patch", "backported_patch": "b.patch", "target": ["t"]}
+    status, reply = post(server, json.dumps(request).encode())
+    assert status == 400 and "target" in reply["error"]
+
+def test_job_runs(server):
+    request = {"upstream_patch": "u.patch", "backported_patch": "b.patch", "target": "t"}
+    status, reply = post(server, json.dumps(request).encode())
+    assert status == 202
+    status, job = get(server, f"/jobs/{reply['id']}?wait=10")
+    assert status == 200 and job["status"] == "done" and job["result"]["verdict"] == "correct"
@@ -0,0 +1,65 @@
+import pytest
+from fingerprints import ResultStore, file_fingerprint, target_region, changed_parts
+from targets import attach_related_code
+
+
+UPSTREAM = """\
+    --- a/mod.py
+    +++ b/mod.py
+    @@ -2,2 +2,3 @@ def check(value):
+         use(value)
+    +    validate(value)
+         return value
+    """
+
+TARGET = "".join(f"line {number}\n" for number in range(1, 201))
+
+def fingerprint(patch, upstream=UPSTREAM, backport=UPSTREAM, target=TARGET, config="full"):
+    return file_fingerprint(patch(upstream), patch(backport), target, config)
+
+
+def test_same_inputs_same_fingerprint(patch):
+    assert fingerprint(patch) == fingerprint(patch)
+
+def test_shifted_hunks_keep_their_fingerprint(patch):
+    shifted = UPSTREAM.replace("@@ -2,2 +2,3 @@", "@@ -12,2 +12,3 @@")
+    assert fingerprint(patch, upstream=shifted)["upstream"] == fingerprint(patch)["upstream"]
+
+@pytest.mark.parametrize("part, changes", [
+    ("upstream", {"upstream": UPSTREAM.replace("validate(value)", "check(value)")}),
+    ("backport", {"backport": UPSTREAM.replace("validate(value)", "check(value)")}),
+    ("target", {"target": TARGET.replace("line 30\n", "changed\n")}),
+    ("config", {"config": "cheap"}),
+])
+def test_each_part_changes_alone(patch, part, changes):
+    assert changed_parts(fingerprint(patch), fingerprint(patch, **changes)) == [part]
+
+def test_target_outside_the_region_is_ignored(patch):
+    assert fingerprint(patch, target=TARGET.replace("line 150\n", "changed\n")) == fingerprint(patch)
+
+def test_target_region_has_margin(patch):
+    region = target_region(TARGET, patch(UPSTREAM), margin=2)
+    assert region == "".join(f"line {number}\n" for number in range(1, 6))
+
+def test_related_code_is_part_of_the_target(patch):
+    backported = patch(UPSTREAM)
+    attach_related_code(backported, "def validate(value): ...")
+    assert file_fingerprint(patch(UPSTREAM), backported, TARGET, "full")["target"] != fingerprint(patch)["target"]
+
+def test_store_round_trip(tmp_path, patch):
+    path = str(tmp_path / "fingerprints.json")
+    store = ResultStore(path)
+    assert store.lookup("0001", "mod.py", fingerprint(patch)) is None
+    store.record("0001", "mod.py", fingerprint(patch), {"is_correct": "Yes"})
+    store.save()
+
+    reloaded = ResultStore(path)
+    assert reloaded.lookup("0001", "mod.py", fingerprint(patch)) == {"is_correct": "Yes"}
+    assert reloaded.lookup("0001", "mod.py", fingerprint(patch, config="cheap")) is None
+    assert (reloaded.reused, reloaded.rejudged) == (1, 1)
+
+@pytest.mark.parametrize("result", [{"is_correct": "Unknown"}, {"is_correct": "Skipped"}, "Error in compare: timeout"])
+def test_failed_and_skipped_results_are_not_stored(patch, result):
+    store = ResultStore(None)
+    store.record("0001", "mod.py", fingerprint(patch), result)
+    assert store.lookup("0001", "mod.py", fingerprint(patch)) is None
@@ -0,0 +1,19 @@
+import json
+from Judge import Judge
+from JuryExecutioner import judging_config
+
+
+def test_config_covers_every_judge_setting(monkeypatch):
+    config = json.loads(judging_config("full"))
+    for name, value in Judge.settings().items():
+        assert config[name] == value
+
+def test_semantic_diff_changes_the_config(monkeypatch):
+    plain = judging_config("full")
+    monkeypatch.setattr(Judge, "semantic_diff", True)
+    assert judging_config("full") != plain
+
+def test_votes_change_the_config(monkeypatch):
+    single = judging_config("full")
+    monkeypatch.setattr(Judge, "votes", 3)
+    assert judging_config("full") != single
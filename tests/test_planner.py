@@ -0,0 +1,19 @@
+import hashlib
+import planner
+
+
+def test_tiktoken_cache_is_looked_up_without_download(tmp_path, monkeypatch):
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(tmp_path))
+    assert not planner.tiktoken_cached()
+    (tmp_path / hashlib.sha1(planner.CL100K_BASE_URL.encode()).hexdigest()).write_text("")
+    assert planner.tiktoken_cached()
+
+def test_disabled_tiktoken_cache(monkeypatch):
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", "")
+    assert not planner.tiktoken_cached()
+
+def test_count_tokens_falls_back_to_characters(tmp_path, monkeypatch):
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(planner, "_encoding", {})
+    assert planner.count_tokens("x" * 400) == planner.estimate_tokens("x" * 400)
+    assert planner._encoding["encoding"] is None
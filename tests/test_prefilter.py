@@ -0,0 +1,55 @@
+import pytest
+from prefilter import PreClassifier, glob_pattern, ROUTE_SKIP, ROUTE_CHEAP, ROUTE_FULL
+
+
+def diff(path, added="+x = 1\n"):
+    return f"--- a/{path}\n+++ b/{path}\n@@ -1,1 +1,2 @@\n line = 0\n{added}"
+
+def classify(patch, path, target_text=None, tmp_path=None, added="+x = 1\n"):
+    target_path = None
+    if target_text is not None:
+        target_path = tmp_path / "target"
+        target_path.write_text(target_text)
+    return PreClassifier().classify(patch(diff(path, added)), target_path=str(target_path) if target_path else None)
+
+
+@pytest.mark.parametrize("glob, path, matches", [
+    ("*.rst", "Doc/library/os.rst", True),
+    ("Doc/**", "Doc/library/os.rst", True),
+    ("Doc/*", "Doc/library/os.rst", False),
+    ("Misc/NEWS.d/**", "Misc/NEWS.d/next/Library/2024.bpo.rst", True),
+    ("NEWS*", "Misc/NEWS", True),
+    ("*.md", "Lib/notes.mdx", False),
+])
+def test_glob_pattern(glob, path, matches):
+    assert bool(glob_pattern(glob).match(path)) == matches
+
+@pytest.mark.parametrize("path, route", [
+    ("Doc/library/os.rst", ROUTE_SKIP),
+    ("Misc/NEWS.d/next/Library/2024-01-01.gh-issue-1.rst", ROUTE_SKIP),
+    ("Doc/conf.py", ROUTE_CHEAP),
+    ("README.md", ROUTE_CHEAP),
+    ("CMakeLists.txt", ROUTE_FULL),
+    ("requirements.txt", ROUTE_FULL),
+    ("Lib/os.py", ROUTE_FULL),
+])
+def test_routes_by_path(patch, path, route):
+    assert classify(patch, path)[0] == route
+
+def test_generated_header_is_cheap(patch, tmp_path):
+    assert classify(patch, "Python/opcode_targets.h", "/* @generated by gen.py, DO NOT EDIT */\nint x;\n", tmp_path) == \
+        (ROUTE_CHEAP, "generated-file")
+
+def test_generated_by_comment_in_source_is_full(patch, tmp_path):
+    source = "import os\n\n\ndef main():\n    pass\n\n# tables below are generated by main()\n"
+    assert classify(patch, "Lib/tables.py", source, tmp_path)[0] == ROUTE_FULL
+
+def test_marker_past_the_header_is_full(patch, tmp_path):
+    source = "\n".join(["x = 1"] * 10 + ["# DO NOT EDIT below this line"]) + "\n"
+    assert classify(patch, "Lib/tables.py", source, tmp_path)[0] == ROUTE_FULL
+
+def test_marker_in_added_lines_of_an_existing_file_is_full(patch, tmp_path):
+    assert classify(patch, "Lib/tables.py", "x = 1\n", tmp_path, added="+# DO NOT EDIT this constant\n")[0] == ROUTE_FULL
+
+def test_binary_target_is_skipped(patch, tmp_path):
+    assert classify(patch, "Lib/data.bin", "abc\0def", tmp_path)[0] == ROUTE_SKIP
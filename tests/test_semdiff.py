@@ -0,0 +1,62 @@
+from semdiff import compute_delta
+
+
+UPSTREAM = """\
+    --- a/mod.py
+    +++ b/mod.py
+    @@ -1,5 +1,8 @@
+     import os
+    +import sys
+     
+     def check(value):
+    +    if value < 0:
+    +        raise ValueError(value)
+         use(value)
+         return value
+    """
+
+
+def test_identical_changes_are_reported_identical(patch):
+    delta = compute_delta(patch(UPSTREAM), patch(UPSTREAM.replace("raise ValueError(value)", "raise ValueError( value )  # bad")))
+    assert delta.startswith("Identical in both patches: import sys (added), function check (modified)")
+    assert "Changed differently" not in delta
+
+def test_moved_check_is_reported_as_differing(patch):
+    backport = UPSTREAM.replace("""\
+    +    if value < 0:
+    +        raise ValueError(value)
+         use(value)
+""", """\
+         use(value)
+    +    if value < 0:
+    +        raise ValueError(value)
+""")
+    delta = compute_delta(patch(UPSTREAM), patch(backport))
+    assert "function check (modified)" not in delta.splitlines()[0]
+    assert "Changed differently:\n  function check" in delta
+    assert "after `use(value)`" in delta
+
+def test_reindented_raise_is_reported_as_differing(patch):
+    upstream = """\
+        --- a/mod.py
+        +++ b/mod.py
+        @@ -1,4 +1,5 @@
+         def check(value):
+             if value < 0:
+                 log(value)
+        +        raise ValueError(value)
+             return value
+        """
+    delta = compute_delta(patch(upstream), patch(upstream.replace("+        raise", "+    raise")))
+    assert delta.startswith("Identical in both patches: nothing")
+    assert "function check (upstream: modified, backport: modified)" in delta
+
+def test_symbol_only_in_one_patch(patch):
+    backport = UPSTREAM.replace("+import sys\n", "")
+    backport = backport.replace("@@ -1,5 +1,8 @@", "@@ -1,5 +1,7 @@")
+    delta = compute_delta(patch(UPSTREAM), patch(backport))
+    assert "Only in the upstream patch:\n  import sys (added)" in delta
+
+def test_unsupported_language(patch):
+    upstream = UPSTREAM.replace("mod.py", "mod.rst")
+    assert compute_delta(patch(upstream), patch(upstream)) is None
@@ -0,0 +1,17 @@
+import json
+from sharding import merge_shards, shard_output_path
+
+
+def write_store(path, entries):
+    with open(path, 'w') as f:
+        json.dump(entries, f)
+
+def test_merge_combines_the_fingerprint_stores(tmp_path):
+    merged = str(tmp_path / "result_fingerprints.json")
+    write_store(merged, {"0001:a.py": "old", "0002:b.py": "kept"})
+    write_store(shard_output_path(merged, 0, 2), {"0001:a.py": "new"})
+    write_store(shard_output_path(merged, 1, 2), {"0003:c.py": "added"})
+    missing = str(tmp_path / "missing")
+    merge_shards(missing + ".csv", missing + ".txt", missing + "_functions.txt", merged)
+    with open(merged) as f:
+        assert json.load(f) == {"0001:a.py": "new", "0002:b.py": "kept", "0003:c.py": "added"}
@@ -0,0 +1,35 @@
+import subprocess
+import pytest
+from targets import GitRepository, GitTargets
+
+
+@pytest.fixture
+def repository(tmp_path):
+    def git(*args):
+        subprocess.run(["git", "-C", str(tmp_path), *args], check=True, capture_output=True)
+    git("init", "-q")
+    (tmp_path / "Lib").mkdir()
+    (tmp_path / "Lib" / "mod.py").write_text("x = 1\n")
+    (tmp_path / "Lib" / "a b.py").write_text("y = 2\n")
+    git("add", ".")
+    git("-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-q", "-m", "initial")
+    repository = GitRepository(str(tmp_path))
+    yield repository
+    repository.close()
+
+
+def test_read_existing_files(repository):
+    assert repository.read("HEAD", "Lib/mod.py") == b"x = 1\n"
+    assert repository.read("HEAD", "Lib/a b.py") == b"y = 2\n"
+
+def test_missing_path_with_spaces(repository):
+    assert repository.read("HEAD", "Lib/a b missing.py") is None
+    assert repository.read("HEAD", "Lib/c d.py") is None
+    # the process is still in sync afterwards
+    assert repository.read("HEAD", "Lib/mod.py") == b"x = 1\n"
+
+def test_directory_is_not_a_file(repository):
+    assert not GitTargets(repository, "HEAD").exists("Lib")
+
+def test_list_files(repository):
+    assert sorted(path for path, _ in GitTargets(repository, "HEAD").list_files()) == ["Lib/a b.py", "Lib/mod.py"]
@@ -0,0 +1,102 @@
+import pytest
+from task_queue import TaskQueue, LeaseKeeper, STAGE_COMPARE, STAGE_ABSTRACT, STAGE_VALIDATE
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return TaskQueue(str(tmp_path / "queue.db"), lease_seconds=60, max_attempts=2)
+
+def add_file(queue, sample="0001", file_path="Lib/mod.py", total_files=1):
+    queue.add_sample(sample, total_files, {"sample": sample})
+    queue.enqueue(sample, file_path, STAGE_COMPARE, {"stage": STAGE_COMPARE})
+    queue.enqueue(sample, file_path, STAGE_ABSTRACT, {"stage": STAGE_ABSTRACT})
+
+def expire_leases(queue):
+    queue._connection().execute("UPDATE tasks SET lease_expires = 0 WHERE status = 'leased'")
+
+
+def test_tasks_are_claimed_once_in_order(queue):
+    add_file(queue)
+    first, second = queue.claim("a"), queue.claim("b")
+    assert (first["stage"], second["stage"]) == (STAGE_COMPARE, STAGE_ABSTRACT)
+    assert first["payload"] == {"stage": STAGE_COMPARE}
+    assert queue.claim("c") is None
+
+def test_enqueue_is_idempotent(queue):
+    add_file(queue)
+    add_file(queue)
+    assert sum(queue.stats().values()) == 2
+
+def test_validate_follows_compare_and_abstract_and_finalizes(queue):
+    add_file(queue)
+    compare, abstract = queue.claim("a"), queue.claim("a")
+    assert queue.complete(compare["id"], "a", {"discrepancies": []}) is None
+    assert queue.claim("a") is None
+    assert queue.complete(abstract["id"], "a", "abstract code") is None
+
+    validate = queue.claim("a")
+    assert validate["stage"] == STAGE_VALIDATE
+    assert queue.stage_result("0001", "Lib/mod.py", STAGE_COMPARE) == {"discrepancies": []}
+    assert queue.complete(validate["id"], "a", {"is_correct": "Yes"}) == "0001"
+    assert queue.sample_results("0001") == {"Lib/mod.py": {"is_correct": "Yes"}}
+    assert queue.sample_payload("0001") == {"sample": "0001"}
+    assert queue.is_drained()
+
+def test_sample_waits_for_all_files(queue):
+    add_file(queue, file_path="Lib/a.py", total_files=2)
+    add_file(queue, file_path="Lib/b.py", total_files=2)
+    finalized = []
+    while (task := queue.claim("a")) is not None:
+        finalized.append(queue.complete(task["id"], "a", {"is_correct": "Yes"}))
+    assert [sample for sample in finalized if sample] == ["0001"]
+
+def test_expired_lease_is_handed_out_again(queue):
+    add_file(queue)
+    task = queue.claim("crashed")
+    expire_leases(queue)
+    assert queue.claim("b")["id"] == task["id"]
+    # the first worker lost its lease and can neither renew nor complete the task
+    assert not queue.heartbeat(task["id"], "crashed")
+    assert queue.complete(task["id"], "crashed", {}) is False
+    assert queue.heartbeat(task["id"], "b")
+
+def test_lease_expiring_too_often_fails_the_task_and_finalizes(queue):
+    add_file(queue)
+    for _ in range(2):
+        task = queue.claim("a")
+        assert task["stage"] == STAGE_COMPARE
+        expire_leases(queue)
+    queue.claim("a")    # reclaims the compare task for good and leases abstract
+    assert queue.stats()[(STAGE_COMPARE, "failed")] == 1
+    assert queue.finalize_ready() == ["0001"]
+    assert queue.sample_results("0001") == {"Lib/mod.py": "Error in compare: lease expired"}
+
+def test_failed_task_is_retried_until_max_attempts(queue):
+    add_file(queue)
+    task = queue.claim("a")
+    assert queue.fail(task["id"], "a", "timeout") is None
+    task = queue.claim("a")
+    assert task["stage"] == STAGE_COMPARE
+    # a failed file is settled, so its only file failing finalizes the sample
+    assert queue.fail(task["id"], "a", "timeout") == "0001"
+    assert queue.stats()[(STAGE_COMPARE, "failed")] == 1
+
+def test_skip_sample(queue):
+    add_file(queue)
+    leased = queue.claim("a")
+    assert queue.skip_sample("0001", "fail-fast") == "0001"
+    assert queue.skipped_files("0001") == {"Lib/mod.py": "fail-fast"}
+    assert not queue.heartbeat(leased["id"], "a")
+    assert queue.is_drained()
+
+def test_lease_keeper_notices_a_lost_lease(queue):
+    add_file(queue)
+    task = queue.claim("a")
+    expire_leases(queue)
+    queue.claim("b")
+    with LeaseKeeper(queue, task["id"], "a", interval=0.01) as keeper:
+        for _ in range(200):
+            if keeper.lost:
+                break
+            keeper._stop.wait(0.01)
+    assert keeper.lost
@@ -0,0 +1,148 @@
+from trivia import hunks_differ_only_in_trivia, python_tokens
+
+
+UPSTREAM_CHECK = """\
+    --- a/mod.py
+    +++ b/mod.py
+    @@ -1,3 +1,5 @@
+     def check(value):
+    +    if value < 0:
+    +        raise ValueError(value)
+         use(value)
+         return value
+    """
+
+def trivial(patch, upstream, backport, path="mod.py"):
+    return hunks_differ_only_in_trivia(list(patch(upstream)), list(patch(backport)), path)
+
+
+def test_comment_and_whitespace_differences_are_trivia(patch):
+    backport = """\
+        --- a/mod.py
+        +++ b/mod.py
+        @@ -1,3 +1,5 @@
+         def check(value):
+        +    if value  <  0:   # negative values are invalid
+        +        raise ValueError( value )
+             use(value)
+             return value
+        """
+    assert trivial(patch, UPSTREAM_CHECK, backport)
+
+def test_docstring_reflow_is_trivia(patch):
+    upstream = """\
+        --- a/mod.py
+        +++ b/mod.py
+        @@ -1,2 +1,3 @@
+         def check(value):
+        +    \"\"\"Reject negative values.\"\"\"
+             return value
+        """
+    backport = """\
+        --- a/mod.py
+        +++ b/mod.py
+        @@ -1,2 +1,4 @@
+         def check(value):
+        +    \"\"\"Reject negative
+        +    values.\"\"\"
+             return value
+        """
+    assert trivial(patch, upstream, backport)
+
+def test_check_moved_after_its_use_is_not_trivia(patch):
+    backport = """\
+        --- a/mod.py
+        +++ b/mod.py
+        @@ -1,3 +1,5 @@
+         def check(value):
+             use(value)
+        +    if value < 0:
+        +        raise ValueError(value)
+             return value
+        """
+    assert trivial(patch, UPSTREAM_CHECK, backport) is False
+
+def test_raise_moved_out_of_its_block_is_not_trivia(patch):
+    upstream = """\
+        --- a/mod.py
+        +++ b/mod.py
+        @@ -1,4 +1,5 @@
+         def check(value):
+             if value < 0:
+                 log(value)
+        +        raise ValueError(value)
+             return value
+        """
+    backport = """\
+        --- a/mod.py
+        +++ b/mod.py
+        @@ -1,4 +1,5 @@
+         def check(value):
+             if value < 0:
+                 log(value)
+        +    raise ValueError(value)
+             return value
+        """
+    assert trivial(patch, upstream, backport) is False
+
+def test_reindented_raise_is_not_trivia_in_fragments_tokenize_rejects(patch):
+    # the hunk starts inside the block, tokenize fails and the regex fallback is used
+    upstream = """\
+        --- a/mod.py
+        +++ b/mod.py
+        @@ -3,2 +3,3 @@
+                 log(value)
+        +        raise ValueError(value)
+             return value
+        """
+    backport = """\
+        --- a/mod.py
+        +++ b/mod.py
+        @@ -3,2 +3,3 @@
+                 log(value)
+        +    raise ValueError(value)
+             return value
+        """
+    assert trivial(patch, upstream, backport) is False
+
+def test_hunks_at_other_distances_are_not_trivia(patch):
+    upstream = """\
+        --- a/mod.py
+        +++ b/mod.py
+        @@ -1,1 +1,2 @@
+         a = 1
+        +b = 2
+        @@ -10,1 +11,2 @@
+         c = 3
+        +d = 4
+        """
+    backport = upstream.replace("@@ -10,1 +11,2 @@", "@@ -20,1 +21,2 @@")
+    assert trivial(patch, upstream, backport) is False
+
+def test_c_comments_are_trivia(patch):
+    upstream = """\
+        --- a/mod.c
+        +++ b/mod.c
+        @@ -1,2 +1,3 @@
+         int f(int x) {
+        +    if (x < 0) return -1;
+             return x;
+        """
+    backport = upstream.replace("return -1;", "return -1;  /* invalid */")
+    assert trivial(patch, upstream, backport, "mod.c")
+
+def test_unsupported_language_is_undecided(patch):
+    assert trivial(patch, UPSTREAM_CHECK, UPSTREAM_CHECK, "mod.rst") is None
+
+def test_python_tokens_keep_block_structure():
+    assert python_tokens("if x:\n    y()\nz()\n") != python_tokens("if x:\n    y()\n    z()\n")
+
+def test_whitespace_inside_string_literals_is_kept():
+    expected = 'EXPECTED = """\nline1\n    line2\n"""\n'
+    assert python_tokens(expected) != python_tokens(expected.replace("    line2", "line2"))
+
+def test_docstrings_are_normalized_in_fragments_tokenize_rejects():
+    fragment = 'def f(x:\n    """Check\n    x."""\n'
+    assert python_tokens(fragment) == python_tokens(fragment.replace("Check\n    x.", "Check x."))
+    literal = 'f(x,\n  """a\n  b""")\n'
+    assert python_tokens(literal) != python_tokens(literal.replace("a\n  b", "a b"))
@@ -0,0 +1,36 @@
+from JuryExecutioner import sample_verdict, failed_result, skipped_result, finalize_queued_sample
+from task_queue import TaskQueue, STAGE_COMPARE
+
+
+def results(*answers):
+    return [{"file_path": f"file{index}.py", "result": answer} for index, answer in enumerate(answers)]
+
+YES = {"is_correct": "Yes"}
+NO = {"is_correct": "No"}
+
+
+def test_all_files_correct():
+    assert sample_verdict(results(YES, YES)) == "correct"
+
+def test_one_incorrect_file_makes_the_sample_incorrect():
+    assert sample_verdict(results(YES, NO, skipped_result("fail-fast"))) == "incorrect"
+
+def test_failed_file_makes_the_sample_unknown():
+    assert sample_verdict(results(YES, failed_result(TimeoutError("timed out")))) == "unknown"
+
+def test_incorrect_wins_over_unknown():
+    assert sample_verdict(results(failed_result(TimeoutError("timed out")), NO)) == "incorrect"
+
+def test_error_text_makes_the_sample_unknown():
+    assert sample_verdict(results(YES, "Error in compare: boom")) == "unknown"
+
+def test_failed_queue_task_makes_the_sample_unknown(tmp_path):
+    queue = TaskQueue(str(tmp_path / "queue.db"), max_attempts=1)
+    queue.add_sample("0001", 1)
+    queue.enqueue("0001", "Lib/mod.py", STAGE_COMPARE)
+    task = queue.claim("worker")
+    assert queue.fail(task["id"], "worker", "boom") == "0001"
+
+    csv_file = tmp_path / "verdicts.csv"
+    finalize_queued_sample(queue, "0001", str(tmp_path / "results.txt"), str(csv_file))
+    assert "0001,unknown" in csv_file.read_text()
@@ -0,0 +1,66 @@
+import json
+import time
+import pytest
+from Judge import Judge
+from backends import StubBackend, Completion, DEFAULT_SEED
+
+
+class VotingBackend(StubBackend):
+    """Validation answers by vote number, a number in delays makes that vote slow"""
+
+    def __init__(self, verdicts, delays=None):
+        super().__init__()
+        self.verdicts = verdicts
+        self.delays = delays or {}
+        self.sent = []
+
+    def send(self, stage, body):
+        vote = body["seed"] - DEFAULT_SEED
+        self.sent.append(vote)
+        time.sleep(self.delays.get(vote, 0))
+        if self.verdicts[vote] is None:
+            raise TimeoutError("vote timed out")
+        return Completion(json.dumps({"is_correct": self.verdicts[vote], "explanation": f"vote {vote}"}))
+
+def vote(monkeypatch, verdicts, delays=None, backend=None):
+    monkeypatch.setattr(Judge, "votes", len(verdicts))
+    return Judge(backend or VotingBackend(verdicts, delays)).validate_with_context("[]", "mod.py", "x = 1\n")
+
+
+def test_majority_wins(monkeypatch):
+    result = vote(monkeypatch, ["Yes", "No", "No"], delays={0: 0.2})
+    assert result["is_correct"] == "No"
+    assert result["agreement"] == "2/3"
+
+def test_tie_goes_to_no(monkeypatch):
+    result = vote(monkeypatch, ["Yes", "No"])
+    assert (result["is_correct"], result["agreement"]) == ("No", "1/2")
+
+def test_voting_stops_once_the_majority_is_settled(monkeypatch):
+    start = time.perf_counter()
+    result = vote(monkeypatch, ["Yes", "Yes", "No"], delays={2: 2})
+    assert time.perf_counter() - start < 1.5
+    assert (result["is_correct"], result["agreement"]) == ("Yes", "2/2")
+
+def test_votes_not_needed_are_never_sent(monkeypatch):
+    backend = VotingBackend(["Yes", "Yes", "Yes", "No", "No"])
+    result = vote(monkeypatch, backend.verdicts, backend=backend)
+    assert (result["is_correct"], result["agreement"]) == ("Yes", "3/3")
+    assert sorted(backend.sent) == [0, 1, 2]
+
+def test_open_outcome_sends_more_votes(monkeypatch):
+    backend = VotingBackend(["Yes", "No", "Yes", "No", "No"])
+    result = vote(monkeypatch, backend.verdicts, backend=backend)
+    assert (result["is_correct"], result["agreement"]) == ("No", "3/5")
+    assert sorted(backend.sent) == [0, 1, 2, 3, 4]
+
+def test_failed_votes_do_not_count(monkeypatch):
+    result = vote(monkeypatch, [None, "Yes", "Yes"])
+    assert result["is_correct"] == "Yes"
+
+def test_all_votes_failing_raises(monkeypatch):
+    with pytest.raises(TimeoutError):
+        vote(monkeypatch, [None, None, None])
+
+def test_single_vote_has_no_agreement(monkeypatch):
+    assert "agreement" not in vote(monkeypatch, ["Yes"])